@@ -1,7 +1,539 @@
-from fastapi import APIRouter
+"""
+The API, on any app.store.StorageBackend. main.py serves it on the backend
+picked by STORAGE_BACKEND, the app package on its SQLAlchemy database
+(app.store.SqlAlchemyStore); ``settings`` is the Settings of either.
+"""
+import hmac
+import json
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
 
-from app.api.v1.endpoints import auth, chat
+from fastapi import APIRouter, Depends, FastAPI, Header, HTTPException, Query, Request, Response, WebSocket, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from jose import jwt
 
-api_router = APIRouter()
-api_router.include_router(auth.router, prefix="/auth", tags=["auth"])
-api_router.include_router(chat.router, prefix="/chat", tags=["chat"])
+from app.core.cache import ResponseCache, TokenCache, UserCache, etag, etag_matches
+from app.core.metrics import HTTP_CONDITIONAL_RESPONSES
+from app.core.ndjson import EXPORT_PAGE, MEDIA_TYPE, ImportFormatError, RecordReader, conversation_line, message_line
+from app.core.security import (
+    ALGORITHM, HashingBusyError, get_password_hash_async, pwd_context, verify_and_update_password_async,
+)
+from app.llm import ChatSockets, ContextWindows, GenerationBusyError, GenerationPool, GenerationTimeoutError, get_generator, sse_event
+from app.schemas.conversation import (
+    ChatRequest, ChatResponse, ConversationHistory, ConversationListResponse, ImportResult, SearchResponse,
+)
+from app.schemas.token import Token
+from app.schemas.user import User, UserCreate
+from app.store import DuplicateUserError, StorageBackend
+
+
+def create_access_token(settings: Any, data: dict, expires_delta: Optional[timedelta] = None) -> str:
+    to_encode = data.copy()
+    if expires_delta:
+        expire = datetime.utcnow() + expires_delta
+    else:
+        expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+    to_encode.update({"exp": expire})
+    return jwt.encode(to_encode, settings.SECRET_KEY, algorithm=ALGORITHM)
+
+
+def add_exception_handlers(app: FastAPI) -> None:
+    # Errors of the generation and hashing pools, raised by the routes below
+    @app.exception_handler(GenerationBusyError)
+    async def generation_busy(request: Request, exc: GenerationBusyError):
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"detail": "The assistant is busy, try again shortly"},
+            headers={"Retry-After": "1"},
+        )
+
+    @app.exception_handler(GenerationTimeoutError)
+    async def generation_timeout(request: Request, exc: GenerationTimeoutError):
+        return JSONResponse(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            content={"detail": "The assistant took too long to reply"},
+        )
+
+    @app.exception_handler(HashingBusyError)
+    async def hashing_busy(request: Request, exc: HashingBusyError):
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"detail": "Too many login requests, try again shortly"},
+            headers={"Retry-After": "1"},
+        )
+
+
+def create_api_router(store: StorageBackend, settings: Any) -> APIRouter:
+    """
+    The auth and chat routes on ``store``, with the caches and pools they
+    keep; mounted at ``settings.API_V1_STR``
+    """
+    api_router = APIRouter()
+    auth_router = APIRouter()
+    chat_router = APIRouter()
+
+    # Produces the assistant's replies, on a bounded pool of workers that
+    # shares identical generations and caches their results; see app.llm.pool
+    generation_pool = GenerationPool(
+        get_generator(
+            settings.RESPONSE_GENERATOR,
+            latency=settings.RESPONSE_LATENCY_MS / 1000,
+            delay=settings.RESPONSE_CHUNK_DELAY_MS / 1000,
+        ),
+        workers=settings.GENERATION_WORKERS,
+        queue_size=settings.GENERATION_QUEUE_SIZE,
+        timeout=settings.GENERATION_TIMEOUT_SECONDS,
+        cache_size=settings.GENERATION_CACHE_SIZE,
+        cache_ttl=settings.GENERATION_CACHE_TTL_SECONDS,
+    )
+
+    # What the replies are generated in: a rolling summary and the latest
+    # messages of each conversation, kept up to date turn by turn; see
+    # app.llm.context
+    context_windows = ContextWindows(
+        settings.CONTEXT_BUDGET,
+        unit=settings.CONTEXT_BUDGET_UNIT,
+        summary_chars=settings.CONTEXT_SUMMARY_CHARS,
+        maxsize=settings.CONTEXT_CACHE_SIZE,
+    )
+
+    # Authentication
+    oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/auth/login")
+
+    # Verified token claims, so a token sent on every request is only decoded
+    # and HMAC-checked once until it expires or is revoked. A shared store
+    # carries revocations to the other workers.
+    token_cache = TokenCache(
+        lambda token: jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM]),
+        maxsize=settings.TOKEN_CACHE_SIZE,
+        ttl=settings.TOKEN_CACHE_TTL_SECONDS,
+        shared=store if store.shared else None,
+        sync_interval=settings.REVOCATION_SYNC_SECONDS,
+    )
+
+    # The users seen by get_current_user, so most requests skip the store.
+    # Per process: a user deactivated elsewhere is only dropped once the TTL
+    # runs out.
+    user_cache = UserCache(maxsize=settings.USER_CACHE_SIZE, ttl=settings.USER_CACHE_TTL_SECONDS)
+
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+    def get_token_subject(token: str) -> int:
+        try:
+            payload = token_cache.decode(token)
+            user_id: str = payload.get("sub")
+            if user_id is None:
+                raise credentials_exception
+        except jwt.JWTError:
+            raise credentials_exception
+        return int(user_id)
+
+    def get_current_user(token: str = Depends(oauth2_scheme)):
+        user_id = get_token_subject(token)
+        user = user_cache.get(user_id)
+        if user is None:
+            user = store.get_user(user_id)
+            if user is None:
+                raise credentials_exception
+            user_cache.put(user_id, user)
+        return user
+
+    # Auth endpoints
+    def check_user_available(user: UserCreate):
+        # Check if username already exists
+        if store.get_user_by_username(user.username) is not None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Username already registered",
+            )
+
+        # Check if email already exists
+        if store.get_user_by_email(user.email) is not None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Email already registered",
+            )
+
+    @auth_router.post("/register", response_model=User)
+    async def register(user: UserCreate):
+        # Store calls stay in the threadpool, bcrypt runs on the hashing pool
+        await run_in_threadpool(check_user_available, user)
+
+        # Create new user; the store checks again in case a concurrent
+        # request registered the same name since the checks above
+        hashed_password = await get_password_hash_async(user.password)
+        try:
+            new_user = await run_in_threadpool(store.create_user, user.username, user.email, hashed_password)
+        except DuplicateUserError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"{e.field.capitalize()} already registered",
+            )
+
+        return {
+            "id": new_user["id"],
+            "username": user.username,
+            "email": user.email
+        }
+
+    async def check_password(password: str, stored: str) -> Tuple[bool, Optional[str]]:
+        # Whether the password matches, and a new hash to store if the stored
+        # one is outdated. Users registered before passwords were hashed have
+        # theirs in the clear until they next log in.
+        if pwd_context.identify(stored) is None:
+            if not hmac.compare_digest(password.encode(), stored.encode()):
+                return False, None
+            return True, await get_password_hash_async(password)
+        return await verify_and_update_password_async(password, stored)
+
+    @auth_router.post("/login", response_model=Token)
+    async def login(form_data: OAuth2PasswordRequestForm = Depends()):
+        # Find user by username
+        user = await run_in_threadpool(store.get_user_by_username, form_data.username)
+        user_id = str(user["id"]) if user else None
+
+        # Check credentials
+        valid, new_hash = (False, None)
+        if user:
+            valid, new_hash = await check_password(form_data.password, user["password"])
+        if not valid:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Incorrect username or password",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        if new_hash:
+            await run_in_threadpool(store.set_password, user["id"], new_hash)
+
+        # Create access token
+        access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+        access_token = create_access_token(
+            settings,
+            data={"sub": user_id},
+            expires_delta=access_token_expires
+        )
+
+        return {"access_token": access_token, "token_type": "bearer"}
+
+    @auth_router.get("/me", response_model=User)
+    def read_users_me(current_user: dict = Depends(get_current_user)):
+        return {
+            "id": current_user["id"],
+            "username": current_user["username"],
+            "email": current_user["email"]
+        }
+
+    @auth_router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+    def logout(token: str = Depends(oauth2_scheme), current_user: dict = Depends(get_current_user)):
+        # Revoke the current access token
+        token_cache.revoke(token)
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+    # Conversation lists and history pages, serialized, for the versions of
+    # the data they were built from
+    response_cache = ResponseCache(settings.RESPONSE_CACHE_MB * 1024 * 1024)
+
+    def conditional_json(
+        route: str, key: Hashable, version: str, if_none_match: Optional[str], build: Callable[[], Any]
+    ) -> Response:
+        # 304 if the client has this version already, otherwise the cached
+        # body or a new one. The version is read before the data, so a body
+        # is never stored under a version newer than its contents.
+        tag = etag(key, version)
+        headers = {"ETag": tag, "Cache-Control": "private, no-cache"}
+        if etag_matches(if_none_match, tag):
+            HTTP_CONDITIONAL_RESPONSES.inc(1, route, "not_modified")
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        body = response_cache.get(key, version)
+        if body is not None:
+            HTTP_CONDITIONAL_RESPONSES.inc(1, route, "cached")
+        else:
+            HTTP_CONDITIONAL_RESPONSES.inc(1, route, "built")
+            # Serialized like FastAPI's JSONResponse
+            body = json.dumps(build(), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            response_cache.set(key, version, body)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    # Chat endpoints
+    def get_or_create_conversation(chat_request: ChatRequest, current_user: dict) -> int:
+        if chat_request.conversation_id:
+            # Check if conversation exists and belongs to user
+            conversation = store.get_conversation(chat_request.conversation_id)
+            if conversation is not None and conversation["user_id"] == current_user["id"]:
+                return chat_request.conversation_id
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Conversation not found",
+            )
+
+        # Create a new conversation
+        title = chat_request.message[:30] + "..." if len(chat_request.message) > 30 else chat_request.message
+        conversation = store.create_conversation(user_id=current_user["id"], title=title)
+        return conversation["id"]
+
+    def messages_after(conversation_id: int, after: int) -> Iterator[Dict[str, Any]]:
+        # Oldest first, a page at a time
+        has_more = True
+        while has_more:
+            page, has_more = store.page_messages(conversation_id, EXPORT_PAGE, after=after)
+            yield from page
+            if page:
+                after = page[-1]["id"]
+
+    def turn_context(chat_request: ChatRequest, current_user: dict) -> List[Dict[str, str]]:
+        # The context the reply is generated in, from the conversation's
+        # cached window or else rebuilt from its stored summary
+        if not chat_request.conversation_id:
+            return []
+        conversation_id = get_or_create_conversation(chat_request, current_user)
+        last_id = None
+        if store.shared:
+            # Other workers add messages too
+            newest, _ = store.page_messages(conversation_id, 1)
+            last_id = newest[0]["id"] if newest else 0
+        context = context_windows.get(conversation_id, last_id)
+        if context is None:
+            summary, until = store.get_summary(conversation_id)
+            context, summary = context_windows.build(
+                conversation_id, summary, until, messages_after(conversation_id, until)
+            )
+            if summary is not None:
+                store.set_summary(conversation_id, *summary)
+        return context
+
+    def add_to_context(conversation_id: int, message: Dict[str, Any]):
+        summary = context_windows.append(conversation_id, [message])
+        if summary is not None:
+            store.set_summary(conversation_id, *summary)
+
+    def start_turn(chat_request: ChatRequest, current_user: dict) -> int:
+        conversation_id = get_or_create_conversation(chat_request, current_user)
+        add_to_context(conversation_id, store.append_message(conversation_id, "user", chat_request.message))
+        return conversation_id
+
+    def finish_turn(conversation_id: int, ai_response: str):
+        add_to_context(conversation_id, store.append_message(conversation_id, "assistant", ai_response))
+        store.touch_conversation(conversation_id)
+
+    @chat_router.post("/", response_model=ChatResponse)
+    async def chat(chat_request: ChatRequest, current_user: dict = Depends(get_current_user)):
+        # Store calls block, so they run in the threadpool; the reply is
+        # awaited on the generation pool without holding a thread. It is
+        # requested before anything is stored, so a 503 leaves no trace.
+        context = await run_in_threadpool(turn_context, chat_request, current_user)
+        reply = generation_pool.stream(chat_request.message, context)
+        conversation_id = await run_in_threadpool(start_turn, chat_request, current_user)
+
+        ai_response = "".join([chunk async for chunk in reply])
+
+        await run_in_threadpool(finish_turn, conversation_id, ai_response)
+
+        return {
+            "message": ai_response,
+            "conversation_id": conversation_id
+        }
+
+    @chat_router.post("/stream")
+    async def chat_stream(chat_request: ChatRequest, current_user: dict = Depends(get_current_user)):
+        # As in chat, and the user message is stored before streaming starts
+        context = await run_in_threadpool(turn_context, chat_request, current_user)
+        reply = generation_pool.stream(chat_request.message, context)
+        conversation_id = await run_in_threadpool(start_turn, chat_request, current_user)
+
+        async def event_stream():
+            yield sse_event({"conversation_id": conversation_id}, event="start")
+
+            chunks = []
+            try:
+                async for chunk in reply:
+                    chunks.append(chunk)
+                    yield sse_event({"token": chunk})
+            except GenerationTimeoutError as e:
+                # Too late for an error status; the reply is not stored
+                yield sse_event({"detail": str(e)}, event="error")
+                return
+
+            # Persist the assistant message once the whole reply is known
+            ai_response = "".join(chunks)
+            await run_in_threadpool(finish_turn, conversation_id, ai_response)
+
+            yield sse_event({"message": ai_response, "conversation_id": conversation_id}, event="done")
+
+        return StreamingResponse(
+            event_stream(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    def socket_turn_context(token: str, chat_request: ChatRequest, current_user: dict) -> List[Dict[str, str]]:
+        # The token is checked again, from the cache only, so that a logout
+        # or its expiry ends the connection
+        get_token_subject(token)
+        return turn_context(chat_request, current_user)
+
+    async def start_socket_turn(
+        token: str, current_user: dict, request: Dict[str, Any]
+    ) -> Tuple[int, AsyncIterator[str]]:
+        # As in chat_stream
+        chat_request = ChatRequest(**request)
+        context = await run_in_threadpool(socket_turn_context, token, chat_request, current_user)
+        reply = generation_pool.stream(chat_request.message, context)
+        conversation_id = await run_in_threadpool(start_turn, chat_request, current_user)
+        return conversation_id, reply
+
+    # Chat turns over WebSockets, each authenticated once; see app.llm.socket
+    chat_sockets = ChatSockets(
+        authenticate=lambda token: run_in_threadpool(get_current_user, token),
+        start_turn=start_socket_turn,
+        finish_turn=lambda conversation_id, ai_response: run_in_threadpool(finish_turn, conversation_id, ai_response),
+        heartbeat=settings.WS_HEARTBEAT_SECONDS,
+        idle_timeout=settings.WS_IDLE_TIMEOUT_SECONDS,
+        auth_timeout=settings.WS_AUTH_TIMEOUT_SECONDS,
+        send_timeout=settings.WS_SEND_TIMEOUT_SECONDS,
+        max_pending=settings.WS_MAX_PENDING_TURNS,
+        max_connections=settings.WS_MAX_CONNECTIONS,
+    )
+
+    @chat_router.websocket("/ws")
+    async def chat_socket(websocket: WebSocket):
+        await chat_sockets.serve(websocket)
+
+    @chat_router.get("/conversations", response_model=ConversationListResponse)
+    def get_conversations(
+        if_none_match: Optional[str] = Header(None),
+        current_user: dict = Depends(get_current_user),
+    ):
+        def build():
+            # Get all conversations for the current user, newest first
+            user_conversations = store.list_conversations(current_user["id"])
+            user_conversations = [
+                {
+                    "id": conv["id"],
+                    "title": conv["title"],
+                    "created_at": conv["created_at"]
+                }
+                for conv in user_conversations
+            ]
+
+            return {"conversations": user_conversations}
+
+        version = store.user_version(current_user["id"])
+        return conditional_json("conversations", ("conversations", current_user["id"]), version, if_none_match, build)
+
+    @chat_router.get("/history/{conversation_id}", response_model=ConversationHistory)
+    def get_conversation_history(
+        conversation_id: int,
+        limit: int = Query(settings.HISTORY_PAGE_SIZE, ge=1, le=settings.HISTORY_PAGE_MAX),
+        before: Optional[int] = None,
+        after: Optional[int] = None,
+        if_none_match: Optional[str] = Header(None),
+        current_user: dict = Depends(get_current_user),
+    ):
+        # Check if conversation exists and belongs to user
+        conversation = store.get_conversation(conversation_id)
+        if conversation is None or conversation["user_id"] != current_user["id"]:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Conversation not found",
+            )
+
+        def build():
+            # Get one page of messages, oldest first. Without cursors this is
+            # the newest page; pass the first id as `before` to load older
+            # messages.
+            page, has_more = store.page_messages(conversation_id, limit, before=before, after=after)
+            conversation_messages = [
+                {
+                    "id": msg["id"],
+                    "role": msg["role"],
+                    "content": msg["content"]
+                }
+                for msg in page
+            ]
+
+            return {"messages": conversation_messages, "has_more": has_more}
+
+        # The messages are only read if the client's copy is out of date
+        version = store.conversation_version(conversation_id)
+        key = ("history", conversation_id, limit, before, after)
+        return conditional_json("history", key, version, if_none_match, build)
+
+    @chat_router.get("/search", response_model=SearchResponse)
+    def search_conversations(
+        q: str = Query(..., min_length=1, max_length=200),
+        limit: int = Query(settings.SEARCH_RESULTS, ge=1, le=settings.SEARCH_RESULTS_MAX),
+        current_user: dict = Depends(get_current_user),
+    ):
+        # Conversations of the current user with messages containing every
+        # word of the query, best match first, each with up to three snippets
+        return {"results": store.search(current_user["id"], q, limit)}
+
+    def export_lines(user_id: int) -> Iterator[str]:
+        # Least recently updated first, so that importing the file recreates
+        # the list in the same order. Messages are read a page at a time.
+        for conversation in reversed(store.list_conversations(user_id)):
+            chunk = conversation_line(conversation)
+            after = 0
+            has_more = True
+            while has_more:
+                page, has_more = store.page_messages(conversation["id"], EXPORT_PAGE, after=after)
+                yield chunk + "".join(message_line(message) for message in page)
+                chunk = ""
+                if page:
+                    after = page[-1]["id"]
+
+    @chat_router.get("/export")
+    def export_conversations(current_user: dict = Depends(get_current_user)):
+        # Stream all the user's conversations and messages as NDJSON (see
+        # app.core.ndjson), without holding them in memory
+        return StreamingResponse(
+            export_lines(current_user["id"]),
+            media_type=MEDIA_TYPE,
+            headers={"Content-Disposition": 'attachment; filename="conversations.ndjson"'},
+        )
+
+    def import_batch(
+        user_id: int, records: List[Dict[str, Any]], conversation_ids: Dict[int, int], counts: Dict[str, int]
+    ):
+        # conversation_ids maps the ids in the file to the new ones
+        with store.batch():
+            for record in records:
+                if record["type"] == "conversation":
+                    conversation = store.create_conversation(user_id=user_id, title=record["title"])
+                    conversation_ids[record["id"]] = conversation["id"]
+                    counts["conversations"] += 1
+                else:
+                    store.append_message(conversation_ids[record["conversation_id"]], record["role"], record["content"])
+                    counts["messages"] += 1
+
+    @chat_router.post("/import", response_model=ImportResult)
+    async def import_conversations(request: Request, current_user: dict = Depends(get_current_user)):
+        # Read an export (NDJSON request body) as it arrives and write it as
+        # new conversations of the current user, one batch of records at a
+        # time
+        reader = RecordReader()
+        conversation_ids: Dict[int, int] = {}
+        counts = {"conversations": 0, "messages": 0}
+        try:
+            async for records in reader.batches(request.stream(), settings.IMPORT_BATCH_SIZE):
+                await run_in_threadpool(import_batch, current_user["id"], records, conversation_ids, counts)
+        except ImportFormatError as e:
+            # The batches before the bad line are kept
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid import at {e}; imported {counts['conversations']} conversations "
+                       f"and {counts['messages']} messages before it",
+            )
+        return counts
+
+    # Include routers
+    api_router.include_router(auth_router, prefix="/auth", tags=["auth"])
+    api_router.include_router(chat_router, prefix="/chat", tags=["chat"])
+    return api_router
@@ -0,0 +1,273 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from jose import JWTError
+
+
+class TTLCache:
+    """
+    Bounded LRU cache whose entries expire ``ttl`` seconds after insertion.
+
+    Thread-safe. ``hits`` and ``misses`` count lookups for inspection.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
+
+
+def token_key(token: str) -> bytes:
+    # Never keep raw bearer tokens around as cache keys
+    return hashlib.sha256(token.encode()).digest()
+
+
+class TokenRevokedError(JWTError):
+    """
+    Raised for a token that was explicitly revoked before it expired
+    """
+
+
+class TokenCache:
+    """
+    Verified JWT claims keyed by token hash.
+
+    ``decode`` must verify the signature and expiry and raise JWTError on
+    failure; its result is cached until the token's ``exp`` (or ``ttl``,
+    whichever comes first), so a hot token is only HMAC-verified once.
+    Expired tokens are never served from the cache, and revoked tokens are
+    rejected until they would have expired anyway.
+
+    Revocations live in this process unless ``shared`` is given: an object
+    with the ``revoke_token`` and ``revoked_tokens`` methods of
+    app.store.StorageBackend, used by every process serving the app.
+    Revocations are then published there and the ones made by other
+    processes are picked up at most ``sync_interval`` seconds later.
+    """
+
+    def __init__(
+        self,
+        decode: Callable[[str], Dict[str, Any]],
+        maxsize: int,
+        ttl: float,
+        shared: Any = None,
+        sync_interval: float = 1.0,
+    ):
+        self._decode = decode
+        self.claims = TTLCache(maxsize, ttl)
+        self._revoked: Dict[bytes, float] = {}
+        self._lock = threading.Lock()
+        self._shared = shared
+        self.sync_interval = sync_interval
+        self._cursor = 0
+        self._next_sync = 0.0
+        self._sync_lock = threading.Lock()
+
+    def decode(self, token: str) -> Dict[str, Any]:
+        if self._shared is not None and time.monotonic() >= self._next_sync:
+            self.sync()
+        key = token_key(token)
+        if key in self._revoked:
+            raise TokenRevokedError("Token has been revoked")
+
+        claims = self.claims.get(key)
+        exp = claims.get("exp") if claims is not None else None
+        if claims is None or (exp is not None and exp <= time.time()):
+            claims = self._decode(token)
+            exp = claims.get("exp")
+            self.claims.set(key, claims, None if exp is None else exp - time.time())
+        return claims
+
+    def revoke(self, token: str) -> None:
+        key = token_key(token)
+        claims = self.claims.get(key)
+        if claims is None:
+            try:
+                claims = self._decode(token)
+            except JWTError:
+                return  # Invalid or expired already
+        self.claims.pop(key)
+
+        expires_at = claims.get("exp") or float("inf")
+        self._add_revoked([(key, expires_at)])
+        if self._shared is not None:
+            self._shared.revoke_token(key, expires_at)
+
+    def sync(self) -> None:
+        """
+        Pick up the revocations other processes published to ``shared``
+        """
+        # One thread polls at a time; the others keep going
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            revoked, self._cursor = self._shared.revoked_tokens(self._cursor)
+            self._next_sync = time.monotonic() + self.sync_interval
+        finally:
+            self._sync_lock.release()
+        if revoked:
+            for key, _ in revoked:
+                self.claims.pop(key)
+            self._add_revoked(revoked)
+
+    def _add_revoked(self, revoked: List[Tuple[bytes, float]]) -> None:
+        now = time.time()
+        with self._lock:
+            # Forget revocations of tokens that have expired in the meantime
+            for revoked_key, expires_at in list(self._revoked.items()):
+                if expires_at <= now:
+                    del self._revoked[revoked_key]
+            self._revoked.update(revoked)
+
+    def stats(self) -> Dict[str, int]:
+        return {**self.claims.stats(), "revoked": len(self._revoked)}
+
+
+class UserCache:
+    """
+    Authenticated users keyed by user id.
+
+    A hit skips the database round trip. Records expire after ``ttl``
+    seconds and ``invalidate`` drops a user immediately when it is modified
+    or deactivated. The cache is per process, so changes made by another
+    process are only seen once the TTL runs out.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.users = TTLCache(maxsize, ttl)
+
+    def get(self, user_id: int) -> Any:
+        return self.users.get(user_id)
+
+    def put(self, user_id: int, record: Any) -> None:
+        self.users.set(user_id, record)
+
+    def invalidate(self, user_id: int) -> None:
+        self.users.pop(user_id)
+
+    def clear(self) -> None:
+        self.users.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return self.users.stats()
+
+
+def etag(*parts: Any) -> str:
+    """
+    Strong entity tag for the response identified by ``parts``, e.g. the
+    request's parameters and the version of the data it returns
+    """
+    return '"' + hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], tag: str) -> bool:
+    """
+    Whether an If-None-Match header lists ``tag`` (compared weakly, as
+    RFC 9110 requires for If-None-Match) or is ``*``
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == tag or candidate == "*":
+            return True
+    return False
+
+
+class ResponseCache:
+    """
+    Serialized response bodies, each stored with the version of the data
+    it was built from.
+
+    ``get`` only returns a body for the version asked for and drops one
+    built from an older version, so a body is never served after its data
+    changed. Least recently used bodies are evicted once their total size
+    exceeds ``max_bytes``. Thread-safe.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Tuple[str, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, version: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                if entry[0] == version:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._data[key]
+                self.bytes -= len(entry[1])
+            self.misses += 1
+            return None
+
+    def set(self, key: Hashable, version: str, body: bytes) -> None:
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= len(old[1])
+            self._data[key] = (version, body)
+            self.bytes += len(body)
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self.bytes -= len(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data), "bytes": self.bytes}
@@ -14,10 +14,80 @@ class Settings(BaseSettings):
     # Security
     SECRET_KEY: str = secrets.token_urlsafe(32)
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 7  # 7 days
+
+    # Verified tokens are cached until they expire (at most
+    # TOKEN_CACHE_TTL_SECONDS), authenticated users for USER_CACHE_TTL_SECONDS
+    TOKEN_CACHE_SIZE: int = 10000
+    TOKEN_CACHE_TTL_SECONDS: float = 900.0
+    USER_CACHE_SIZE: int = 10000
+    USER_CACHE_TTL_SECONDS: float = 60.0
+    # How soon the other workers reject a token after a logout
+    REVOCATION_SYNC_SECONDS: float = 1.0
+
+    # Password hashing. Stored hashes with a different cost are rehashed on
+    # the next successful login. Hashing runs on its own pool of
+    # HASHING_WORKERS ("thread" or "process"); once HASHING_QUEUE_SIZE more
+    # requests are waiting, further ones get a 503.
+    BCRYPT_ROUNDS: int = 12
+    HASHING_EXECUTOR: str = "thread"
+    HASHING_WORKERS: int = 4
+    HASHING_QUEUE_SIZE: int = 64
     
     # Database
     DATABASE_URL: str = "sqlite:///./app.db"
-    
+    # Combine the writes of concurrent requests into one transaction,
+    # waiting at most GROUP_COMMIT_WINDOW_MS for a batch to fill up
+    GROUP_COMMIT: bool = False
+    GROUP_COMMIT_WINDOW_MS: float = 2.0
+    GROUP_COMMIT_MAX_BATCH: int = 64
+
+    # Pagination
+    HISTORY_PAGE_SIZE: int = 50
+    HISTORY_PAGE_MAX: int = 200
+    # Conversations per search result
+    SEARCH_RESULTS: int = 20
+    SEARCH_RESULTS_MAX: int = 50
+    # Records of /chat/import written per transaction
+    IMPORT_BATCH_SIZE: int = 1000
+    # Serialized conversation lists and history pages kept in memory
+    RESPONSE_CACHE_MB: int = 32
+
+    # Assistant replies, see app.llm.generators.GENERATORS. The slow
+    # generator waits RESPONSE_LATENCY_MS before its first chunk and
+    # RESPONSE_CHUNK_DELAY_MS before each one.
+    RESPONSE_GENERATOR: str = "echo"
+    RESPONSE_LATENCY_MS: float = 0.0
+    RESPONSE_CHUNK_DELAY_MS: float = 50.0
+    # Generations run on a pool of GENERATION_WORKERS; once
+    # GENERATION_QUEUE_SIZE more are waiting, chat requests get a 503, and
+    # a reply not finished within GENERATION_TIMEOUT_SECONDS a 504. Replies
+    # are cached by context and prompt (GENERATION_CACHE_SIZE 0 disables).
+    GENERATION_WORKERS: int = 8
+    GENERATION_QUEUE_SIZE: int = 64
+    GENERATION_TIMEOUT_SECONDS: float = 60.0
+    GENERATION_CACHE_SIZE: int = 1000
+    GENERATION_CACHE_TTL_SECONDS: float = 3600.0
+    # Context of a reply: the latest messages within CONTEXT_BUDGET
+    # ("chars", or "tokens" estimated from them) and a rolling summary of
+    # the older ones, kept in memory for CONTEXT_CACHE_SIZE conversations
+    CONTEXT_BUDGET: int = 8000
+    CONTEXT_BUDGET_UNIT: str = "chars"
+    CONTEXT_SUMMARY_CHARS: int = 2000
+    CONTEXT_CACHE_SIZE: int = 2000
+    # Chat over WebSockets: connections open at once per worker, chat
+    # messages queued per connection, time between pings (a client silent
+    # for two is disconnected), and time allowed without a chat turn, to
+    # authenticate and to take a frame
+    WS_MAX_CONNECTIONS: int = 10000
+    WS_MAX_PENDING_TURNS: int = 4
+    WS_HEARTBEAT_SECONDS: float = 20.0
+    WS_IDLE_TIMEOUT_SECONDS: float = 600.0
+    WS_AUTH_TIMEOUT_SECONDS: float = 10.0
+    WS_SEND_TIMEOUT_SECONDS: float = 30.0
+
+    # Prometheus metrics at /metrics
+    METRICS_ENABLED: bool = True
+
     class Config:
         env_file = ".env"
 
@@ -0,0 +1,153 @@
+"""
+NDJSON format of /chat/export and /chat/import.
+
+One JSON object per line: each conversation, followed by its messages
+oldest first.
+
+    {"type": "conversation", "id": 1, "title": "Hello", "created_at": "...", "updated_at": "..."}
+    {"type": "message", "conversation_id": 1, "role": "user", "content": "Hello", "created_at": "..."}
+
+Ids only link the messages to their conversation within a file. An import
+creates new conversations and messages, with new ids and timestamps, for
+the importing user; conversations keep their title and messages their role,
+content and order. Timestamps are informational.
+"""
+import json
+from datetime import datetime
+from typing import Any, AsyncIterable, AsyncIterator, Dict, List, Optional, Set
+
+from app.store.records import ROLES
+
+MEDIA_TYPE = "application/x-ndjson"
+EXPORT_PAGE = 500  # messages read per query while exporting
+MAX_LINE_BYTES = 1024 * 1024
+
+Record = Dict[str, Any]
+
+
+class ImportFormatError(ValueError):
+    """
+    Raised for a line of an import that is not a valid record; ``line`` is
+    its number, counting from 1
+    """
+
+    def __init__(self, line: int, message: str):
+        super().__init__(f"line {line}: {message}")
+        self.line = line
+
+
+def conversation_line(conversation: Any) -> str:
+    # Records of the stores or SQLAlchemy rows
+    return _line({
+        "type": "conversation",
+        "id": conversation["id"],
+        "title": conversation["title"],
+        "created_at": _timestamp(conversation["created_at"]),
+        "updated_at": _timestamp(conversation["updated_at"]),
+    })
+
+
+def message_line(message: Any) -> str:
+    return _line({
+        "type": "message",
+        "conversation_id": message["conversation_id"],
+        "role": message["role"],
+        "content": message["content"],
+        "created_at": _timestamp(message["created_at"]),
+    })
+
+
+def _line(data: Record) -> str:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def _timestamp(value: Any) -> Optional[str]:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+class RecordReader:
+    """
+    Reads an NDJSON upload as it arrives and hands out its records in
+    batches, so memory use depends on the batch size rather than on the
+    size of the upload.
+
+    Every record is checked before its batch is handed out: messages must
+    follow their conversation and have one of the store's ROLES. Conversations come out as ``{type, id,
+    title}`` and messages as ``{type, conversation_id, role, content}``.
+    Raises ImportFormatError at the first invalid line; the batches before
+    it have been handed out already.
+    """
+
+    def __init__(self, max_line_bytes: int = MAX_LINE_BYTES):
+        self.max_line_bytes = max_line_bytes
+        self.line = 0
+        self._conversations: Set[int] = set()
+
+    async def batches(self, chunks: AsyncIterable[bytes], size: int) -> AsyncIterator[List[Record]]:
+        batch = []
+        async for line in self._lines(chunks):
+            self.line += 1
+            if not line.strip():
+                continue
+            batch.append(self.parse(line))
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    async def _lines(self, chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+        buffer = bytearray()
+        async for chunk in chunks:
+            buffer += chunk
+            start = 0
+            while True:
+                end = buffer.find(b"\n", start)
+                if end < 0:
+                    break
+                yield bytes(buffer[start:end])
+                start = end + 1
+            del buffer[:start]
+            if len(buffer) > self.max_line_bytes:
+                raise ImportFormatError(self.line + 1, f"longer than {self.max_line_bytes} bytes")
+        if buffer:
+            yield bytes(buffer)
+
+    def parse(self, line: bytes) -> Record:
+        if len(line) > self.max_line_bytes:
+            raise ImportFormatError(self.line, f"longer than {self.max_line_bytes} bytes")
+        try:
+            data = json.loads(line)
+        except ValueError:
+            raise ImportFormatError(self.line, "not valid JSON")
+        if not isinstance(data, dict):
+            raise ImportFormatError(self.line, "expected a JSON object")
+
+        kind = data.get("type")
+        if kind == "conversation":
+            conversation_id = self._field(data, "id", int)
+            if conversation_id in self._conversations:
+                raise ImportFormatError(self.line, f"conversation {conversation_id} appears twice")
+            self._conversations.add(conversation_id)
+            return {"type": kind, "id": conversation_id, "title": self._field(data, "title", str)}
+        if kind == "message":
+            conversation_id = self._field(data, "conversation_id", int)
+            if conversation_id not in self._conversations:
+                raise ImportFormatError(self.line, f"message of conversation {conversation_id} before the conversation")
+            role = self._field(data, "role", str)
+            if role not in ROLES:
+                raise ImportFormatError(self.line, f"'role' must be one of {', '.join(ROLES)}")
+            return {
+                "type": kind,
+                "conversation_id": conversation_id,
+                "role": role,
+                "content": self._field(data, "content", str),
+            }
+        raise ImportFormatError(self.line, f"unknown record type {kind!r}")
+
+    def _field(self, data: Record, name: str, kind: type) -> Any:
+        value = data.get(name)
+        # bool is an int too
+        if not isinstance(value, kind) or isinstance(value, bool):
+            raise ImportFormatError(self.line, f"{name!r} must be {'an integer' if kind is int else 'a string'}")
+        return value
@@ -0,0 +1,116 @@
+"""
+Full-text search over messages, shared by both apps.
+
+Text is split into words the way SQLite's FTS5 ``unicode61`` tokenizer
+with ``remove_diacritics 2`` does: runs of letters and digits, case-folded
+and without accents. The ``app`` package and main.py's sqlite backend
+query the ``messages_fts`` table (migration 4) with SEARCH_SQL; main.py's
+other backends keep an inverted index in memory (app.store.search). Both
+rank messages by BM25, match messages that contain every word of the query
+and group the matches by conversation.
+
+Results are ``{conversation_id, title, score, matches}`` with up to
+MATCHES_PER_CONVERSATION ``{message_id, role, snippet}`` per conversation,
+best first. Snippets are plain text.
+"""
+import re
+import unicodedata
+from typing import Any, Callable, Dict, Iterable, List, Mapping
+
+WORD = re.compile(r"[^\W_]+")
+
+# Words around the first match in a snippet
+SNIPPET_WORDS = 12
+ELLIPSIS = "…"
+
+MATCHES_PER_CONVERSATION = 3
+# Best ranked messages considered per query before they are grouped
+MAX_HITS = 200
+
+# The messages of one user matching every term, best first. The owner
+# column holds "u<user id>" so the match only walks that user's rows, and
+# the table's rank is bm25 over the content column only (migration 4).
+SEARCH_SQL = """
+SELECT m.id AS message_id, m.conversation_id AS conversation_id, m.role AS role,
+       c.title AS title, -messages_fts.rank AS score,
+       snippet(messages_fts, 0, '', '', '…', 12) AS snippet
+FROM messages_fts
+JOIN messages m ON m.id = messages_fts.rowid
+JOIN conversations c ON c.id = m.conversation_id
+WHERE messages_fts MATCH :match
+ORDER BY messages_fts.rank
+LIMIT :limit
+"""
+
+
+def normalize(text: str) -> str:
+    text = text.casefold()
+    if text.isascii():
+        return text
+    return "".join(ch for ch in unicodedata.normalize("NFKD", text) if not unicodedata.combining(ch))
+
+
+def tokenize(text: str) -> List[str]:
+    return WORD.findall(normalize(text))
+
+
+def query_terms(query: str) -> List[str]:
+    # Each word once, in order
+    return list(dict.fromkeys(tokenize(query)))
+
+
+def fts_match(user_id: int, terms: List[str]) -> str:
+    # Terms only hold letters and digits, so quoting them is enough to
+    # keep FTS5 from reading them as operators
+    return " AND ".join([f'owner : "u{user_id}"'] + [f'content : "{term}"' for term in terms])
+
+
+def snippet(content: str, terms: Iterable[str]) -> str:
+    """
+    About SNIPPET_WORDS words of ``content`` around the first word that
+    matches one of ``terms``
+    """
+    terms = set(terms)
+    words = list(WORD.finditer(content))
+    if not words:
+        return content
+    first = next((i for i, word in enumerate(words) if normalize(word.group()) in terms), 0)
+    start = max(0, min(first - SNIPPET_WORDS // 4, len(words) - SNIPPET_WORDS))
+    end = min(len(words), start + SNIPPET_WORDS)
+    # Keep the text before the first and after the last word when they are included
+    begin = words[start].start() if start > 0 else 0
+    finish = words[end - 1].end() if end < len(words) else len(content)
+    return (ELLIPSIS if start > 0 else "") + content[begin:finish] + (ELLIPSIS if end < len(words) else "")
+
+
+def group_hits(hits: Iterable[Mapping[str, Any]], limit: int) -> List[List[Mapping[str, Any]]]:
+    """
+    Group message hits (best first, each with a ``conversation_id``) into
+    at most ``limit`` conversations, best first, of at most
+    MATCHES_PER_CONVERSATION hits each
+    """
+    groups: Dict[int, List[Mapping[str, Any]]] = {}
+    for hit in hits:
+        group = groups.get(hit["conversation_id"])
+        if group is None:
+            if len(groups) == limit:
+                continue
+            group = groups[hit["conversation_id"]] = []
+        if len(group) < MATCHES_PER_CONVERSATION:
+            group.append(hit)
+    return list(groups.values())
+
+
+def search_result(title: str, hits: List[Mapping[str, Any]], snippet_of: Callable[[Mapping], str]) -> Dict[str, Any]:
+    """
+    The result for one conversation's group of hits; a conversation
+    scores as its best message
+    """
+    return {
+        "conversation_id": hits[0]["conversation_id"],
+        "title": title,
+        "score": hits[0]["score"],
+        "matches": [
+            {"message_id": hit["message_id"], "role": hit["role"], "snippet": snippet_of(hit)} for hit in hits
+        ],
+    }
@@ -1,14 +1,29 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Any, Optional, Union
+from typing import Any, Callable, Optional, Tuple, Union
 
 from jose import jwt
 from passlib.context import CryptContext
 from app.core.config import settings
+from app.core.metrics import registry
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes made with a different cost than BCRYPT_ROUNDS are flagged for
+# update by verify_and_update, so they are rehashed on the next login
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS
+)
 
 ALGORITHM = "HS256"
 
+PASSWORD_HASHING_SECONDS = registry.histogram(
+    "password_hashing_duration_seconds",
+    "bcrypt time per hash or verification, excluding time queued",
+    ("operation",),
+)
+
 
 def create_access_token(
     subject: Union[str, Any], expires_delta: Optional[timedelta] = None
@@ -28,5 +43,97 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+def verify_and_update_password(
+    plain_password: str, hashed_password: str
+) -> Tuple[bool, Optional[str]]:
+    """
+    Verify a password and return a new hash if the stored one is outdated
+    """
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
+
+
+def timed_call(fn: Callable[..., Any], *args: Any) -> Tuple[float, Any]:
+    # Module level so it can be sent to a process pool; the duration is
+    # returned rather than recorded because the worker may be another process
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+class HashingBusyError(Exception):
+    """
+    Raised when the hashing queue is full
+    """
+
+
+class HashingExecutor:
+    """
+    Runs bcrypt on a dedicated pool so bursts of logins and registrations
+    cannot occupy the request threadpool or the event loop.
+
+    At most ``workers`` hashes run at once and ``queue_size`` more may wait;
+    beyond that ``run`` fails immediately with HashingBusyError instead of
+    letting requests pile up behind slow hashes. bcrypt releases the GIL,
+    so a thread pool is usually enough; a process pool is also available.
+    """
+
+    def __init__(self, workers: int, queue_size: int, kind: str = "thread"):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.kind = kind
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.kind == "process":
+                        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                    else:
+                        self._executor = ThreadPoolExecutor(
+                            max_workers=self.workers, thread_name_prefix="hashing"
+                        )
+        return self._executor
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusyError()
+        try:
+            future = self._get_executor().submit(timed_call, fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        elapsed, result = await asyncio.wrap_future(future)
+        PASSWORD_HASHING_SECONDS.observe(elapsed, fn.__name__)
+        return result
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+hashing_executor = HashingExecutor(
+    workers=settings.HASHING_WORKERS,
+    queue_size=settings.HASHING_QUEUE_SIZE,
+    kind=settings.HASHING_EXECUTOR,
+)
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await hashing_executor.run(get_password_hash, password)
+
+
+async def verify_and_update_password_async(
+    plain_password: str, hashed_password: str
+) -> Tuple[bool, Optional[str]]:
+    return await hashing_executor.run(
+        verify_and_update_password, plain_password, hashed_password
+    )
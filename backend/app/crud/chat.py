@@ -0,0 +1,83 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import Select, select, text, update
+from sqlalchemy.orm import Session
+
+from app.core.search import MAX_HITS, SEARCH_SQL, fts_match, group_hits, query_terms, search_result
+from app.models.conversation import Conversation
+from app.models.message import Message
+
+
+def touch_conversation(db: Session, conversation_id: int) -> None:
+    # Set from Python, in UTC with microseconds like the creation times, so
+    # that the list order holds within a second
+    db.execute(
+        update(Conversation)
+        .where(Conversation.id == conversation_id)
+        .values(updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+
+
+# Queries behind the conversation list and history endpoints, run by
+# app.store.SqlAlchemyStore and checked by benchmarks/explain_queries.py
+
+def conversation_list_query(user_id: int) -> Select:
+    # Served by ix_conversations_user_id_updated_at
+    return select(Conversation).where(
+        Conversation.user_id == user_id
+    ).order_by(Conversation.updated_at.desc())
+
+
+def history_page_query(
+    conversation_id: int,
+    limit: int,
+    before: Optional[int] = None,
+    after: Optional[int] = None,
+) -> Select:
+    """
+    Keyset pagination on (conversation_id, id), served by
+    ix_messages_conversation_id_id.
+
+    Selects ``limit + 1`` rows so the caller can tell whether there are
+    more. Rows come back newest first, unless only ``after`` is given, in
+    which case they come back oldest first (paging forward).
+    """
+    query = select(Message).where(Message.conversation_id == conversation_id)
+    if before is not None:
+        query = query.where(Message.id < before)
+    if after is not None:
+        query = query.where(Message.id > after)
+
+    order = Message.id.asc() if is_forward_page(before, after) else Message.id.desc()
+    return query.order_by(order).limit(limit + 1)
+
+
+def is_forward_page(before: Optional[int], after: Optional[int]) -> bool:
+    return after is not None and before is None
+
+
+def save_summary(db: Session, conversation_id: int, summary: str, until: int) -> None:
+    """
+    Store a conversation's summary without committing
+    """
+    db.execute(
+        update(Conversation)
+        .where(Conversation.id == conversation_id)
+        .values(summary=summary, summary_until=until)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def search_conversations(db: Session, user_id: int, query: str, limit: int) -> List[Dict[str, Any]]:
+    """
+    The user's conversations with messages that contain every word of
+    ``query``, ranked by the best matching message, from the
+    ``messages_fts`` table (see app.core.search)
+    """
+    terms = query_terms(query)
+    if not terms:
+        return []
+    hits = db.execute(text(SEARCH_SQL), {"match": fts_match(user_id, terms), "limit": MAX_HITS}).mappings().all()
+    return [search_result(group[0]["title"], group, lambda hit: hit["snippet"]) for group in group_hits(hits, limit)]
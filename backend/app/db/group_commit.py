@@ -0,0 +1,92 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Tuple
+
+from sqlalchemy.orm import Session, sessionmaker
+
+WriteJob = Tuple[Callable[..., Any], tuple, Future]
+
+
+class GroupCommitWriter:
+    """
+    Runs write jobs from many requests in one transaction.
+
+    ``submit(fn, *args)`` queues ``fn(session, *args)`` and returns a Future.
+    A single writer thread waits up to ``window`` seconds (or until
+    ``max_batch`` jobs are queued), runs every job in one session and
+    commits once, so concurrent chat turns share a single fsync. If the
+    batch fails, each job is retried in its own transaction so one bad
+    write does not fail the others. Jobs should return plain values, not
+    ORM objects, since the session is closed before the Future resolves.
+    """
+
+    def __init__(self, session_factory: sessionmaker, window: float = 0.002, max_batch: int = 64):
+        self.session_factory = session_factory
+        self.window = window
+        self.max_batch = max_batch
+        self._queue: "queue.Queue[WriteJob]" = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, fn: Callable[..., Any], *args: Any) -> Future:
+        if self._thread is None:
+            self._start()
+        future: Future = Future()
+        self._queue.put((fn, args, future))
+        return future
+
+    def _start(self) -> None:
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="group-commit-writer", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._commit(batch)
+
+    def _commit(self, batch: List[WriteJob]) -> None:
+        db: Session = self.session_factory()
+        try:
+            results = [fn(db, *args) for fn, args, _ in batch]
+            db.commit()
+        except Exception:
+            db.rollback()
+            results = None
+        finally:
+            db.close()
+
+        if results is None:
+            for job in batch:
+                self._commit_one(job)
+            return
+        for (_, _, future), result in zip(batch, results):
+            future.set_result(result)
+
+    def _commit_one(self, job: WriteJob) -> None:
+        fn, args, future = job
+        db: Session = self.session_factory()
+        try:
+            result = fn(db, *args)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+        finally:
+            db.close()
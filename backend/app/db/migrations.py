@@ -0,0 +1,173 @@
+"""
+Versioned schema migrations.
+
+Each migration is a numbered list of SQL statements. ``migrate`` records
+applied versions in the ``schema_migrations`` table and runs the pending
+ones in order, each in its own transaction, so it is safe to run on every
+startup and on databases created before migrations existed.
+
+Apply to the configured database with:
+    python -m app.db.migrations
+"""
+from datetime import datetime
+from typing import List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+Migration = Tuple[int, str, List[str]]
+
+MIGRATIONS: List[Migration] = [
+    (1, "initial schema", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER NOT NULL,
+            username VARCHAR,
+            email VARCHAR,
+            hashed_password VARCHAR,
+            is_active BOOLEAN,
+            PRIMARY KEY (id)
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_username ON users (username)",
+        "CREATE INDEX IF NOT EXISTS ix_users_id ON users (id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_users_email ON users (email)",
+        """
+        CREATE TABLE IF NOT EXISTS conversations (
+            id INTEGER NOT NULL,
+            title VARCHAR,
+            user_id INTEGER,
+            created_at DATETIME DEFAULT (CURRENT_TIMESTAMP),
+            updated_at DATETIME,
+            PRIMARY KEY (id),
+            FOREIGN KEY(user_id) REFERENCES users (id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_conversations_id ON conversations (id)",
+        """
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER NOT NULL,
+            content TEXT,
+            role VARCHAR,
+            conversation_id INTEGER,
+            created_at DATETIME DEFAULT (CURRENT_TIMESTAMP),
+            PRIMARY KEY (id),
+            FOREIGN KEY(conversation_id) REFERENCES conversations (id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_messages_id ON messages (id)",
+    ]),
+    (2, "indexes for conversation list and history", [
+        # Conversations used to get updated_at only when edited; give the
+        # old rows a value so the list is ordered sensibly
+        "UPDATE conversations SET updated_at = created_at WHERE updated_at IS NULL",
+        "CREATE INDEX IF NOT EXISTS ix_conversations_user_id_updated_at "
+        "ON conversations (user_id, updated_at DESC)",
+        "CREATE INDEX IF NOT EXISTS ix_messages_conversation_id_id "
+        "ON messages (conversation_id, id)",
+    ]),
+    (3, "revoked tokens shared between workers", [
+        # AUTOINCREMENT so that ids are never reused and work as a cursor
+        """
+        CREATE TABLE IF NOT EXISTS revoked_tokens (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            token_hash BLOB NOT NULL UNIQUE,
+            expires_at REAL NOT NULL
+        )
+        """,
+    ]),
+    (4, "full-text search over messages", [
+        # FTS5 reads the indexed text back from this view (for snippets)
+        # instead of keeping a second copy. owner ("u<user id>") lets a
+        # query match only the rows of one user.
+        """
+        CREATE VIEW IF NOT EXISTS messages_search AS
+        SELECT m.id AS id, m.content AS content, 'u' || c.user_id AS owner
+        FROM messages m JOIN conversations c ON c.id = m.conversation_id
+        """,
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            content, owner,
+            content='messages_search', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        # Rank by BM25 over the content column only
+        "INSERT INTO messages_fts (messages_fts, rank) VALUES ('rank', 'bm25(1.0, 0.0)')",
+        """
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, content, owner)
+            SELECT new.id, new.content, 'u' || user_id FROM conversations WHERE id = new.conversation_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content, owner)
+            SELECT 'delete', old.id, old.content, 'u' || user_id FROM conversations WHERE id = old.conversation_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content, owner)
+            SELECT 'delete', old.id, old.content, 'u' || user_id FROM conversations WHERE id = old.conversation_id;
+            INSERT INTO messages_fts (rowid, content, owner)
+            SELECT new.id, new.content, 'u' || user_id FROM conversations WHERE id = new.conversation_id;
+        END
+        """,
+        # Index the messages that already exist
+        "INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')",
+    ]),
+    (5, "rolling summaries of older messages for the context window", [
+        # summary_until is the id of the newest message the summary covers
+        "ALTER TABLE conversations ADD COLUMN summary TEXT NOT NULL DEFAULT ''",
+        "ALTER TABLE conversations ADD COLUMN summary_until INTEGER NOT NULL DEFAULT 0",
+    ]),
+]
+
+
+def applied_versions(connection: Connection) -> List[int]:
+    connection.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, name VARCHAR, applied_at DATETIME)"
+    ))
+    rows = connection.execute(text("SELECT version FROM schema_migrations"))
+    return sorted(row[0] for row in rows)
+
+
+def migrate(connection: Connection) -> List[int]:
+    """
+    Apply pending migrations on ``connection``; returns the versions applied.
+
+    Works with ``AsyncConnection.run_sync`` as well.
+    """
+    done = set(applied_versions(connection))
+    connection.commit()
+
+    applied = []
+    for version, name, statements in MIGRATIONS:
+        if version in done:
+            continue
+        with connection.begin():
+            for statement in statements:
+                connection.execute(text(statement))
+            connection.execute(
+                text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+                {"v": version, "n": name, "t": datetime.utcnow()},
+            )
+        applied.append(version)
+    return applied
+
+
+def migrate_engine(engine: Engine) -> List[int]:
+    with engine.connect() as connection:
+        return migrate(connection)
+
+
+if __name__ == "__main__":
+    from app.db.database import engine
+
+    versions = migrate_engine(engine)
+    if versions:
+        print(f"Applied migrations: {', '.join(map(str, versions))}")
+    else:
+        print("Database is up to date")
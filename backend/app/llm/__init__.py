@@ -0,0 +1,7 @@
+from app.llm.context import ContextWindows, fold_summary
+from app.llm.generators import (
+    ResponseGenerator, EchoGenerator, SlowGenerator, get_generator
+)
+from app.llm.pool import GenerationBusyError, GenerationCancelledError, GenerationPool, GenerationTimeoutError
+from app.llm.socket import ChatSockets
+from app.llm.sse import sse_event
@@ -0,0 +1,216 @@
+"""
+Per-conversation context windows: what a reply is generated in.
+
+A window is a rolling summary of a conversation's older messages followed
+by its latest messages, as many as fit in a budget of characters or
+(estimated) tokens. Windows are kept in an LRU cache and updated as
+messages are added, so the context of a turn is assembled without reading
+the conversation's history.
+
+Once the messages exceed the budget, the oldest are folded into the
+summary until they fill TRIM_TO of it, so the summary changes every few
+turns rather than every turn. The caller stores it then (``dirty``), with
+the id of the newest message it covers. After an eviction or a restart a
+window is rebuilt lazily from the stored summary and the messages after
+it, which the budget keeps few. Each message is folded into the summary
+once, so assembling a context costs O(1) amortized instead of O(history).
+
+Contexts are lists of ``{"role", "content"}``, the summary first as a
+"system" message.
+"""
+import threading
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.store.base import Record
+
+# Messages are folded into the summary until they fill this share of the
+# budget
+TRIM_TO = 0.75
+
+SUMMARY_LINE_CHARS = 200  # of each folded message
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+# A summary to store: its text and the id of the newest message it covers
+Summary = Tuple[str, int]
+
+
+def estimate_tokens(text: str) -> int:
+    # About four characters per token for English text with common
+    # tokenizers; close enough for a budget
+    return len(text) // 4 + 1
+
+
+MEASURES: Dict[str, Callable[[str], int]] = {
+    "chars": len,
+    "tokens": estimate_tokens,
+}
+
+
+def fold_summary(summary: str, messages: Sequence[Record], max_chars: int) -> str:
+    """
+    Add one line per message (its role and the start of its content) to
+    ``summary``, keeping the newest lines within ``max_chars``
+    """
+    lines = [summary] if summary else []
+    for message in messages:
+        content = " ".join(message["content"].split())
+        if len(content) > SUMMARY_LINE_CHARS:
+            content = content[:SUMMARY_LINE_CHARS - 3] + "..."
+        lines.append(f"{message['role']}: {content}")
+    summary = "\n".join(lines)
+    if len(summary) > max_chars:
+        summary = summary[-max_chars:]
+        # Drop the partial line at the start
+        summary = summary[summary.find("\n") + 1:] if "\n" in summary else summary
+    return summary
+
+
+class ContextWindow:
+    """
+    Summary and latest messages of one conversation. ``last_id`` is the id
+    of the newest message seen; ``dirty`` is set when the summary changed
+    since it was last stored.
+    """
+
+    __slots__ = ("summary", "summary_until", "messages", "size", "last_id", "dirty")
+
+    def __init__(self, summary: str, summary_until: int):
+        self.summary = summary
+        self.summary_until = summary_until
+        # (id, size, {"role", "content"}), oldest first
+        self.messages: Deque[Tuple[int, int, Dict[str, str]]] = deque()
+        self.size = 0
+        self.last_id = summary_until
+        self.dirty = False
+
+    def context(self) -> List[Dict[str, str]]:
+        context = [{"role": "system", "content": SUMMARY_PREFIX + self.summary}] if self.summary else []
+        context.extend(message for _, _, message in self.messages)
+        return context
+
+    def take_summary(self) -> Optional[Summary]:
+        if not self.dirty:
+            return None
+        self.dirty = False
+        return self.summary, self.summary_until
+
+
+class ContextWindows:
+    """
+    LRU cache of up to ``maxsize`` ContextWindows, keyed by conversation
+    id, each holding messages worth at most ``budget`` in ``unit`` ("chars"
+    or "tokens") and a summary of at most ``summary_chars``. ``summarize``
+    folds messages into a summary, like fold_summary. Thread-safe.
+    """
+
+    def __init__(
+        self,
+        budget: int,
+        unit: str = "chars",
+        summary_chars: int = 2000,
+        maxsize: int = 2000,
+        summarize: Callable[[str, Sequence[Record], int], str] = fold_summary,
+    ):
+        if unit not in MEASURES:
+            raise ValueError(f"Unknown context budget unit {unit!r}; expected one of {', '.join(MEASURES)}")
+        self.budget = budget
+        self.measure = MEASURES[unit]
+        self.summary_chars = summary_chars
+        self.maxsize = maxsize
+        self.summarize = summarize
+        self.hits = 0
+        self.misses = 0
+        self._windows: "OrderedDict[int, ContextWindow]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, conversation_id: int, last_id: Optional[int] = None) -> Optional[List[Dict[str, str]]]:
+        """
+        Context of the cached window of a conversation, or None if there is
+        none. Pass the id of the newest stored message as ``last_id`` when
+        other processes may add messages: a window without it is dropped.
+        """
+        with self._lock:
+            window = self._windows.get(conversation_id)
+            if window is not None and last_id is not None and window.last_id != last_id:
+                del self._windows[conversation_id]
+                window = None
+            if window is None:
+                self.misses += 1
+                return None
+            self._windows.move_to_end(conversation_id)
+            self.hits += 1
+            return window.context()
+
+    def build(
+        self, conversation_id: int, summary: str, summary_until: int, messages: Iterable[Record]
+    ) -> Tuple[List[Dict[str, str]], Optional[Summary]]:
+        """
+        Cache the window made of a stored summary and the messages after
+        it, oldest first. Returns its context, and the summary to store if
+        some of the messages had to be folded into it.
+        """
+        window = ContextWindow(summary, summary_until)
+        for message in messages:
+            self._add(window, message)
+        with self._lock:
+            cached = self._windows.get(conversation_id)
+            # Built by another thread alongside, and newer already
+            if cached is None or cached.last_id < window.last_id:
+                self._windows[conversation_id] = window
+            self._windows.move_to_end(conversation_id)
+            while len(self._windows) > self.maxsize:
+                self._windows.popitem(last=False)
+            return window.context(), window.take_summary()
+
+    def append(self, conversation_id: int, messages: Sequence[Record]) -> Optional[Summary]:
+        """
+        Add new messages (``{id, role, content}``) to the cached window of
+        their conversation, if there is one. Returns the summary to store
+        if it changed. A window that missed a message, e.g. because two
+        turns of a conversation were written at once, is dropped to be
+        rebuilt.
+        """
+        with self._lock:
+            window = self._windows.get(conversation_id)
+            if window is None:
+                return None
+            for message in messages:
+                if message["id"] <= window.last_id:
+                    del self._windows[conversation_id]
+                    return None
+                self._add(window, message)
+            return window.take_summary()
+
+    def discard(self, conversation_id: int) -> None:
+        with self._lock:
+            self._windows.pop(conversation_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._windows.clear()
+
+    def _add(self, window: ContextWindow, message: Record) -> None:
+        size = self.measure(message["content"])
+        window.messages.append((message["id"], size, {"role": message["role"], "content": message["content"]}))
+        window.size += size
+        window.last_id = message["id"]
+        if window.size <= self.budget:
+            return
+
+        # Fold the oldest, but never the newest message
+        folded = []
+        while window.size > self.budget * TRIM_TO and len(window.messages) > 1:
+            message_id, size, folded_message = window.messages.popleft()
+            window.size -= size
+            folded.append(folded_message)
+            window.summary_until = message_id
+        if folded:
+            window.summary = self.summarize(window.summary, folded, self.summary_chars)
+            window.dirty = True
+
+    def __len__(self) -> int:
+        return len(self._windows)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._windows)}
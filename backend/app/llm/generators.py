@@ -0,0 +1,71 @@
+import asyncio
+from typing import AsyncIterator, Callable, Dict, Sequence
+
+# Earlier messages of the conversation, oldest first, as {"role", "content"}
+Context = Sequence[Dict[str, str]]
+
+
+class ResponseGenerator:
+    """
+    Produces an assistant reply to ``message`` as an async stream of text
+    chunks, given the ``context`` of the conversation so far.
+
+    Implementations must not block the event loop; a worker holding many
+    slow generations only spends a coroutine, not a thread, on each. They
+    are run through app.llm.pool.GenerationPool, which bounds and times
+    them out and may cancel them.
+    """
+
+    async def generate(self, message: str, context: Context = ()) -> AsyncIterator[str]:
+        raise NotImplementedError
+        yield  # pragma: no cover
+
+
+class EchoGenerator(ResponseGenerator):
+    """
+    Echoes the user's message back, one word per chunk
+    """
+
+    async def generate(self, message: str, context: Context = ()) -> AsyncIterator[str]:
+        reply = f"You said: {message}"
+        words = reply.split(" ")
+        for i, word in enumerate(words):
+            yield word if i == len(words) - 1 else word + " "
+            await asyncio.sleep(0)
+
+
+class SlowGenerator(EchoGenerator):
+    """
+    Echo generator that waits ``latency`` seconds before the first chunk
+    and ``delay`` seconds before every chunk, to simulate a model offline
+    in tests and benchmarks
+    """
+
+    def __init__(self, latency: float = 0.0, delay: float = 0.05):
+        self.latency = latency
+        self.delay = delay
+        self.calls = 0
+
+    async def generate(self, message: str, context: Context = ()) -> AsyncIterator[str]:
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        async for chunk in super().generate(message, context):
+            await asyncio.sleep(self.delay)
+            yield chunk
+
+
+# Factories take the simulated ``latency`` and per-chunk ``delay``, in
+# seconds, which only the slow generator uses
+GENERATORS: Dict[str, Callable[[float, float], ResponseGenerator]] = {
+    "echo": lambda latency, delay: EchoGenerator(),
+    "slow": SlowGenerator,
+}
+
+
+def get_generator(name: str, latency: float = 0.0, delay: float = 0.05) -> ResponseGenerator:
+    try:
+        factory = GENERATORS[name]
+    except KeyError:
+        raise ValueError(f"Unknown response generator: {name}")
+    return factory(latency, delay)
@@ -0,0 +1,227 @@
+"""
+Runs the assistant's generations for the chat endpoints.
+
+Every reply goes through a GenerationPool, which
+
+- runs at most ``workers`` generations at once and lets ``queue_size``
+  more wait for a worker; a request that would need another one fails
+  with GenerationBusyError,
+- fails a generation that is not finished ``timeout`` seconds after it
+  was requested with GenerationTimeoutError,
+- shares one generation between all the requests for the same prompt in
+  the same context while it runs, and cancels it when none of them is
+  reading it any more (e.g. every client disconnected),
+- keeps finished replies in an LRU cache keyed by a hash of the context
+  and the prompt.
+
+Only use a pool from the event loop that serves the app.
+"""
+import asyncio
+import hashlib
+import json
+import time
+from typing import AsyncIterator, Dict, List, Optional, Sequence
+
+from app.core.cache import TTLCache
+from app.core.metrics import registry
+from app.llm.generators import Context, ResponseGenerator
+
+LLM_REPLIES = registry.counter(
+    "llm_replies_total",
+    "Replies by outcome: generated, timeout, cancelled or error per generation; coalesced, cached or busy per request",
+    ("result",),
+)
+LLM_GENERATION_SECONDS = registry.histogram(
+    "llm_generation_duration_seconds", "Time from requesting a generation to its last chunk, including time queued",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+LLM_GENERATIONS_IN_PROGRESS = registry.gauge(
+    "llm_generations_in_progress", "Generations running or waiting for a worker"
+)
+
+
+class GenerationBusyError(Exception):
+    """
+    Raised when every worker is busy and the queue is full
+    """
+
+
+class GenerationTimeoutError(Exception):
+    """
+    Raised to every reader of a generation that ran out of time
+    """
+
+
+class GenerationCancelledError(Exception):
+    """
+    Raised to any reader left on a generation that was cancelled, so its
+    partial reply is never taken for a whole one
+    """
+
+
+def prompt_key(message: str, context: Context) -> bytes:
+    # Only roles and contents count, so the same exchange in two
+    # conversations shares a generation and a cache entry
+    payload = json.dumps([[m["role"], m["content"]] for m in context] + [message], ensure_ascii=False)
+    return hashlib.blake2b(payload.encode(), digest_size=16).digest()
+
+
+class Generation:
+    """
+    Chunks of one reply as they are produced, for any number of readers
+    """
+
+    def __init__(self, key: bytes):
+        self.key = key
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.readers = 0
+        self.cancelled = False
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def add(self, chunk: str) -> None:
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        self.done = True
+        self.error = error
+        self._notify()
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def reader(self) -> AsyncIterator[str]:
+        """
+        A new reader, counted from now rather than from its first read: the
+        generation is only cancelled once every reader has stopped. A reader
+        that is never read from keeps it running until it finishes.
+        """
+        self.readers += 1
+        return self._follow()
+
+    async def _follow(self) -> AsyncIterator[str]:
+        # Every chunk from the first, then the ones still to come
+        try:
+            sent = 0
+            while True:
+                changed = self._changed
+                while sent < len(self.chunks):
+                    yield self.chunks[sent]
+                    sent += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await changed.wait()
+        finally:
+            self.readers -= 1
+            if self.readers == 0 and not self.done and self.task is not None:
+                self.cancelled = True
+                self.task.cancel()
+
+
+class GenerationPool:
+    """
+    Bounded, coalescing and caching front of a ResponseGenerator; see the
+    module docstring. ``cache_size`` 0 disables the cache.
+    """
+
+    def __init__(
+        self,
+        generator: ResponseGenerator,
+        workers: int,
+        queue_size: int,
+        timeout: float,
+        cache_size: int,
+        cache_ttl: float,
+    ):
+        self.generator = generator
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.cache = TTLCache(cache_size, cache_ttl) if cache_size > 0 else None
+        self._in_flight: Dict[bytes, Generation] = {}
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def stream(self, message: str, context: Context = ()) -> AsyncIterator[str]:
+        """
+        The reply to ``message`` in ``context``, chunk by chunk.
+
+        Admission happens here, before the first chunk is read, so
+        GenerationBusyError can still be turned into an error response;
+        GenerationTimeoutError and the generator's own errors are raised
+        while reading.
+        """
+        key = prompt_key(message, context)
+        if self.cache is not None:
+            chunks = self.cache.get(key)
+            if chunks is not None:
+                LLM_REPLIES.inc(1, "cached")
+                return self._replay(chunks)
+
+        generation = self._in_flight.get(key)
+        if generation is not None and not generation.cancelled:
+            LLM_REPLIES.inc(1, "coalesced")
+            return generation.reader()
+
+        if generation is None and len(self._in_flight) >= self.workers + self.queue_size:
+            LLM_REPLIES.inc(1, "busy")
+            raise GenerationBusyError()
+        generation = self._in_flight[key] = Generation(key)
+        generation.task = asyncio.get_running_loop().create_task(self._run(generation, message, context))
+        return generation.reader()
+
+    async def complete(self, message: str, context: Context = ()) -> str:
+        """
+        The whole reply to ``message`` in ``context``
+        """
+        return "".join([chunk async for chunk in self.stream(message, context)])
+
+    async def _replay(self, chunks: Sequence[str]) -> AsyncIterator[str]:
+        for chunk in chunks:
+            yield chunk
+
+    async def _run(self, generation: Generation, message: str, context: Context) -> None:
+        LLM_GENERATIONS_IN_PROGRESS.inc()
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._generate(generation, message, context), self.timeout)
+        except asyncio.TimeoutError:
+            LLM_REPLIES.inc(1, "timeout")
+            generation.finish(GenerationTimeoutError(f"No reply within {self.timeout:g}s"))
+        except asyncio.CancelledError:
+            # Nobody is reading any more, and nobody joins a cancelled generation
+            LLM_REPLIES.inc(1, "cancelled")
+            generation.finish(GenerationCancelledError("The generation was cancelled"))
+            raise
+        except Exception as e:
+            LLM_REPLIES.inc(1, "error")
+            generation.finish(e)
+        else:
+            LLM_REPLIES.inc(1, "generated")
+            LLM_GENERATION_SECONDS.observe(time.perf_counter() - start)
+            if self.cache is not None:
+                self.cache.set(generation.key, tuple(generation.chunks))
+            generation.finish()
+        finally:
+            LLM_GENERATIONS_IN_PROGRESS.dec()
+            # A cancelled generation may have been replaced already
+            if self._in_flight.get(generation.key) is generation:
+                del self._in_flight[generation.key]
+
+    async def _generate(self, generation: Generation, message: str, context: Context) -> None:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        async with self._slots:
+            async for chunk in self.generator.generate(message, context):
+                generation.add(chunk)
+
+    def stats(self) -> Dict[str, int]:
+        stats = {"in_flight": len(self._in_flight)}
+        if self.cache is not None:
+            stats.update({f"cache_{name}": value for name, value in self.cache.stats().items()})
+        return stats
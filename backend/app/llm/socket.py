@@ -0,0 +1,329 @@
+"""
+Chat over a WebSocket: the connection is authenticated once, then carries
+any number of chat turns and their streamed replies, without the per
+request CORS, token and user checks of the REST endpoints.
+
+One JSON object per text frame, each with a ``type``:
+
+- ``auth`` {token} from the client, first and within ``auth_timeout``;
+  answered by ``ready``. Browsers cannot set headers on a WebSocket, and a
+  token in the URL would end up in access logs.
+- ``chat`` {message, conversation_id, id} from the client, one turn. Turns
+  run one at a time, in order, and up to ``max_pending`` more can wait; the
+  reply is ``start`` {conversation_id}, ``token`` {token}... and ``done``
+  {message, conversation_id}. Each of them carries the ``id`` of the chat
+  message, if it had one.
+- ``error`` {status, detail} from the server, with the status the REST
+  endpoints would have answered with, and the ``id`` of the chat message
+  it is about if any; the connection stays open. A chat message rejected
+  because too many are waiting gets its error at once, possibly in the
+  middle of another turn's reply.
+- ``ping`` from the server every ``heartbeat`` seconds, answered by a
+  ``pong``.
+
+Frames are sent one at a time and each send waits for the transport, so a
+slow client slows down only its own turns: the chunks generated meanwhile
+go out together in the next ``token`` frame. A client that takes longer
+than ``send_timeout`` to accept a frame, that sends nothing, not even a
+pong, for two heartbeats, or that runs no turn for ``idle_timeout``, is
+disconnected.
+"""
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, WebSocket, status
+from pydantic import ValidationError
+
+from app.core.metrics import registry
+from app.llm.pool import GenerationBusyError, GenerationTimeoutError
+
+WS_CONNECTIONS = registry.gauge("websocket_connections", "Open chat WebSocket connections")
+WS_CLOSED = registry.counter(
+    "websocket_connections_closed_total",
+    "Chat WebSocket connections closed, by reason: disconnected, unauthenticated, idle, unresponsive, slow, full or error",
+    ("reason",),
+)
+WS_TURNS = registry.counter("websocket_turns_total", "Chat turns over WebSockets by outcome", ("result",))
+
+# Close codes by reason, for the closes the server initiates
+CLOSE_CODES = {
+    "unauthenticated": status.WS_1008_POLICY_VIOLATION,
+    "idle": status.WS_1000_NORMAL_CLOSURE,
+    "unresponsive": status.WS_1001_GOING_AWAY,
+    "slow": status.WS_1001_GOING_AWAY,
+    "full": status.WS_1013_TRY_AGAIN_LATER,
+    "error": status.WS_1011_INTERNAL_ERROR,
+}
+
+# token -> user; raises HTTPException
+Authenticate = Callable[[str], Awaitable[Any]]
+# (token, user, chat frame) -> (conversation id, reply chunks); raises
+# HTTPException, ValidationError or GenerationBusyError
+StartTurn = Callable[[str, Any, Dict[str, Any]], Awaitable[Tuple[int, AsyncIterator[str]]]]
+# (conversation id, whole reply)
+FinishTurn = Callable[[int, str], Awaitable[None]]
+
+
+class SocketClosed(Exception):
+    """
+    Raised inside a connection to end it, with the reason it ends
+    """
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+async def batches(chunks: AsyncIterator[str]) -> AsyncIterator[List[str]]:
+    """
+    The chunks of a reply, as lists of the ones that came in while the
+    previous list was being handled
+    """
+    pending: List[str] = []
+    ready = asyncio.Event()
+    finished = False
+    error: Optional[BaseException] = None
+
+    async def pump() -> None:
+        nonlocal finished, error
+        try:
+            async for chunk in chunks:
+                pending.append(chunk)
+                ready.set()
+        except Exception as e:
+            error = e
+        finally:
+            finished = True
+            ready.set()
+
+    # Cancelling it stops reading the reply, like a disconnected client
+    task = asyncio.get_running_loop().create_task(pump())
+    try:
+        while True:
+            await ready.wait()
+            ready.clear()
+            if pending:
+                batch = pending[:]
+                pending.clear()
+                yield batch
+            if finished and not pending:
+                if error is not None:
+                    raise error
+                return
+    finally:
+        task.cancel()
+
+
+class ChatSockets:
+    """
+    Serves the chat WebSockets of an app, with its own ``authenticate``,
+    ``start_turn`` and ``finish_turn``; see the module docstring. At most
+    ``max_connections`` are open at once, further ones are refused.
+    """
+
+    def __init__(
+        self,
+        authenticate: Authenticate,
+        start_turn: StartTurn,
+        finish_turn: FinishTurn,
+        heartbeat: float,
+        idle_timeout: float,
+        auth_timeout: float,
+        send_timeout: float,
+        max_pending: int,
+        max_connections: int,
+    ):
+        self.authenticate = authenticate
+        self.start_turn = start_turn
+        self.finish_turn = finish_turn
+        self.heartbeat = heartbeat
+        self.idle_timeout = idle_timeout
+        self.auth_timeout = auth_timeout
+        self.send_timeout = send_timeout
+        self.max_pending = max_pending
+        self.max_connections = max_connections
+        self.open = 0
+
+    async def serve(self, websocket: WebSocket) -> None:
+        if self.open >= self.max_connections:
+            # Before the handshake, so the client gets a 403
+            WS_CLOSED.inc(1, "full")
+            await websocket.close(CLOSE_CODES["full"])
+            return
+
+        await websocket.accept()
+        self.open += 1
+        WS_CONNECTIONS.inc()
+        reason = "error"
+        try:
+            reason = await ChatSocket(self, websocket).run()
+        finally:
+            self.open -= 1
+            WS_CONNECTIONS.dec()
+            WS_CLOSED.inc(1, reason)
+            if reason in CLOSE_CODES:
+                try:
+                    await asyncio.wait_for(websocket.close(CLOSE_CODES[reason], reason.capitalize()), self.send_timeout)
+                except Exception:
+                    pass  # Gone already
+
+    def stats(self) -> Dict[str, int]:
+        return {"open": self.open}
+
+
+class ChatSocket:
+    """
+    One connection of ChatSockets
+    """
+
+    def __init__(self, sockets: ChatSockets, websocket: WebSocket):
+        self.sockets = sockets
+        self.websocket = websocket
+        self.token = ""
+        self.user: Any = None
+        self.busy = False
+        self.last_received = self.last_turn = time.monotonic()
+        self._send_lock = asyncio.Lock()
+
+    async def run(self) -> str:
+        """
+        Serve the connection until it ends; returns why it did
+        """
+        try:
+            await asyncio.wait_for(self.authenticate(), self.sockets.auth_timeout)
+        except asyncio.TimeoutError:
+            return "unauthenticated"
+        except SocketClosed as e:
+            return e.reason
+
+        turns: asyncio.Queue = asyncio.Queue(self.sockets.max_pending)
+        tasks = [asyncio.ensure_future(coro) for coro in (self.read(turns), self.run_turns(turns), self.keep_alive())]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        error = done.pop().exception()
+        if isinstance(error, SocketClosed):
+            return error.reason
+        raise error
+
+    async def authenticate(self) -> None:
+        frame = await self.receive()
+        token = frame.get("token") if frame is not None and frame.get("type") == "auth" else None
+        if not isinstance(token, str):
+            raise SocketClosed("unauthenticated")
+        try:
+            self.user = await self.sockets.authenticate(token)
+        except HTTPException:
+            raise SocketClosed("unauthenticated")
+        self.token = token
+        await self.send({"type": "ready"})
+
+    async def read(self, turns: asyncio.Queue) -> None:
+        while True:
+            frame = await self.receive()
+            kind = frame.get("type") if frame is not None else None
+            if kind == "pong":
+                continue
+            if kind != "chat":
+                await self.send_error(status.HTTP_400_BAD_REQUEST, "Expected a chat or pong message")
+                continue
+            try:
+                turns.put_nowait(frame)
+            except asyncio.QueueFull:
+                WS_TURNS.inc(1, "rejected")
+                await self.send_error(
+                    status.HTTP_429_TOO_MANY_REQUESTS, "Too many messages waiting for a reply", frame.get("id")
+                )
+
+    async def run_turns(self, turns: asyncio.Queue) -> None:
+        while True:
+            frame = await turns.get()
+            self.busy = True
+            try:
+                await self.turn(frame)
+            finally:
+                self.busy = False
+                self.last_turn = time.monotonic()
+
+    async def turn(self, frame: Dict[str, Any]) -> None:
+        ref = frame.get("id")
+        try:
+            conversation_id, reply = await self.sockets.start_turn(self.token, self.user, frame)
+        except ValidationError as e:
+            WS_TURNS.inc(1, "invalid")
+            await self.send_error(status.HTTP_422_UNPROCESSABLE_ENTITY, e.errors(), ref)
+            return
+        except GenerationBusyError:
+            WS_TURNS.inc(1, "busy")
+            await self.send_error(status.HTTP_503_SERVICE_UNAVAILABLE, "The assistant is busy, try again shortly", ref)
+            return
+        except HTTPException as e:
+            WS_TURNS.inc(1, "error")
+            await self.send_error(e.status_code, e.detail, ref)
+            if e.status_code == status.HTTP_401_UNAUTHORIZED:
+                # Logged out or expired since the connection was opened
+                raise SocketClosed("unauthenticated")
+            return
+
+        await self.send({"type": "start", "conversation_id": conversation_id}, ref)
+        chunks: List[str] = []
+        try:
+            async for batch in batches(reply):
+                chunks.extend(batch)
+                await self.send({"type": "token", "token": "".join(batch)}, ref)
+        except GenerationTimeoutError as e:
+            # The reply is not stored, as with the REST endpoints
+            WS_TURNS.inc(1, "timeout")
+            await self.send_error(status.HTTP_504_GATEWAY_TIMEOUT, str(e), ref)
+            return
+
+        ai_response = "".join(chunks)
+        await self.sockets.finish_turn(conversation_id, ai_response)
+        WS_TURNS.inc(1, "done")
+        await self.send({"type": "done", "message": ai_response, "conversation_id": conversation_id}, ref)
+
+    async def keep_alive(self) -> None:
+        heartbeat = self.sockets.heartbeat
+        while True:
+            await asyncio.sleep(heartbeat)
+            now = time.monotonic()
+            if now - self.last_received > 2 * heartbeat:
+                raise SocketClosed("unresponsive")
+            if not self.busy and now - self.last_turn > self.sockets.idle_timeout:
+                raise SocketClosed("idle")
+            await self.send({"type": "ping"})
+
+    async def receive(self) -> Optional[Dict[str, Any]]:
+        """
+        The next frame, or None if it is not a JSON object
+        """
+        message = await self.websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise SocketClosed("disconnected")
+        self.last_received = time.monotonic()
+        try:
+            frame = json.loads(message.get("text") or message.get("bytes") or "")
+        except ValueError:
+            return None
+        return frame if isinstance(frame, dict) else None
+
+    async def send(self, frame: Dict[str, Any], ref: Any = None) -> None:
+        if ref is not None:
+            frame["id"] = ref
+        text = json.dumps(frame, ensure_ascii=False, separators=(",", ":"))
+        async with self._send_lock:
+            try:
+                await asyncio.wait_for(self.websocket.send_text(text), self.sockets.send_timeout)
+            except asyncio.TimeoutError:
+                raise SocketClosed("slow")
+            except Exception:
+                # The transport's own error for a closed connection
+                raise SocketClosed("disconnected")
+
+    async def send_error(self, status_code: int, detail: Any, ref: Any = None) -> None:
+        await self.send({"type": "error", "status": status_code, "detail": detail}, ref)
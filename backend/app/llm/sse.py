@@ -0,0 +1,12 @@
+import json
+from typing import Any, Optional
+
+
+def sse_event(data: Any, event: Optional[str] = None) -> str:
+    """
+    Format one Server-Sent Event with a JSON payload
+    """
+    payload = json.dumps(data, separators=(",", ":"))
+    if event:
+        return f"event: {event}\ndata: {payload}\n\n"
+    return f"data: {payload}\n\n"
@@ -0,0 +1,60 @@
+from fastapi import FastAPI
+from fastapi.middleware.cors import CORSMiddleware
+
+from app.api.v1.api import add_exception_handlers, create_api_router
+from app.core.config import settings
+from app.core.metrics import MetricsMiddleware, metrics_response
+from app.core.security import hashing_executor
+from app.db.database import engine
+from app.store import SqlAlchemyStore
+
+
+def create_app() -> FastAPI:
+    application = FastAPI(
+        title=settings.PROJECT_NAME,
+        openapi_url=f"{settings.API_V1_STR}/openapi.json"
+    )
+
+    application.add_middleware(
+        CORSMiddleware,
+        allow_origins=settings.CORS_ORIGINS,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["ETag"],
+    )
+
+    if settings.METRICS_ENABLED:
+        application.add_middleware(MetricsMiddleware)
+
+        @application.get("/metrics", include_in_schema=False)
+        def metrics():
+            return metrics_response()
+
+    # main.py's API, on the database at DATABASE_URL
+    store = SqlAlchemyStore(
+        engine,
+        group_commit=settings.GROUP_COMMIT,
+        window=settings.GROUP_COMMIT_WINDOW_MS / 1000,
+        max_batch=settings.GROUP_COMMIT_MAX_BATCH,
+    )
+    application.include_router(create_api_router(store, settings), prefix=settings.API_V1_STR)
+    add_exception_handlers(application)
+
+    @application.on_event("startup")
+    def apply_migrations():
+        store.load()
+
+    @application.on_event("shutdown")
+    def close_store():
+        store.close()
+        hashing_executor.shutdown()
+
+    @application.get("/")
+    def root():
+        return {"message": "Welcome to AI Assistant API"}
+
+    return application
+
+
+app = create_app()
@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index, Text
+from sqlalchemy.orm import deferred, relationship
 from sqlalchemy.sql import func
 
 from app.db.database import Base
@@ -13,7 +13,19 @@ class Conversation(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    # Rolling summary of the older messages (see app.llm.context), only
+    # loaded when asked for, and the id of the newest message it covers
+    summary = deferred(Column(Text, nullable=False, server_default=""))
+    summary_until = Column(Integer, nullable=False, server_default="0")
     
     # Relationships
     user = relationship("User", back_populates="conversations")
     messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan")
+
+
+# Conversation list, newest first
+Index(
+    "ix_conversations_user_id_updated_at",
+    Conversation.user_id,
+    Conversation.updated_at.desc(),
+)
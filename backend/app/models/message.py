@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Text
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index, Text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 
@@ -16,3 +16,9 @@ class Message(Base):
     
     # Relationships
     conversation = relationship("Conversation", back_populates="messages")
+
+    __table_args__ = (
+        # History is paged by (conversation_id, id); ids are assigned in
+        # creation order so this is also created_at order
+        Index("ix_messages_conversation_id_id", "conversation_id", "id"),
+    )
@@ -2,5 +2,6 @@ from app.schemas.user import User, UserCreate, UserUpdate, UserInDB
 from app.schemas.token import Token, TokenPayload
 from app.schemas.conversation import (
     Conversation, ConversationCreate, ConversationUpdate, ConversationList,
+    ConversationListResponse, ConversationHistory, HistoryMessage,
     Message, MessageCreate, ChatRequest, ChatResponse
 )
@@ -53,6 +53,44 @@ class ConversationList(BaseModel):
         orm_mode = True
 
 
+class ConversationListResponse(BaseModel):
+    conversations: List[ConversationList]
+
+
+class HistoryMessage(MessageBase):
+    id: int
+
+    class Config:
+        orm_mode = True
+
+
+class ConversationHistory(BaseModel):
+    messages: List[HistoryMessage]
+    has_more: bool
+
+
+class SearchMatch(BaseModel):
+    message_id: int
+    role: str
+    snippet: str
+
+
+class SearchResult(BaseModel):
+    conversation_id: int
+    title: str
+    score: float
+    matches: List[SearchMatch]
+
+
+class SearchResponse(BaseModel):
+    results: List[SearchResult]
+
+
+class ImportResult(BaseModel):
+    conversations: int
+    messages: int
+
+
 class ChatRequest(BaseModel):
     message: str
     conversation_id: Optional[int] = None
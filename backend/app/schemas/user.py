@@ -25,8 +25,11 @@ class UserInDBBase(UserBase):
         orm_mode = True
 
 
-class User(UserInDBBase):
-    pass
+class User(UserBase):
+    id: int
+
+    class Config:
+        orm_mode = True
 
 
 class UserInDB(UserInDBBase):
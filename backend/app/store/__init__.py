@@ -0,0 +1,57 @@
+import os
+from typing import Optional
+
+from sqlalchemy import create_engine
+
+from app.store.base import DuplicateUserError, Record, StorageBackend
+from app.store.durability import DURABILITY_MODES, Flusher
+from app.store.journal import Journal
+from app.store.json_store import JsonStore
+from app.store.locking import StoreLockedError
+from app.store.memory import MemoryStore
+from app.store.sharded import ShardedStore
+from app.store.sqlalchemy_store import SqlAlchemyStore
+from app.store.sqlite_store import SqliteStore
+
+STORAGE_BACKENDS = ("memory", "json", "sharded", "sqlite", "sqlalchemy")
+
+
+def create_store(
+    kind: str,
+    data_dir: str,
+    sqlite_path: Optional[str] = None,
+    compact_every: int = 10000,
+    cache_bytes: int = 256 * 1024 * 1024,
+    durability: str = "sync",
+    flush_interval: float = 0.05,
+    flush_every: int = 1000,
+    pool_size: int = 8,
+    search_index: bool = False,
+    database_url: Optional[str] = None,
+) -> StorageBackend:
+    """
+    Build the storage backend named ``kind`` (one of STORAGE_BACKENDS).
+    ``durability`` is one of DURABILITY_MODES; the memory backend ignores it.
+    ``pool_size`` bounds the SQLite connections of the process.
+    ``search_index`` keeps the sharded backend's search index in memory.
+    The sqlalchemy backend opens ``database_url``, by default the SQLite
+    file the sqlite backend would use; it ignores ``durability``.
+    """
+    flush = {"durability": durability, "flush_interval": flush_interval, "flush_every": flush_every}
+    if kind == "memory":
+        return MemoryStore()
+    if kind == "json":
+        return JsonStore(data_dir, compact_every=compact_every, **flush)
+    if kind == "sharded":
+        return ShardedStore(
+            data_dir, compact_every=compact_every, cache_bytes=cache_bytes, search_index=search_index, **flush
+        )
+    sqlite_path = sqlite_path or os.path.join(data_dir, "chat.db")
+    if kind == "sqlite":
+        return SqliteStore(sqlite_path, durability=durability, pool_size=pool_size)
+    if kind == "sqlalchemy":
+        engine = create_engine(database_url or f"sqlite:///{sqlite_path}", connect_args={"check_same_thread": False})
+        return SqlAlchemyStore(engine)
+    raise ValueError(
+        f"Unknown storage backend {kind!r}; expected one of {', '.join(STORAGE_BACKENDS)}"
+    )
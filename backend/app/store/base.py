@@ -0,0 +1,186 @@
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+Record = Dict[str, Any]
+
+
+class DuplicateUserError(Exception):
+    """
+    Raised by create_user when the username or email (``field``) is taken
+    """
+
+    def __init__(self, field: str):
+        super().__init__(f"{field} already registered")
+        self.field = field
+
+
+class StorageBackend:
+    """
+    Storage for users, conversations and messages behind the API of
+    app.api.v1.api, whose one set of routes runs on any implementation:
+    main.py's pick of STORAGE_BACKEND, or the app package's database.
+
+    Records are plain dicts shaped like the JSON files:
+    users ``{id, username, email, password}``, conversations
+    ``{id, title, user_id, created_at, updated_at}`` and messages
+    ``{id, content, role, conversation_id, created_at}``, with ISO 8601
+    timestamps. Message ids increase in insertion order.
+
+    Backends are safe to call from many threads at once: ids are never
+    handed out twice and concurrent writes are never lost. Backends with
+    ``shared`` set are also safe to use from several processes at once.
+    """
+
+    # Whether several processes (e.g. uvicorn workers) can share the data
+    shared = False
+
+    def load(self) -> None:
+        """
+        Open the backend and load or recover any persisted state
+        """
+
+    def save(self) -> int:
+        """
+        Write a full snapshot, for backends that keep one; returns the
+        number of bytes written
+        """
+        return 0
+
+    def close(self) -> None:
+        """
+        Flush and release resources
+        """
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """
+        Group the writes this thread makes in the block, for bulk loads:
+        they are made durable together when it ends instead of one by one
+        """
+        yield
+
+    # Token revocations, for processes that share the backend
+
+    def revoke_token(self, token_hash: bytes, expires_at: float) -> None:
+        """
+        Record that the token with this hash is revoked until ``expires_at``
+        (a Unix time); a no-op for backends that are not ``shared``
+        """
+
+    def revoked_tokens(self, after: int = 0) -> Tuple[List[Tuple[bytes, float]], int]:
+        """
+        The ``(token_hash, expires_at)`` revocations recorded since cursor
+        ``after`` that have not expired yet, and the cursor to pass next time
+        """
+        return [], after
+
+    # Users
+
+    def get_user(self, user_id: int) -> Optional[Record]:
+        raise NotImplementedError
+
+    def get_user_by_username(self, username: str) -> Optional[Record]:
+        raise NotImplementedError
+
+    def get_user_by_email(self, email: str) -> Optional[Record]:
+        raise NotImplementedError
+
+    def create_user(self, username: str, email: str, password: str) -> Record:
+        """
+        ``password`` is a hash from app.core.security, which is what the
+        app package's users table holds too. Raises DuplicateUserError if
+        the username or email is taken.
+        """
+        raise NotImplementedError
+
+    def set_password(self, user_id: int, password: str) -> None:
+        """
+        Replace the password hash of a user
+        """
+        raise NotImplementedError
+
+    # Conversations
+
+    def get_conversation(self, conversation_id: int) -> Optional[Record]:
+        raise NotImplementedError
+
+    def create_conversation(self, user_id: int, title: str) -> Record:
+        raise NotImplementedError
+
+    def list_conversations(self, user_id: int) -> List[Record]:
+        """
+        The user's conversations, most recently updated first
+        """
+        raise NotImplementedError
+
+    def touch_conversation(self, conversation_id: int) -> None:
+        raise NotImplementedError
+
+    def get_summary(self, conversation_id: int) -> Tuple[str, int]:
+        """
+        The stored rolling summary of a conversation's older messages (see
+        app.llm.context) and the id of the newest message it covers;
+        ``("", 0)`` when there is none
+        """
+        raise NotImplementedError
+
+    def set_summary(self, conversation_id: int, summary: str, until: int) -> None:
+        raise NotImplementedError
+
+    # Messages
+
+    def append_message(self, conversation_id: int, role: str, content: str) -> Record:
+        """
+        Add a message to a conversation. Raises ValueError, before anything
+        is stored, if ``role`` is not one of app.store.records.ROLES.
+        """
+        raise NotImplementedError
+
+    def list_messages(self, conversation_id: int) -> List[Record]:
+        """
+        Messages of a conversation in the order they were appended
+        """
+        raise NotImplementedError
+
+    def page_messages(
+        self,
+        conversation_id: int,
+        limit: int,
+        before: Optional[int] = None,
+        after: Optional[int] = None,
+    ) -> Tuple[List[Record], bool]:
+        """
+        One page of a conversation's messages, oldest first.
+
+        Only messages with ids strictly between ``after`` and ``before`` are
+        considered. With only ``after`` set the page is the oldest ``limit``
+        of them (paging forward); otherwise it is the newest ``limit``
+        (paging backward from the end or from ``before``). The flag tells
+        whether more messages exist past the page in that direction.
+        """
+        raise NotImplementedError
+
+    # Search
+
+    def search(self, user_id: int, query: str, limit: int) -> List[Record]:
+        """
+        The user's conversations with messages that contain every word of
+        ``query``, best match first, shaped as described in app.core.search
+        """
+        raise NotImplementedError
+
+    # Versions, for conditional requests
+
+    def user_version(self, user_id: int) -> str:
+        """
+        Opaque token that changes whenever the user's conversation list
+        does: a conversation is created or updated
+        """
+        raise NotImplementedError
+
+    def conversation_version(self, conversation_id: int) -> str:
+        """
+        Opaque token that changes whenever a message is added to the
+        conversation; must not read the messages themselves
+        """
+        raise NotImplementedError
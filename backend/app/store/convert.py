@@ -0,0 +1,42 @@
+"""
+Convert a data directory to the current layout of its backend up front,
+instead of on the first start of the server: the older users.json,
+conversations.json and messages.json files (and, for ``sharded``, a
+snapshot written by ``json``) are loaded and written out as the backend
+stores them.
+
+Usage (from the backend directory, with the server stopped):
+    python -m app.store.convert <data dir> [--backend sharded|json]
+
+The backend defaults to STORAGE_BACKEND, as for main.py.
+"""
+import argparse
+import os
+
+from app.store import create_store
+
+# The backends that read the older JSON files
+CONVERTIBLE_BACKENDS = ("sharded", "json")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("data_dir", nargs="?", default=".")
+    parser.add_argument(
+        "--backend", default=os.environ.get("STORAGE_BACKEND", "sharded"),
+        help=f"one of {', '.join(CONVERTIBLE_BACKENDS)}; defaults to STORAGE_BACKEND",
+    )
+    args = parser.parse_args()
+    if args.backend not in CONVERTIBLE_BACKENDS:
+        parser.error(f"the {args.backend} backend does not read the JSON files")
+
+    store = create_store(args.backend, args.data_dir)
+    # Loading the sharded backend splits the messages into segments
+    store.load()
+    size = store.save()
+    store.close()
+    print(f"Wrote {store.snapshot_file} ({size} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+Durability modes for the files the stores append to.
+
+- ``sync``: every append is fsynced before the write is acknowledged.
+  Nothing that was acknowledged is lost, even on power loss. Writers
+  that wait at the same time share one fsync (group commit).
+- ``batched``: appends are written to the OS before they return and a
+  background thread fsyncs them every ``interval`` seconds, or as soon as
+  ``max_pending`` appends are waiting. A crash of the process loses
+  nothing; a power loss or OS crash loses at most the last ``interval``
+  (or ``max_pending`` appends).
+- ``async``: appends are queued in memory and written and fsynced by the
+  background thread on the same schedule. A crash of the process or of
+  the machine loses the appends still queued, at most the last
+  ``interval`` (or ``max_pending`` appends) under normal load, more if
+  the disk falls behind.
+
+A crash can leave a torn last line in a file. Readers skip it, and it is
+cut off before the file is appended to again.
+"""
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import IO, Iterator, List, Optional, Set, Tuple
+
+from app.store.metrics import STORAGE_FSYNCS
+
+DURABILITY_MODES = ("sync", "batched", "async")
+
+# Append handles kept open between writes
+MAX_OPEN_FILES = 128
+
+
+def truncate_torn_line(path: str) -> bool:
+    """
+    Cut off a last line that a crash left without its newline, so that the
+    next append starts a line of its own; returns whether anything was cut
+    """
+    with open(path, "rb+") as f:
+        end = position = f.seek(0, os.SEEK_END)
+        while position > 0:
+            start = max(0, position - 65536)
+            f.seek(start)
+            newline = f.read(position - start).rfind(b"\n")
+            if newline >= 0:
+                position = start + newline + 1
+                break
+            position = start
+        if position == end:
+            return False
+        f.truncate(position)
+        return True
+
+
+class Flusher:
+    """
+    Appends text to files with one of the DURABILITY_MODES and runs the
+    background thread that makes ``batched`` and ``async`` appends
+    durable. Appends to the same file are written in order.
+
+    ``append`` returns a ticket; in ``sync`` mode the append is durable once
+    ``wait(ticket)`` returns. Callers append while holding their own lock,
+    to keep the order, and wait after releasing it, so that the appends of
+    concurrent writers are fsynced together.
+    """
+
+    def __init__(self, mode: str = "sync", interval: float = 0.05, max_pending: int = 1000):
+        if mode not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode {mode!r}; expected one of {', '.join(DURABILITY_MODES)}")
+        self.mode = mode
+        self.interval = interval
+        self.max_pending = max_pending
+
+        # Held while writing; taken before _wakeup when both are needed
+        self._lock = threading.Lock()
+        self._files: "OrderedDict[str, IO[str]]" = OrderedDict()
+        self._dirty: Set[str] = set()
+        # Appends written so far and appends known to be fsynced
+        self._written = 0
+        self._synced = 0
+        self._sync_lock = threading.Lock()
+
+        self._wakeup = threading.Condition()
+        self._queue: List[Tuple[str, str]] = []
+        self._pending = 0
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    def append(self, path: str, text: str, sync: bool = False) -> int:
+        """
+        Append ``text`` to ``path`` and return the ticket to ``wait`` on.
+        With ``sync`` the append is durable when this returns whatever the
+        mode, and so is everything appended before it.
+        """
+        if sync:
+            with self._lock:
+                self._flush_locked()
+                self._write(path, text)
+                self._fsync(path)
+                self._written += 1
+                return self._written
+
+        if self.mode == "async":
+            with self._wakeup:
+                self._queue.append((path, text))
+                self._pending_append()
+            return 0
+
+        with self._lock:
+            self._write(path, text)
+            self._dirty.add(path)
+            self._written += 1
+            ticket = self._written
+        if self.mode == "batched":
+            with self._wakeup:
+                self._pending_append()
+        return ticket
+
+    def wait(self, ticket: int) -> None:
+        """
+        In ``sync`` mode, block until the append that returned ``ticket``
+        has been fsynced
+        """
+        if self.mode != "sync" or ticket <= self._synced:
+            return
+        with self._sync_lock:
+            if ticket <= self._synced:
+                # Covered by the fsync of another writer
+                return
+            with self._lock:
+                target = self._written
+                # Duplicated so the fsyncs can run without holding _lock
+                fds = [os.dup(self._files[path].fileno()) for path in self._dirty]
+                self._dirty.clear()
+            try:
+                for fd in fds:
+                    os.fsync(fd)
+                    STORAGE_FSYNCS.inc(1, self.mode)
+            finally:
+                for fd in fds:
+                    os.close(fd)
+            self._synced = target
+
+    def flush(self) -> None:
+        """
+        Write and fsync everything appended so far
+        """
+        with self._lock:
+            self._flush_locked()
+
+    def drain(self) -> None:
+        """
+        Write queued ``async`` appends to the OS, without waiting for an
+        fsync, so that reading the files sees them
+        """
+        with self.paused():
+            pass
+
+    @contextmanager
+    def paused(self) -> Iterator[None]:
+        """
+        Hold back appends, after writing the queued ones to the OS, so that
+        no file is in the middle of an append until the block ends
+        """
+        with self._lock:
+            with self._wakeup:
+                queue, self._queue = self._queue, []
+            for path, text in queue:
+                self._write(path, text)
+                self._dirty.add(path)
+            yield
+
+    def release(self, path: str) -> None:
+        """
+        Make ``path`` durable and close its handle, before the file is
+        renamed or replaced
+        """
+        with self._lock:
+            self._flush_locked()
+            f = self._files.pop(path, None)
+            if f is not None:
+                f.close()
+
+    def close(self) -> None:
+        with self._wakeup:
+            self._closed = True
+            self._wakeup.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            self._flush_locked()
+            for f in self._files.values():
+                f.close()
+            self._files.clear()
+
+    # Internals; _lock must be held for the methods that touch files
+
+    def _pending_append(self) -> None:
+        # Called with _wakeup held
+        self._pending += 1
+        if self._thread is None and not self._closed:
+            self._thread = threading.Thread(target=self._run, name="store-flusher", daemon=True)
+            self._thread.start()
+        if self._pending >= self.max_pending:
+            self._wakeup.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._wakeup:
+                self._wakeup.wait_for(lambda: self._closed or self._pending >= self.max_pending, self.interval)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Error flushing store files: {e}")
+
+    def _flush_locked(self) -> None:
+        with self._wakeup:
+            queue, self._queue = self._queue, []
+            self._pending = 0
+        for path, text in queue:
+            self._write(path, text)
+            self._dirty.add(path)
+        for path in self._dirty:
+            self._fsync(path)
+        self._dirty.clear()
+
+    def _open(self, path: str) -> IO[str]:
+        f = self._files.get(path)
+        if f is not None:
+            self._files.move_to_end(path)
+            return f
+        try:
+            f = open(path, "a", encoding="utf-8")
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            f = open(path, "a", encoding="utf-8")
+        self._files[path] = f
+        while len(self._files) > MAX_OPEN_FILES:
+            oldest, handle = self._files.popitem(last=False)
+            if oldest in self._dirty:
+                handle.flush()
+                os.fsync(handle.fileno())
+                STORAGE_FSYNCS.inc(1, self.mode)
+                self._dirty.discard(oldest)
+            handle.close()
+        return f
+
+    def _write(self, path: str, text: str) -> None:
+        f = self._open(path)
+        f.write(text)
+        f.flush()
+
+    def _fsync(self, path: str) -> None:
+        f = self._files.get(path)
+        if f is not None:
+            os.fsync(f.fileno())
+            STORAGE_FSYNCS.inc(1, self.mode)
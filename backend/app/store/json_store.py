@@ -0,0 +1,284 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional
+
+from app.store.durability import Flusher
+from app.store.journal import Journal
+from app.store.locking import FileLock
+from app.store.metrics import STORAGE_LOAD_SECONDS, STORAGE_SAVE_BYTES, STORAGE_SAVE_SECONDS
+from app.store.memory import MemoryStore
+from app.store.records import MessageColumns
+from app.store.snapshot import Snapshot, Table, snapshot_table, write_snapshot
+
+
+class SectionSpec(NamedTuple):
+    """
+    A snapshot section and the store attribute it is loaded into. Users and
+    conversations are keyed by string ids in memory.
+    """
+
+    name: str
+    key_type: str
+    to_disk: Callable[[Any], Any]
+    from_disk: Callable[[Any], Any]
+    # Values are changed in place (see Table)
+    mutable: bool = False
+    encode: Optional[Callable[[Any], Any]] = None
+    decode: Optional[Callable[[Any], Any]] = None
+
+
+RECORD_SECTIONS: List[SectionSpec] = [
+    SectionSpec("users", "int", int, str),
+    SectionSpec("conversations", "int", int, str),
+    SectionSpec(
+        "messages_by_conversation", "int", int, int, True,
+        MessageColumns.to_json, MessageColumns.from_json,
+    ),
+]
+INDEX_SECTIONS: List[SectionSpec] = [
+    SectionSpec("user_id_by_username", "str", str, str),
+    SectionSpec("user_id_by_email", "str", str, str),
+    SectionSpec("conversation_ids_by_user", "int", int, int, True),
+]
+
+
+class JsonStore(MemoryStore):
+    """
+    Users, conversations and messages held in memory and persisted as JSON.
+
+    Mutations are applied to the in-memory dicts and appended to a journal,
+    which is periodically compacted into a snapshot on a background thread.
+    How soon journal appends reach the disk depends on the ``durability``
+    mode (see app.store.durability); snapshots are always written to a
+    temporary file, fsynced and renamed over the previous one.
+
+    The snapshot (store.snap, see app.store.snapshot) holds the records and
+    the secondary indexes and is memory-mapped on load, so records are only
+    decoded when they are used and startup does not parse the whole
+    dataset. The tables then hold the snapshot plus the changes made since
+    the process started. The older users/conversations/messages JSON files
+    are still read when there is no snapshot yet.
+    """
+
+    # Label for the storage metrics
+    backend_name = "json"
+
+    def __init__(
+        self,
+        data_dir: str,
+        compact_every: int = 10000,
+        durability: str = "sync",
+        flush_interval: float = 0.05,
+        flush_every: int = 1000,
+    ):
+        super().__init__()
+        self.data_dir = data_dir
+        self.compact_every = compact_every
+        self.flusher = Flusher(durability, interval=flush_interval, max_pending=flush_every)
+        self.users_file = os.path.join(data_dir, "users.json")
+        self.conversations_file = os.path.join(data_dir, "conversations.json")
+        self.messages_file = os.path.join(data_dir, "messages.json")
+        self.snapshot_file = os.path.join(data_dir, "store.snap")
+        self._snapshot = None
+        self.journal = Journal(os.path.join(data_dir, "journal.log"), self.flusher)
+        self._compact_lock = threading.Lock()
+        # Held from load to close; one process per data directory
+        self._dir_lock = FileLock(os.path.join(data_dir, "store.lock"))
+        self._indexer: Optional[threading.Thread] = None
+        self._stop_indexing = threading.Event()
+        # Newest durability ticket of the batch() each thread is in
+        self._batch = threading.local()
+
+    # Loading and snapshots
+
+    def load(self) -> None:
+        """
+        Open the snapshot, then replay any journal entries on top of it.
+        Raises StoreLockedError if another process has the data directory.
+        """
+        self._dir_lock.acquire(blocking=False)
+        with STORAGE_LOAD_SECONDS.time(self.backend_name):
+            self._load()
+        if not self.indexes_search:
+            return
+        # Messages written from now on are indexed as they arrive; the
+        # ones loaded from disk are indexed without holding up startup
+        self._indexer = threading.Thread(target=self._build_search_index, name="search-indexer", daemon=True)
+        self._indexer.start()
+
+    def _build_search_index(self) -> None:
+        try:
+            self.build_search_index(self._stop_indexing)
+        except Exception as e:
+            print(f"Error building the search index: {e}")
+
+    def _load(self) -> None:
+        if os.path.exists(self.snapshot_file):
+            self._open_snapshot()
+        else:
+            self._load_json_files()
+
+        # A leftover rotated journal means a compaction did not finish
+        interrupted = os.path.exists(self.journal.rotated_path)
+        if interrupted:
+            for op, data in self.journal.replay(self.journal.rotated_path):
+                self._apply(op, data)
+
+        replayed = 0
+        for op, data in self.journal.replay():
+            self._apply(op, data)
+            replayed += 1
+
+        self.journal.repair()
+        self.journal.entries = replayed
+        if interrupted:
+            self.save()
+            self.journal.discard_rotated()
+
+    def _open_snapshot(self) -> None:
+        self._snapshot = Snapshot(self.snapshot_file)
+        for spec in self._sections():
+            table = Table(
+                self._snapshot.section(spec.name), spec.to_disk, spec.from_disk,
+                mutable=spec.mutable, encode=spec.encode, decode=spec.decode,
+            )
+            setattr(self, spec.name, table)
+        self._restore_meta(self._snapshot.meta)
+
+        # Snapshots written before messages were stored in columns have one
+        # record per message; they are rewritten by the next compaction
+        messages = self._snapshot.section("messages")
+        if messages is not None:
+            for message in Table(messages).values():
+                self._add_message(message)
+
+    def _load_json_files(self) -> None:
+        if os.path.exists(self.users_file):
+            with open(self.users_file, "r") as f:
+                data = json.load(f)
+                self.users = data["users"]
+                self.next_user_id = data["next_id"]
+
+        if os.path.exists(self.conversations_file):
+            with open(self.conversations_file, "r") as f:
+                data = json.load(f)
+                self.conversations = data["conversations"]
+                self.next_conversation_id = data["next_id"]
+
+        self._load_messages_file()
+        self._rebuild_indexes()
+
+    def _load_messages_file(self) -> None:
+        if os.path.exists(self.messages_file):
+            with open(self.messages_file, "r") as f:
+                data = json.load(f)
+                for message in data["messages"].values():
+                    self._add_message(message)
+                self.next_message_id = max(self.next_message_id, data["next_id"])
+
+    def close(self) -> None:
+        if self._indexer is not None:
+            self._stop_indexing.set()
+            self._indexer.join()
+        self.journal.close()
+        self.flusher.close()
+        if self._snapshot is not None:
+            self._snapshot.close()
+        self._dir_lock.release()
+
+    def save(self) -> int:
+        """
+        Write a full snapshot of the current state
+        """
+        start = time.perf_counter()
+        # Copy the indexes before the records (see MemoryStore._apply), and
+        # both before writing so that concurrent mutations don't change a
+        # table mid-write
+        specs = self._sections()
+        indexes = [(spec, self._snapshot_table(spec)) for spec in specs if spec in INDEX_SECTIONS]
+        records = [(spec, self._snapshot_table(spec)) for spec in specs if spec not in INDEX_SECTIONS]
+        meta = self._snapshot_meta()
+        written = write_snapshot(
+            self.snapshot_file,
+            {spec.name: (spec.key_type, table.raw_items()) for spec, table in records + indexes},
+            meta,
+        )
+        STORAGE_SAVE_SECONDS.observe(time.perf_counter() - start, self.backend_name)
+        STORAGE_SAVE_BYTES.inc(written, self.backend_name)
+        return written
+
+    def compact(self) -> None:
+        """
+        Fold the journal into a fresh snapshot.
+
+        The journal is rotated before the state is copied, so every entry in
+        the rotated file is already reflected in the copy; entries that race
+        with the copy land in the new journal and are replayed idempotently.
+        """
+        with self._compact_lock:
+            self.journal.rotate()
+            self.save()
+            self.journal.discard_rotated()
+
+    def _maybe_compact(self) -> None:
+        if self.journal.entries < self.compact_every or self._compact_lock.locked():
+            return
+        threading.Thread(target=self._compact_in_background, daemon=True).start()
+
+    def _compact_in_background(self) -> None:
+        try:
+            self.compact()
+        except Exception as e:
+            print(f"Error compacting journal: {e}")
+
+    def _sections(self) -> List[SectionSpec]:
+        return RECORD_SECTIONS + INDEX_SECTIONS
+
+    def _snapshot_table(self, spec: SectionSpec) -> Table:
+        return snapshot_table(getattr(self, spec.name), spec.to_disk, spec.mutable, spec.encode)
+
+    def _snapshot_meta(self) -> Dict[str, int]:
+        return {
+            "next_user_id": self.next_user_id,
+            "next_conversation_id": self.next_conversation_id,
+            "next_message_id": self.next_message_id,
+        }
+
+    def _restore_meta(self, meta: Dict[str, int]) -> None:
+        self.next_user_id = meta["next_user_id"]
+        self.next_conversation_id = meta["next_conversation_id"]
+        self.next_message_id = meta["next_message_id"]
+
+    # Mutations
+
+    def _record(self, op: str, data: Dict[str, Any], sync: bool = False) -> int:
+        self._apply(op, data)
+        ticket = self.journal.append(op, data, sync=sync)
+        self._maybe_compact()
+        return ticket
+
+    def _wait(self, ticket: Optional[int]) -> None:
+        if ticket is None:
+            # Nothing was journaled
+            return
+        if getattr(self._batch, "ticket", None) is not None:
+            self._batch.ticket = max(self._batch.ticket, ticket)
+            return
+        self.flusher.wait(ticket)
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        # Waiting for the newest ticket covers all the earlier ones, so the
+        # whole batch needs a single fsync
+        if getattr(self._batch, "ticket", None) is not None:
+            yield
+            return
+        self._batch.ticket = 0
+        try:
+            yield
+        finally:
+            ticket, self._batch.ticket = self._batch.ticket, None
+            self.flusher.wait(ticket)
@@ -0,0 +1,76 @@
+"""
+Advisory file locks between processes.
+
+The json and sharded stores keep their state in the memory of one
+process, so two processes (for example several uvicorn workers) serving
+the same DATA_DIR would hand out the same ids and overwrite each other's
+snapshots. Each takes an exclusive lock on the data directory when it is
+loaded and the second one fails with StoreLockedError. The sqlite store
+uses a lock only to run its migrations one process at a time.
+
+Locks use ``fcntl.flock`` and are released by the OS when the process
+exits, so a crash never leaves a stale lock behind. Where ``fcntl`` is not
+available (Windows) locking is skipped.
+"""
+import os
+from typing import IO, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+
+class StoreLockedError(Exception):
+    """
+    Raised when another process holds the lock on a store's data
+    """
+
+    def __init__(self, path: str):
+        super().__init__(
+            f"{path} is locked by another process; the json and sharded stores serve one process only, "
+            "use STORAGE_BACKEND=sqlite to run several workers"
+        )
+        self.path = path
+
+
+class FileLock:
+    """
+    Exclusive lock on ``path``, created if missing
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file: Optional[IO[bytes]] = None
+
+    def acquire(self, blocking: bool = True) -> None:
+        """
+        Take the lock, waiting for it with ``blocking`` and raising
+        StoreLockedError otherwise
+        """
+        if self._file is not None:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        f = open(self.path, "ab")
+        if fcntl is not None:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                f.close()
+                raise StoreLockedError(self.path) from None
+        self._file = f
+
+    def release(self) -> None:
+        if self._file is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
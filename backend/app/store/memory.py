@@ -0,0 +1,361 @@
+import os
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.search import MAX_HITS, group_hits, query_terms, search_result, snippet
+from app.store.base import DuplicateUserError, Record, StorageBackend
+from app.store.records import MessageColumns, check_role
+from app.store.search import SearchIndex
+
+# Reads of a conversation being indexed before it is read under the write
+# lock, if messages keep being added to it
+INDEX_ATTEMPTS = 3
+
+
+def page_bounds(
+    message_ids: List[int], limit: int, before: Optional[int], after: Optional[int]
+) -> Tuple[int, int, bool]:
+    """
+    Slice of the sorted ``message_ids`` that makes up one history page, and
+    whether there are more messages past it (see StorageBackend.page_messages)
+    """
+    lo = bisect_right(message_ids, after) if after is not None else 0
+    hi = bisect_left(message_ids, before) if before is not None else len(message_ids)
+
+    if after is not None and before is None:
+        return lo, min(hi, lo + limit), lo + limit < hi
+    return max(lo, hi - limit), hi, hi - limit > lo
+
+
+class MemoryStore(StorageBackend):
+    """
+    Users, conversations and messages held in memory only.
+
+    Users and conversations live in dicts keyed by string id, the same
+    layout as the JSON files, with secondary indexes (username, email and
+    user -> conversations) maintained by every mutation, so lookups never
+    scan the whole dataset. Messages are kept per conversation in compact
+    columns (see app.store.records), which double as the conversation ->
+    messages index, and are turned back into dicts when they are read.
+
+    Every mutation goes through ``_record(op, data)`` and is applied by
+    ``_apply``; subclasses hook ``_record`` to persist it and return a
+    ticket that ``_wait`` blocks on until the change is durable.
+
+    There is a single writer at a time: mutations allocate their id, apply
+    and record the change under ``_write_lock``, and wait for durability
+    after releasing it, so one fsync can cover several writers. Reads take
+    no lock. Records are replaced rather than changed in place, and are
+    stored before they are added to an index, so a reader running
+    alongside a writer sees either the old or the new state.
+
+    Message words are kept in an inverted index (app.store.search) for
+    ``search``. New conversations and messages are indexed as they are
+    written; subclasses that load existing data index it afterwards with
+    ``build_search_index``.
+
+    Every change also bumps a version counter of the user or conversation
+    it affects (see ``user_version``). The counters are not persisted, so
+    versions carry a token that is new each time the store is created.
+    """
+
+    def __init__(self):
+        self.users: Dict[str, Record] = {}
+        self.conversations: Dict[str, Record] = {}
+        self.messages_by_conversation: Dict[int, MessageColumns] = {}
+        self.next_user_id = 1
+        self.next_conversation_id = 1
+        self.next_message_id = 1
+        # Reentrant so that subclasses can wrap a mutation in it
+        self._write_lock = threading.RLock()
+
+        # Secondary indexes, keyed by the same string ids as the dicts above
+        self.user_id_by_username: Dict[str, str] = {}
+        self.user_id_by_email: Dict[str, str] = {}
+        self.conversation_ids_by_user: Dict[int, List[str]] = {}
+        self.search_index = SearchIndex()
+        # Subclasses that keep messages on disk may search without it
+        self.indexes_search = True
+
+        self.version_epoch = os.urandom(4).hex()
+        self.user_versions: Dict[int, int] = {}
+        self.conversation_versions: Dict[int, int] = {}
+
+    # Indexes and lookups
+
+    def _rebuild_indexes(self) -> None:
+        self.user_id_by_username = {}
+        self.user_id_by_email = {}
+        self.conversation_ids_by_user = {}
+
+        for user_id, user in self.users.items():
+            self.user_id_by_username[user["username"]] = user_id
+            self.user_id_by_email[user["email"]] = user_id
+
+        for conv_id, conversation in self.conversations.items():
+            self.conversation_ids_by_user.setdefault(conversation["user_id"], []).append(conv_id)
+
+    def get_user(self, user_id: int) -> Optional[Record]:
+        return self.users.get(str(user_id))
+
+    def get_user_by_username(self, username: str) -> Optional[Record]:
+        user_id = self.user_id_by_username.get(username)
+        return self.users[user_id] if user_id is not None else None
+
+    def get_user_by_email(self, email: str) -> Optional[Record]:
+        user_id = self.user_id_by_email.get(email)
+        return self.users[user_id] if user_id is not None else None
+
+    def get_conversation(self, conversation_id: int) -> Optional[Record]:
+        return self.conversations.get(str(conversation_id))
+
+    def list_conversations(self, user_id: int) -> List[Record]:
+        conversations = [
+            self.conversations[conv_id]
+            for conv_id in self.conversation_ids_by_user.get(user_id, ())
+        ]
+        conversations.sort(key=lambda conv: conv["updated_at"], reverse=True)
+        return conversations
+
+    def get_summary(self, conversation_id: int) -> Tuple[str, int]:
+        conversation = self.conversations.get(str(conversation_id))
+        if conversation is None:
+            return "", 0
+        return conversation.get("summary", ""), conversation.get("summary_until", 0)
+
+    def list_messages(self, conversation_id: int) -> List[Record]:
+        columns = self.messages_by_conversation.get(conversation_id)
+        return columns.records() if columns is not None else []
+
+    def page_messages(
+        self,
+        conversation_id: int,
+        limit: int,
+        before: Optional[int] = None,
+        after: Optional[int] = None,
+    ) -> Tuple[List[Record], bool]:
+        columns = self.messages_by_conversation.get(conversation_id)
+        if columns is None:
+            return [], False
+        start, end, has_more = page_bounds(columns.ids, limit, before, after)
+        return columns.records(start, end), has_more
+
+    # Search
+
+    def search(self, user_id: int, query: str, limit: int) -> List[Record]:
+        terms = query_terms(query)
+        hits = [
+            {"score": score, "message_id": message_id, "conversation_id": conversation_id}
+            for score, message_id, conversation_id in self._search_index(user_id).search(user_id, terms, MAX_HITS)
+        ]
+        results = []
+        for group in group_hits(hits, limit):
+            conversation = self.get_conversation(group[0]["conversation_id"])
+            if conversation is None:
+                continue
+            for hit in group:
+                # The page of the one message with this id
+                page, _ = self.page_messages(
+                    hit["conversation_id"], 1, before=hit["message_id"] + 1, after=hit["message_id"] - 1
+                )
+                hit.update(role=page[0]["role"], content=page[0]["content"])
+            results.append(search_result(conversation["title"], group, lambda hit: snippet(hit["content"], terms)))
+        return results
+
+    def _search_index(self, user_id: int) -> SearchIndex:
+        # The index that holds the user's messages
+        return self.search_index
+
+    def build_search_index(self, stop: Optional[threading.Event] = None) -> None:
+        """
+        Index the messages of every conversation that is not indexed yet,
+        one conversation at a time, until ``stop`` is set
+        """
+        with self._write_lock:
+            conversation_ids = list(self.conversations)
+        for conv_id in conversation_ids:
+            if stop is not None and stop.is_set():
+                return
+            self._index_conversation(conv_id)
+
+    def _index_conversation(self, conv_id: str) -> None:
+        # The messages are read without the write lock, which only covers
+        # checking that none was added meanwhile (the version is the same)
+        # and indexing them
+        for attempt in range(INDEX_ATTEMPTS):
+            with self._write_lock:
+                conversation = self.conversations.get(conv_id)
+                if conversation is None or self.search_index.covers(conversation["id"]):
+                    return
+                conversation_id = conversation["id"]
+                version = self.conversation_version(conversation_id)
+                if attempt == INDEX_ATTEMPTS - 1:
+                    # Still changing, read it under the lock
+                    self.search_index.add_conversation(
+                        conversation["user_id"], conversation_id, self._messages_to_index(conversation_id)
+                    )
+                    return
+            messages = self._messages_to_index(conversation_id)
+            with self._write_lock:
+                if self.search_index.covers(conversation_id):
+                    return
+                if self.conversation_version(conversation_id) == version:
+                    self.search_index.add_conversation(conversation["user_id"], conversation_id, messages)
+                    return
+
+    def _messages_to_index(self, conversation_id: int) -> List[Record]:
+        return self.list_messages(conversation_id)
+
+    def _index_message(self, message: Record) -> None:
+        # Called under _write_lock
+        if self.search_index.covers(message["conversation_id"]):
+            conversation = self.conversations[str(message["conversation_id"])]
+            self.search_index.add(conversation["user_id"], message)
+
+    # Versions
+
+    def user_version(self, user_id: int) -> str:
+        return f"{self.version_epoch}.{self.user_versions.get(user_id, 0)}"
+
+    def conversation_version(self, conversation_id: int) -> str:
+        return f"{self.version_epoch}.{self.conversation_versions.get(conversation_id, 0)}"
+
+    def _bump_version(self, versions: Dict[int, int], key: int) -> None:
+        # Called under _write_lock, once the change is visible to readers
+        versions[key] = versions.get(key, 0) + 1
+
+    # Mutations
+
+    def _apply(self, op: str, data: Dict[str, Any]) -> None:
+        # Replaying an entry that is already present must not duplicate it
+        # in the indexes. Records are stored before they are indexed, so a
+        # snapshot that copies the indexes first never references a missing
+        # record.
+        if op == "user_created":
+            user_id = str(data["id"])
+            self.users[user_id] = data
+            self.user_id_by_username[data["username"]] = user_id
+            self.user_id_by_email[data["email"]] = user_id
+            self.next_user_id = max(self.next_user_id, data["id"] + 1)
+        elif op == "conversation_created":
+            conv_id = str(data["id"])
+            is_new = conv_id not in self.conversations
+            self.conversations[conv_id] = data
+            if is_new:
+                self.conversation_ids_by_user.setdefault(data["user_id"], []).append(conv_id)
+            self._bump_version(self.user_versions, data["user_id"])
+            self.next_conversation_id = max(self.next_conversation_id, data["id"] + 1)
+        elif op == "message_appended":
+            self._add_message(data)
+            self._bump_version(self.conversation_versions, data["conversation_id"])
+            self.next_message_id = max(self.next_message_id, data["id"] + 1)
+        elif op == "conversation_touched":
+            conv_id = str(data["id"])
+            conversation = self.conversations.get(conv_id)
+            if conversation is not None:
+                # Replace rather than mutate so snapshot copies stay consistent
+                self.conversations[conv_id] = {**conversation, "updated_at": data["updated_at"]}
+                # The list is ordered by updated_at
+                self._bump_version(self.user_versions, conversation["user_id"])
+        elif op == "conversation_summarized":
+            conv_id = str(data["id"])
+            conversation = self.conversations.get(conv_id)
+            if conversation is not None:
+                # Neither the list nor the history show the summary, so no
+                # version changes
+                self.conversations[conv_id] = {
+                    **conversation, "summary": data["summary"], "summary_until": data["summary_until"],
+                }
+        else:
+            raise ValueError(f"Unknown store op: {op}")
+
+    def _add_message(self, message: Record) -> None:
+        conv_id = message["conversation_id"]
+        if conv_id not in self.messages_by_conversation:
+            self.messages_by_conversation[conv_id] = MessageColumns(conv_id)
+        # setdefault rather than get: snapshot tables copy the columns
+        # into memory before they are changed
+        self.messages_by_conversation.setdefault(conv_id).add(message)
+
+    def _record(self, op: str, data: Dict[str, Any]) -> Optional[int]:
+        self._apply(op, data)
+        return None
+
+    def _wait(self, ticket: Optional[int]) -> None:
+        """
+        Block until the change recorded with ``ticket`` is durable
+        """
+
+    def create_user(self, username: str, email: str, password: str) -> Record:
+        with self._write_lock:
+            if username in self.user_id_by_username:
+                raise DuplicateUserError("username")
+            if email in self.user_id_by_email:
+                raise DuplicateUserError("email")
+            user = {
+                "id": self.next_user_id,
+                "username": username,
+                "email": email,
+                "password": password,
+            }
+            ticket = self._record("user_created", user)
+        self._wait(ticket)
+        return user
+
+    def set_password(self, user_id: int, password: str) -> None:
+        with self._write_lock:
+            user = self.users.get(str(user_id))
+            if user is None:
+                return
+            # Replaying user_created replaces the record
+            ticket = self._record("user_created", {**user, "password": password})
+        self._wait(ticket)
+
+    def create_conversation(self, user_id: int, title: str) -> Record:
+        with self._write_lock:
+            now = datetime.utcnow().isoformat()
+            conversation = {
+                "id": self.next_conversation_id,
+                "title": title,
+                "user_id": user_id,
+                "created_at": now,
+                "updated_at": now,
+            }
+            ticket = self._record("conversation_created", conversation)
+            if self.indexes_search:
+                self.search_index.add_conversation(user_id, conversation["id"], ())
+        self._wait(ticket)
+        return conversation
+
+    def append_message(self, conversation_id: int, role: str, content: str) -> Record:
+        check_role(role)
+        with self._write_lock:
+            message = {
+                "id": self.next_message_id,
+                "content": content,
+                "role": role,
+                "conversation_id": conversation_id,
+                "created_at": datetime.utcnow().isoformat(),
+            }
+            ticket = self._record("message_appended", message)
+            self._index_message(message)
+        self._wait(ticket)
+        return message
+
+    def touch_conversation(self, conversation_id: int) -> None:
+        with self._write_lock:
+            ticket = self._record(
+                "conversation_touched",
+                {"id": conversation_id, "updated_at": datetime.utcnow().isoformat()},
+            )
+        self._wait(ticket)
+
+    def set_summary(self, conversation_id: int, summary: str, until: int) -> None:
+        with self._write_lock:
+            ticket = self._record(
+                "conversation_summarized",
+                {"id": conversation_id, "summary": summary, "summary_until": until},
+            )
+        self._wait(ticket)
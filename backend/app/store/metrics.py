@@ -0,0 +1,35 @@
+from app.core.metrics import registry
+
+# Snapshot loading and writing, by backend
+STORAGE_LOAD_SECONDS = registry.histogram(
+    "storage_load_duration_seconds", "Time to load or recover the stored state", ("backend",)
+)
+STORAGE_SAVE_SECONDS = registry.histogram(
+    "storage_save_duration_seconds", "Time to write a full snapshot", ("backend",)
+)
+STORAGE_SAVE_BYTES = registry.counter(
+    "storage_save_bytes_total", "Bytes written by full snapshots", ("backend",)
+)
+
+# Journal appends; the fsyncs are counted by STORAGE_FSYNCS
+JOURNAL_APPEND_SECONDS = registry.histogram(
+    "storage_journal_append_duration_seconds", "Time to append one journal entry",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+JOURNAL_BYTES = registry.counter(
+    "storage_journal_bytes_total", "Bytes appended to the journal"
+)
+STORAGE_FSYNCS = registry.counter(
+    "storage_fsyncs_total", "fsync calls on the journal and segment files, by durability mode", ("mode",)
+)
+
+# Message segments of the sharded store
+SEGMENT_LOADS = registry.counter(
+    "storage_segment_loads_total", "Conversations whose messages were read from their segment file"
+)
+SEGMENT_EVICTIONS = registry.counter(
+    "storage_segment_evictions_total", "Conversations dropped from the message cache"
+)
+MESSAGE_CACHE_BYTES = registry.gauge(
+    "storage_message_cache_bytes", "Estimated size of the cached messages"
+)
@@ -0,0 +1,161 @@
+import sys
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Any, List
+
+from app.store.base import Record
+
+# Message roles, stored as their index in one byte
+ROLES = ("user", "assistant", "system")
+ROLE_CODES = {role: code for code, role in enumerate(ROLES)}
+
+EPOCH = datetime(1970, 1, 1)
+
+# Per message: an int64 id, a role byte, an int64 timestamp and a list slot
+COLUMN_BYTES = 8 + 1 + 8 + 8
+
+
+def to_micros(timestamp: str) -> int:
+    """
+    Microseconds since the epoch for a naive UTC ISO 8601 timestamp
+    """
+    delta = datetime.fromisoformat(timestamp) - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def check_role(role: str) -> None:
+    """
+    Raise ValueError unless ``role`` is one of ROLES
+    """
+    if role not in ROLE_CODES:
+        raise ValueError(f"Unknown message role {role!r}; expected one of {', '.join(ROLES)}")
+
+
+def is_message_line(record: Any) -> bool:
+    """
+    Whether a record read back from disk has the fields of a message
+    """
+    return (
+        isinstance(record, dict)
+        and isinstance(record.get("id"), int)
+        and record.get("role") in ROLE_CODES
+        and isinstance(record.get("content"), str)
+        and isinstance(record.get("created_at"), str)
+    )
+
+
+@lru_cache(maxsize=4096)
+def _format_seconds(seconds: int) -> str:
+    return (EPOCH + timedelta(seconds=seconds)).isoformat()
+
+
+def from_micros(micros: int) -> str:
+    # Same format as datetime.utcnow().isoformat(), which the records had.
+    # Messages read together are usually seconds apart, so the date and
+    # time are formatted once per second and only the fraction per message.
+    seconds, fraction = divmod(micros, 1000000)
+    if fraction:
+        return f"{_format_seconds(seconds)}.{fraction:06d}"
+    return _format_seconds(seconds)
+
+
+def message_bytes(content: str) -> int:
+    """
+    Approximate memory held by one message in MessageColumns
+    """
+    return COLUMN_BYTES + sys.getsizeof(content)
+
+
+class MessageColumns:
+    """
+    The messages of one conversation stored column by column, in id order.
+
+    Ids and timestamps are packed int64 arrays, roles are single bytes and
+    only the contents are Python objects, so a message costs about 25
+    bytes plus its content string instead of a dict with five keys and
+    three more strings. Records in the usual dict shape are built on
+    demand by ``record`` and ``records``.
+    """
+
+    __slots__ = ("conversation_id", "ids", "roles", "created", "contents")
+
+    def __init__(self, conversation_id: int):
+        self.conversation_id = conversation_id
+        self.ids = array("q")
+        self.roles = bytearray()
+        self.created = array("q")
+        self.contents: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, record: Record) -> bool:
+        """
+        Add a message record; returns False if its id is already present
+        """
+        message_id = record["id"]
+        position = bisect_left(self.ids, message_id)
+        if position < len(self.ids) and self.ids[position] == message_id:
+            return False
+
+        role = ROLE_CODES[record["role"]]
+        created = to_micros(record["created_at"])
+        if position == len(self.ids):
+            # The id goes last: readers only look at the first len(ids)
+            # rows, so they never see a half-added message
+            self.contents.append(record["content"])
+            self.roles.append(role)
+            self.created.append(created)
+            self.ids.append(message_id)
+        else:
+            # Only when loading data that is out of order, before readers
+            self.contents.insert(position, record["content"])
+            self.roles.insert(position, role)
+            self.created.insert(position, created)
+            self.ids.insert(position, message_id)
+        return True
+
+    def record(self, index: int) -> Record:
+        return {
+            "id": self.ids[index],
+            "content": self.contents[index],
+            "role": ROLES[self.roles[index]],
+            "conversation_id": self.conversation_id,
+            "created_at": from_micros(self.created[index]),
+        }
+
+    def records(self, start: int = 0, end: int = None) -> List[Record]:
+        end = len(self.ids) if end is None else end
+        return [self.record(index) for index in range(start, end)]
+
+    def nbytes(self) -> int:
+        """
+        Approximate memory held by the messages
+        """
+        return sum(map(message_bytes, self.contents))
+
+    def copy(self) -> "MessageColumns":
+        # Sized by the ids, which are appended last (see add), so the copy
+        # is consistent while another thread appends
+        columns = MessageColumns(self.conversation_id)
+        columns.ids = self.ids[:]
+        count = len(columns.ids)
+        columns.roles = self.roles[:count]
+        columns.created = self.created[:count]
+        columns.contents = self.contents[:count]
+        return columns
+
+    def to_json(self) -> List[Any]:
+        return [self.conversation_id, self.ids.tolist(), list(self.roles), self.created.tolist(), self.contents]
+
+    @classmethod
+    def from_json(cls, data: List[Any]) -> "MessageColumns":
+        conversation_id, ids, roles, created, contents = data
+        columns = cls(conversation_id)
+        columns.ids = array("q", ids)
+        columns.roles = bytearray(roles)
+        columns.created = array("q", created)
+        columns.contents = contents
+        return columns
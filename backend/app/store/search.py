@@ -0,0 +1,121 @@
+"""
+In-memory inverted index behind main.py's /chat/search.
+
+Each user has an index of their own mapping a word to its postings: the
+ids of the messages that contain it, with the conversation and the number
+of occurrences, packed two per posting into one ``array('q')``. A query
+only touches the postings of the user's own words, intersects them
+starting from the shortest and ranks the messages left by BM25 (without
+the document length part). A posting takes 16 bytes.
+"""
+import heapq
+import math
+import sys
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Set, Tuple
+
+from app.core.search import tokenize
+from app.store.base import Record
+
+# BM25 term frequency saturation
+K1 = 1.2
+TF_WEIGHTS = [tf * (K1 + 1) / (tf + K1) for tf in range(256)]
+
+
+class SearchIndex:
+    """
+    Words of the messages of each user, updated as messages are added.
+
+    Conversations are indexed whole, by ``add_conversation``, or as their
+    messages arrive; ``add`` skips messages of a conversation that has not
+    been indexed yet, so that building the index for existing data and
+    indexing new messages never index a message twice. Writers must be
+    serialized by the caller; searches can run alongside them.
+    """
+
+    def __init__(self):
+        self._postings: Dict[int, Dict[str, array]] = {}
+        self._documents: Dict[int, int] = {}
+        self._conversations: Set[int] = set()
+        self.postings = 0
+
+    def covers(self, conversation_id: int) -> bool:
+        return conversation_id in self._conversations
+
+    def add_conversation(self, user_id: int, conversation_id: int, messages: Iterable[Record]) -> None:
+        """
+        Index all of a conversation's messages; it is then covered
+        """
+        if conversation_id in self._conversations:
+            return
+        for message in messages:
+            self._add(user_id, message)
+        self._conversations.add(conversation_id)
+
+    def add(self, user_id: int, message: Record) -> bool:
+        """
+        Index a new message, if its conversation is covered
+        """
+        if message["conversation_id"] not in self._conversations:
+            return False
+        self._add(user_id, message)
+        return True
+
+    def _add(self, user_id: int, message: Record) -> None:
+        postings = self._postings.get(user_id)
+        if postings is None:
+            postings = self._postings[user_id] = {}
+        conversation = message["conversation_id"] << 8
+        for word, count in Counter(tokenize(message["content"])).items():
+            entries = postings.get(word)
+            if entries is None:
+                # Shared by every user's index
+                entries = postings[sys.intern(word)] = array("q")
+            # One call, so readers never see half a posting
+            entries.extend((message["id"], conversation | min(count, 255)))
+            self.postings += 1
+        self._documents[user_id] = self._documents.get(user_id, 0) + 1
+
+    def search(self, user_id: int, terms: List[str], limit: int) -> List[Tuple[float, int, int]]:
+        """
+        The ``limit`` best ``(score, message_id, conversation_id)`` of the
+        user's messages that contain every term, best first
+        """
+        postings = self._postings.get(user_id, {})
+        lists = [postings.get(term) for term in terms]
+        if not lists or any(entries is None for entries in lists):
+            return []
+        documents = self._documents.get(user_id, 0)
+
+        scores: Dict[int, float] = {}
+        conversations: Dict[int, int] = {}
+        for n, entries in enumerate(sorted(lists, key=len)):
+            # Whole postings only, in case a writer is appending
+            size = len(entries) & ~1
+            frequency = size // 2
+            idf = math.log(1 + (documents - frequency + 0.5) / (frequency + 0.5))
+            ids, packed = entries[0:size:2], entries[1:size:2]
+            if n == 0:
+                for message_id, value in zip(ids, packed):
+                    scores[message_id] = idf * TF_WEIGHTS[value & 255]
+                    conversations[message_id] = value >> 8
+                continue
+            matched = {}
+            for message_id, value in zip(ids, packed):
+                score = scores.get(message_id)
+                if score is not None:
+                    matched[message_id] = score + idf * TF_WEIGHTS[value & 255]
+            scores = matched
+            if not scores:
+                return []
+
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        return [(score, message_id, conversations[message_id]) for message_id, score in best]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "users": len(self._postings),
+            "conversations": len(self._conversations),
+            "postings": self.postings,
+        }
@@ -0,0 +1,311 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.store.base import Record
+from app.store.durability import truncate_torn_line
+from app.store.json_store import RECORD_SECTIONS, JsonStore, SectionSpec
+from app.store.memory import page_bounds
+from app.store.metrics import MESSAGE_CACHE_BYTES, SEGMENT_EVICTIONS, SEGMENT_LOADS
+from app.store.records import MessageColumns, check_role, is_message_line, message_bytes
+from app.store.search import SearchIndex
+from app.store.snapshot import Table
+
+# Message ids are reserved in the journal a block at a time, so appending a
+# message does not need a journal entry of its own. Ids left unused in a
+# block when the process stops are skipped.
+MESSAGE_ID_BLOCK = 1000
+
+
+class ShardedStore(JsonStore):
+    """
+    JsonStore that keeps messages in one append-only segment file per
+    conversation instead of messages.json.
+
+    Users and conversations are loaded at startup as before. A
+    conversation's messages are read from its segment the first time they
+    are needed and kept, as MessageColumns, in an LRU cache; once the cached messages exceed
+    ``cache_bytes``, the least recently used conversations are dropped from
+    memory. Startup time and resident memory therefore depend on the number
+    of conversations, not on the number of messages.
+
+    Segments live in ``segments/<id % 256>/<id>.jsonl`` with one message per
+    line, appended with the store's durability mode like the journal. An existing
+    messages.json (and messages in the journal) is split into segments the
+    first time the store is loaded.
+
+    The in-memory search index would hold the words of every message, so
+    it is only kept with ``search_index``. Otherwise each search reads the
+    user's messages, like the indexer does, into an index of its own.
+    """
+
+    backend_name = "sharded"
+
+    def __init__(
+        self,
+        data_dir: str,
+        compact_every: int = 10000,
+        cache_bytes: int = 256 * 1024 * 1024,
+        durability: str = "sync",
+        flush_interval: float = 0.05,
+        flush_every: int = 1000,
+        search_index: bool = False,
+    ):
+        super().__init__(
+            data_dir,
+            compact_every=compact_every,
+            durability=durability,
+            flush_interval=flush_interval,
+            flush_every=flush_every,
+        )
+        self.cache_bytes = cache_bytes
+        self.indexes_search = search_index
+        self.segments_dir = os.path.join(data_dir, "segments")
+        self.message_id_limit = 1
+
+        self._segments: "OrderedDict[int, MessageColumns]" = OrderedDict()
+        self._cached_bytes = 0
+        self._segments_lock = threading.Lock()
+
+    # Loading and snapshots
+
+    def _load(self) -> None:
+        super()._load()
+        # Messages still in messages.json, in a JsonStore snapshot or in
+        # the journal come from before the store was sharded. Without a
+        # snapshot, JsonStore has read messages.json already; reading it
+        # again would only merge the same ids.
+        legacy_file = os.path.exists(self.messages_file)
+        if legacy_file and self._snapshot is not None:
+            self._load_messages_file()
+        self.next_message_id = max(self.next_message_id, self.message_id_limit)
+        self.message_id_limit = self.next_message_id
+
+        if self.messages_by_conversation or legacy_file:
+            self._migrate()
+
+    def _open_snapshot(self) -> None:
+        super()._open_snapshot()
+        # Written by JsonStore, whose snapshot holds the messages
+        messages = self._snapshot.section("messages_by_conversation")
+        if messages is not None:
+            spec = next(spec for spec in RECORD_SECTIONS if spec.name == "messages_by_conversation")
+            table = Table(messages, spec.to_disk, spec.from_disk, mutable=True, encode=spec.encode, decode=spec.decode)
+            for conversation_id, columns in table.items():
+                self.messages_by_conversation[conversation_id] = columns
+
+    def _migrate(self) -> None:
+        for conversation_id, columns in self.messages_by_conversation.items():
+            # Merge with what an interrupted migration may have written
+            merged = {record["id"]: record for record in self._read_segment(conversation_id)}
+            merged.update((message["id"], message) for message in columns.records())
+            self._write_segment(conversation_id, [merged[i] for i in sorted(merged)])
+
+        self.messages_by_conversation = {}
+        # Fold the migrated journal entries into the snapshot before the
+        # old messages file goes away; everything in it is in the segments
+        # by now
+        self.compact()
+        if os.path.exists(self.messages_file):
+            os.remove(self.messages_file)
+
+    def _sections(self) -> List[SectionSpec]:
+        # Messages live in the segments
+        return [spec for spec in super()._sections() if spec.name != "messages_by_conversation"]
+
+    def _snapshot_meta(self) -> Dict[str, int]:
+        meta = super()._snapshot_meta()
+        meta["next_message_id"] = max(self.next_message_id, self.message_id_limit)
+        return meta
+
+    # Segment files
+
+    def _segment_path(self, conversation_id: int) -> str:
+        return os.path.join(self.segments_dir, f"{conversation_id % 256:02x}", f"{conversation_id}.jsonl")
+
+    def _read_segment(self, conversation_id: int, repair: bool = True) -> List[Record]:
+        # A last line that is not complete is skipped. It is only cut off
+        # with ``repair``, and then only once it is read again with appends
+        # held back: until then it may be an append still being written.
+        path = self._segment_path(conversation_id)
+        records, torn = self._parse_segment(path, conversation_id)
+        if torn and repair:
+            with self.flusher.paused():
+                records, torn = self._parse_segment(path, conversation_id)
+                if torn:
+                    truncate_torn_line(path)
+        return records
+
+    def _parse_segment(self, path: str, conversation_id: int) -> Tuple[List[Record], bool]:
+        # The valid messages, and whether a line was not valid JSON
+        records: List[Record] = []
+        torn = False
+        if not os.path.exists(path):
+            return records, torn
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A write cut short by a crash
+                    torn = True
+                    continue
+                if not is_message_line(record):
+                    # Written before roles were checked; the rest of the
+                    # conversation stays readable
+                    print(f"Skipping an invalid message in {path}: {line.strip()[:200]}")
+                    continue
+                record["conversation_id"] = conversation_id
+                records.append(record)
+        return records, torn
+
+    def _write_segment(self, conversation_id: int, records: List[Record]) -> None:
+        path = self._segment_path(conversation_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.flusher.release(path)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(segment_line(record))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _append_to_segment(self, record: Record) -> int:
+        return self.flusher.append(self._segment_path(record["conversation_id"]), segment_line(record))
+
+    # Cache
+
+    def _segment(self, conversation_id: int) -> MessageColumns:
+        with self._segments_lock:
+            segment = self._segments.get(conversation_id)
+            if segment is not None:
+                self._segments.move_to_end(conversation_id)
+                return segment
+
+            # Queued async appends must reach the file before it is read
+            self.flusher.drain()
+            segment = MessageColumns(conversation_id)
+            for record in self._read_segment(conversation_id):
+                segment.add(record)
+            SEGMENT_LOADS.inc()
+            self._segments[conversation_id] = segment
+            self._cached_bytes += segment.nbytes()
+            self._evict()
+            return segment
+
+    def _evict(self) -> None:
+        # Never evicts the most recently used segment, however large
+        while self._cached_bytes > self.cache_bytes and len(self._segments) > 1:
+            _, segment = self._segments.popitem(last=False)
+            self._cached_bytes -= segment.nbytes()
+            SEGMENT_EVICTIONS.inc()
+        MESSAGE_CACHE_BYTES.set(self._cached_bytes)
+
+    def _messages_to_index(self, conversation_id: int) -> List[Record]:
+        # Read without caching, so indexing does not evict the segments in
+        # use, and without the write lock
+        with self._segments_lock:
+            segment = self._segments.get(conversation_id)
+        if segment is not None:
+            return segment.records()
+        self.flusher.drain()
+        return self._read_segment(conversation_id, repair=False)
+
+    def _search_index(self, user_id: int) -> SearchIndex:
+        if self.indexes_search:
+            return self.search_index
+        index = SearchIndex()
+        for conv_id in list(self.conversation_ids_by_user.get(user_id, ())):
+            conversation = self.conversations.get(conv_id)
+            if conversation is not None:
+                index.add_conversation(user_id, conversation["id"], self._messages_to_index(conversation["id"]))
+        return index
+
+    def cache_stats(self) -> Dict[str, int]:
+        return {"conversations": len(self._segments), "bytes": self._cached_bytes}
+
+    # Messages
+
+    def list_messages(self, conversation_id: int) -> List[Record]:
+        return self._segment(conversation_id).records()
+
+    def page_messages(
+        self,
+        conversation_id: int,
+        limit: int,
+        before: Optional[int] = None,
+        after: Optional[int] = None,
+    ) -> Tuple[List[Record], bool]:
+        segment = self._segment(conversation_id)
+        start, end, has_more = page_bounds(segment.ids, limit, before, after)
+        return segment.records(start, end), has_more
+
+    def _apply(self, op: str, data: Dict[str, Any]) -> None:
+        if op == "message_ids_reserved":
+            self.message_id_limit = max(self.message_id_limit, data["next_id"])
+        else:
+            super()._apply(op, data)
+
+    def create_conversation(self, user_id: int, title: str) -> Record:
+        with self._write_lock:
+            # Without sync durability a crash can keep a conversation's
+            # messages but lose the conversation, whose id is then reused;
+            # the old messages must not show up in the new conversation
+            conversation_id = self.next_conversation_id
+            path = self._segment_path(conversation_id)
+            if os.path.exists(path):
+                self.flusher.release(path)
+                os.remove(path)
+                with self._segments_lock:
+                    segment = self._segments.pop(conversation_id, None)
+                    if segment is not None:
+                        self._cached_bytes -= segment.nbytes()
+            return super().create_conversation(user_id, title)
+
+    def append_message(self, conversation_id: int, role: str, content: str) -> Record:
+        # Before the segment append: the cache would only reject the role
+        # once the message is on disk
+        check_role(role)
+        # Make sure the conversation is cached first so the new message is
+        # not read back from the segment a second time
+        segment = self._segment(conversation_id)
+
+        with self._write_lock:
+            if self.next_message_id >= self.message_id_limit:
+                # Made durable before any message uses the ids, so they are
+                # never handed out twice
+                self._record(
+                    "message_ids_reserved", {"next_id": self.next_message_id + MESSAGE_ID_BLOCK}, sync=True
+                )
+            message = {
+                "id": self.next_message_id,
+                "content": content,
+                "role": role,
+                "conversation_id": conversation_id,
+                "created_at": datetime.utcnow().isoformat(),
+            }
+            self.next_message_id += 1
+            ticket = self._append_to_segment(message)
+            self._index_message(message)
+
+            with self._segments_lock:
+                # A reader that loaded the segment meanwhile may already
+                # have the message
+                if self._segments.get(conversation_id) is segment and segment.add(message):
+                    self._cached_bytes += message_bytes(content)
+                    self._segments.move_to_end(conversation_id)
+                    self._evict()
+            # Only once readers can see the message
+            self._bump_version(self.conversation_versions, conversation_id)
+        self._wait(ticket)
+        return message
+
+
+def segment_line(record: Record) -> str:
+    # The conversation id is implied by the file
+    data = {key: value for key, value in record.items() if key != "conversation_id"}
+    return json.dumps(data, separators=(",", ":")) + "\n"
@@ -0,0 +1,302 @@
+"""
+Indexed snapshot file for the JSON stores.
+
+A snapshot holds named sections, each a sorted table of key/value pairs.
+Every pair is one line, ``<key JSON>\\t<value JSON>\\n``, and each section
+has an array of line offsets (and, for integer keys, an array of the keys)
+so that a single record is found with a binary search and decoded on its
+own. The file is memory-mapped; opening it only reads the footer, so
+startup time no longer depends on the size of the data.
+
+Layout::
+
+    CHATSNAP1\\n
+    section lines ...
+    per section: uint64 line offsets (count + 1), int64 keys (int sections)
+    footer JSON {"sections": {...}, "meta": {...}}
+    uint64 offset of the footer
+
+The older users/conversations/messages.json files of a directory are
+converted with app.store.convert.
+"""
+import json
+import mmap
+import os
+from array import array
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+MAGIC = b"CHATSNAP1\n"
+
+# Disk key -> raw value bytes, in key order
+RawItems = Iterable[Tuple[Any, bytes]]
+
+
+def encode_value(value: Any) -> bytes:
+    return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+
+class Section:
+    """
+    One sorted key/value table inside a mapped snapshot
+    """
+
+    def __init__(self, buffer, key_type: str, count: int, offsets: int, keys: Optional[int]):
+        self.buffer = buffer
+        self.key_type = key_type
+        self.count = count
+        view = memoryview(buffer)
+        self.offsets = view[offsets:offsets + (count + 1) * 8].cast("Q")
+        self.keys = view[keys:keys + count * 8].cast("q") if keys is not None else None
+
+    def _line(self, index: int) -> bytes:
+        return self.buffer[self.offsets[index]:self.offsets[index + 1] - 1]
+
+    def key_at(self, index: int) -> Any:
+        if self.keys is not None:
+            return self.keys[index]
+        line = self._line(index)
+        return json.loads(line[:line.index(b"\t")])
+
+    def raw_value_at(self, index: int) -> bytes:
+        line = self._line(index)
+        return line[line.index(b"\t") + 1:]
+
+    def find(self, key: Any) -> int:
+        if self.keys is not None:
+            index = bisect_left(self.keys, key)
+        else:
+            lo, hi = 0, self.count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self.key_at(mid) < key:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            index = lo
+        if index < self.count and self.key_at(index) == key:
+            return index
+        return -1
+
+    def get(self, key: Any) -> Any:
+        index = self.find(key)
+        if index < 0:
+            raise KeyError(key)
+        return json.loads(self.raw_value_at(index))
+
+    def raw_items(self) -> RawItems:
+        for index in range(self.count):
+            yield self.key_at(index), self.raw_value_at(index)
+
+
+class Snapshot:
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            if os.name == "nt":
+                # A mapped file cannot be replaced on Windows, and the next
+                # snapshot is written over this one
+                self.buffer = f.read()
+            else:
+                self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a snapshot file")
+        footer_offset = int.from_bytes(self.buffer[-8:], "little")
+        footer = json.loads(self.buffer[footer_offset:-8])
+        self.meta: Dict[str, Any] = footer["meta"]
+        self.sections = {
+            name: Section(self.buffer, s["key"], s["count"], s["offsets"], s.get("keys"))
+            for name, s in footer["sections"].items()
+        }
+
+    def section(self, name: str) -> Optional[Section]:
+        return self.sections.get(name)
+
+    def close(self) -> None:
+        # Sections may still be referenced by tables; the mapping is
+        # released once they are gone
+        self.sections = {}
+
+
+def write_snapshot(path: str, sections: Dict[str, Tuple[str, RawItems]], meta: Dict[str, Any]) -> int:
+    """
+    Write ``sections`` (name -> (key type, items sorted by key)) to ``path``
+    atomically; returns the file size
+    """
+    tmp_path = path + ".tmp"
+    footer: Dict[str, Any] = {"sections": {}, "meta": meta}
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        index: List[Tuple[str, str, array, Optional[array]]] = []
+        for name, (key_type, items) in sections.items():
+            offsets = array("Q")
+            keys = array("q") if key_type == "int" else None
+            for key, raw_value in items:
+                offsets.append(f.tell())
+                if keys is not None:
+                    keys.append(key)
+                f.write(encode_value(key) + b"\t" + raw_value + b"\n")
+            offsets.append(f.tell())
+            index.append((name, key_type, offsets, keys))
+
+        for name, key_type, offsets, keys in index:
+            f.write(b"\0" * (-f.tell() % 8))
+            section = {"key": key_type, "count": len(offsets) - 1, "offsets": f.tell()}
+            f.write(offsets.tobytes())
+            if keys is not None:
+                section["keys"] = f.tell()
+                f.write(keys.tobytes())
+            footer["sections"][name] = section
+
+        footer_offset = f.tell()
+        f.write(encode_value(footer))
+        f.write(footer_offset.to_bytes(8, "little"))
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    os.replace(tmp_path, path)
+    return size
+
+
+class Table:
+    """
+    Dict-like view of a snapshot section with the changes made since it
+    was loaded kept in memory on top.
+
+    Keys are the store's in-memory keys (string ids for records);
+    ``to_disk`` maps them to the section's keys. Values read from the
+    snapshot are decoded on every access and never cached, so reading a
+    record costs a binary search and a ``json.loads`` but no memory.
+    Values that are mutated in place (the id lists of the indexes, the
+    message columns) must be obtained with ``setdefault``, which copies
+    them into the overlay, and the table must be ``mutable`` so that
+    snapshot copies copy them too. ``encode`` and ``decode`` convert
+    values that are not plain JSON.
+    """
+
+    def __init__(
+        self,
+        section: Optional[Section],
+        to_disk: Callable[[Any], Any] = lambda key: key,
+        from_disk: Callable[[Any], Any] = lambda key: key,
+        overlay: Optional[Dict[Any, Any]] = None,
+        mutable: bool = False,
+        encode: Optional[Callable[[Any], Any]] = None,
+        decode: Optional[Callable[[Any], Any]] = None,
+    ):
+        self.section = section
+        self.to_disk = to_disk
+        self.from_disk = from_disk
+        self.mutable = mutable
+        self.encode = encode
+        self.decode = decode
+        self.overlay: Dict[Any, Any] = overlay if overlay is not None else {}
+        # Keys in the overlay that are not in the section
+        self._added = len(self.overlay) if section is None else 0
+
+    def _in_section(self, key: Any) -> bool:
+        return self.section is not None and self.section.find(self.to_disk(key)) >= 0
+
+    def __getitem__(self, key: Any) -> Any:
+        if key in self.overlay:
+            return self.overlay[key]
+        if self.section is None:
+            raise KeyError(key)
+        value = self.section.get(self.to_disk(key))
+        return self.decode(value) if self.decode is not None else value
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self.overlay or self._in_section(key)
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        if key not in self.overlay and not self._in_section(key):
+            self._added += 1
+        self.overlay[key] = value
+
+    def setdefault(self, key: Any, default: Any = None) -> Any:
+        if key not in self.overlay:
+            self[key] = self.get(key, default)
+        return self.overlay[key]
+
+    def __len__(self) -> int:
+        return (self.section.count if self.section is not None else 0) + self._added
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __iter__(self) -> Iterator[Any]:
+        if self.section is not None:
+            for index in range(self.section.count):
+                key = self.from_disk(self.section.key_at(index))
+                if key not in self.overlay:
+                    yield key
+        yield from self.overlay
+
+    def keys(self) -> Iterator[Any]:
+        return iter(self)
+
+    def values(self) -> Iterator[Any]:
+        return (self[key] for key in self)
+
+    def items(self) -> Iterator[Tuple[Any, Any]]:
+        return ((key, self[key]) for key in self)
+
+    def copy(self) -> "Table":
+        # dict() copies atomically even while other threads insert; mutable
+        # values are copied as well since the store appends to them
+        overlay = dict(self.overlay)
+        if self.mutable:
+            for key, value in overlay.items():
+                overlay[key] = value.copy()
+        table = Table(self.section, self.to_disk, self.from_disk, overlay, self.mutable, self.encode, self.decode)
+        table._added = self._added
+        return table
+
+    def _encode(self, value: Any) -> bytes:
+        return encode_value(self.encode(value) if self.encode is not None else value)
+
+    def raw_items(self) -> RawItems:
+        """
+        All pairs in disk key order; values that were not changed are
+        copied from the snapshot without decoding them
+        """
+        changed = sorted(
+            ((self.to_disk(key), value) for key, value in self.overlay.items()),
+            key=lambda item: item[0],
+        )
+        base = self.section.raw_items() if self.section is not None else iter(())
+        position = 0
+        for disk_key, raw_value in base:
+            while position < len(changed) and changed[position][0] < disk_key:
+                yield changed[position][0], self._encode(changed[position][1])
+                position += 1
+            if position < len(changed) and changed[position][0] == disk_key:
+                yield disk_key, self._encode(changed[position][1])
+                position += 1
+            else:
+                yield disk_key, raw_value
+        for disk_key, value in changed[position:]:
+            yield disk_key, self._encode(value)
+
+
+def snapshot_table(
+    mapping: Any,
+    to_disk: Callable[[Any], Any] = lambda key: key,
+    mutable: bool = False,
+    encode: Optional[Callable[[Any], Any]] = None,
+) -> Table:
+    """
+    A Table over a copy of ``mapping`` (a Table or a plain dict) that is
+    safe to write while the store keeps changing
+    """
+    if isinstance(mapping, Table):
+        return mapping.copy()
+    return Table(None, to_disk, overlay=mapping, mutable=mutable, encode=encode).copy()
+
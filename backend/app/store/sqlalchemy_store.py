@@ -0,0 +1,282 @@
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import func, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.crud.chat import (
+    conversation_list_query, history_page_query, is_forward_page, save_summary, search_conversations,
+    touch_conversation,
+)
+from app.db.group_commit import GroupCommitWriter
+from app.db.migrations import migrate_engine
+from app.models.conversation import Conversation
+from app.models.message import Message
+from app.models.user import User
+from app.store.base import DuplicateUserError, Record, StorageBackend
+from app.store.metrics import STORAGE_LOAD_SECONDS
+from app.store.records import check_role
+
+
+class SqlAlchemyStore(StorageBackend):
+    """
+    Users, conversations and messages in the database of ``engine``,
+    through the models of ``app.models``; the backend of the app package.
+
+    Each call runs on a session of its own, and a write is committed before
+    it returns. With ``group_commit`` writes are instead handed to one
+    writer thread, which commits the writes of concurrent requests together
+    (see app.db.group_commit), waiting at most ``window`` seconds for up to
+    ``max_batch`` of them. Like ``sqlite``, several processes can share the
+    database: ids come from it and token revocations are stored in it.
+    """
+
+    shared = True
+
+    def __init__(self, engine: Engine, group_commit: bool = False, window: float = 0.002, max_batch: int = 64):
+        self.engine = engine
+        self.sessions = sessionmaker(bind=engine, autoflush=False)
+        self.writer = None
+        if group_commit:
+            self.writer = GroupCommitWriter(self.sessions, window=window, max_batch=max_batch)
+        # Session of the batch() this thread is in
+        self._local = threading.local()
+
+    def load(self) -> None:
+        with STORAGE_LOAD_SECONDS.time("sqlalchemy"):
+            migrate_engine(self.engine)
+
+    def close(self) -> None:
+        self.engine.dispose()
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        # One transaction, so a batch is also atomic; it leaves the writer
+        # thread out
+        with self.sessions() as db:
+            self._local.session = db
+            try:
+                yield
+                db.commit()
+            finally:
+                self._local.session = None
+
+    def _read(self, fn: Callable[..., Any], *args: Any) -> Any:
+        db = getattr(self._local, "session", None)
+        if db is not None:
+            return fn(db, *args)
+        with self.sessions() as db:
+            return fn(db, *args)
+
+    def _write(self, fn: Callable[..., Any], *args: Any) -> Any:
+        # fn(session, *args) must return plain values: the session is closed
+        # (or, in a batch, committed) by the time they are used
+        db = getattr(self._local, "session", None)
+        if db is not None:
+            return fn(db, *args)
+        if self.writer is not None:
+            return self.writer.submit(fn, *args).result()
+        with self.sessions() as db:
+            result = fn(db, *args)
+            db.commit()
+            return result
+
+    # Token revocations
+
+    def revoke_token(self, token_hash: bytes, expires_at: float) -> None:
+        try:
+            self._write(insert_revocation, token_hash, expires_at)
+        except IntegrityError:
+            # Revoked already
+            pass
+
+    def revoked_tokens(self, after: int = 0) -> Tuple[List[Tuple[bytes, float]], int]:
+        rows = self._read(lambda db: db.execute(
+            text("SELECT id, token_hash, expires_at FROM revoked_tokens WHERE id > :after ORDER BY id"),
+            {"after": after},
+        ).all())
+        if rows:
+            after = rows[-1].id
+        now = time.time()
+        return [(bytes(row.token_hash), row.expires_at) for row in rows if row.expires_at > now], after
+
+    # Users
+
+    def get_user(self, user_id: int) -> Optional[Record]:
+        return self._read(find_user, User.id == user_id)
+
+    def get_user_by_username(self, username: str) -> Optional[Record]:
+        return self._read(find_user, User.username == username)
+
+    def get_user_by_email(self, email: str) -> Optional[Record]:
+        return self._read(find_user, User.email == email)
+
+    def create_user(self, username: str, email: str, password: str) -> Record:
+        try:
+            return self._write(insert_user, username, email, password)
+        except IntegrityError as e:
+            # "UNIQUE constraint failed: users.username" on SQLite
+            raise DuplicateUserError("email" if "email" in str(e.orig) else "username") from e
+
+    def set_password(self, user_id: int, password: str) -> None:
+        self._write(update_password, user_id, password)
+
+    # Conversations
+
+    def get_conversation(self, conversation_id: int) -> Optional[Record]:
+        return self._read(lambda db: conversation_record(db.get(Conversation, conversation_id)))
+
+    def create_conversation(self, user_id: int, title: str) -> Record:
+        return self._write(insert_conversation, user_id, title)
+
+    def list_conversations(self, user_id: int) -> List[Record]:
+        return self._read(lambda db: [
+            conversation_record(conversation) for conversation in db.scalars(conversation_list_query(user_id))
+        ])
+
+    def touch_conversation(self, conversation_id: int) -> None:
+        self._write(touch_conversation, conversation_id)
+
+    def get_summary(self, conversation_id: int) -> Tuple[str, int]:
+        row = self._read(lambda db: db.execute(
+            select(Conversation.summary, Conversation.summary_until).where(Conversation.id == conversation_id)
+        ).first())
+        return (row.summary, row.summary_until) if row is not None else ("", 0)
+
+    def set_summary(self, conversation_id: int, summary: str, until: int) -> None:
+        self._write(save_summary, conversation_id, summary, until)
+
+    # Messages
+
+    def append_message(self, conversation_id: int, role: str, content: str) -> Record:
+        check_role(role)
+        return self._write(insert_message, conversation_id, role, content)
+
+    def list_messages(self, conversation_id: int) -> List[Record]:
+        return self._read(lambda db: [
+            message_record(message)
+            for message in db.scalars(
+                select(Message).where(Message.conversation_id == conversation_id).order_by(Message.id)
+            )
+        ])
+
+    def page_messages(
+        self,
+        conversation_id: int,
+        limit: int,
+        before: Optional[int] = None,
+        after: Optional[int] = None,
+    ) -> Tuple[List[Record], bool]:
+        messages = self._read(lambda db: [
+            message_record(message)
+            for message in db.scalars(history_page_query(conversation_id, limit, before=before, after=after))
+        ])
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        if not is_forward_page(before, after):
+            messages.reverse()
+        return messages, has_more
+
+    # Search
+
+    def search(self, user_id: int, query: str, limit: int) -> List[Record]:
+        return self._read(search_conversations, user_id, query, limit)
+
+    # Versions, from the stored rows as in the sqlite backend
+
+    def user_version(self, user_id: int) -> str:
+        row = self._read(lambda db: db.execute(
+            select(func.count(), func.max(Conversation.updated_at)).where(Conversation.user_id == user_id)
+        ).one())
+        return f"{row[0]}.{row[1]}"
+
+    def conversation_version(self, conversation_id: int) -> str:
+        newest = self._read(lambda db: db.scalar(
+            select(func.max(Message.id)).where(Message.conversation_id == conversation_id)
+        ))
+        return str(newest or 0)
+
+
+# Writes, run on the caller's session or the group commit writer's; they
+# flush to learn the new ids and leave the commit to the caller
+
+def insert_user(db: Session, username: str, email: str, password: str) -> Record:
+    user = User(username=username, email=email, hashed_password=password, is_active=True)
+    db.add(user)
+    db.flush()
+    return user_record(user)
+
+
+def update_password(db: Session, user_id: int, password: str) -> None:
+    user = db.get(User, user_id)
+    if user is not None:
+        user.hashed_password = password
+
+
+def insert_conversation(db: Session, user_id: int, title: str) -> Record:
+    now = datetime.utcnow()
+    conversation = Conversation(title=title, user_id=user_id, created_at=now, updated_at=now)
+    db.add(conversation)
+    db.flush()
+    return conversation_record(conversation)
+
+
+def insert_message(db: Session, conversation_id: int, role: str, content: str) -> Record:
+    message = Message(content=content, role=role, conversation_id=conversation_id, created_at=datetime.utcnow())
+    db.add(message)
+    db.flush()
+    return message_record(message)
+
+
+def insert_revocation(db: Session, token_hash: bytes, expires_at: float) -> None:
+    db.execute(text("DELETE FROM revoked_tokens WHERE expires_at <= :now"), {"now": time.time()})
+    db.execute(
+        text("INSERT INTO revoked_tokens (token_hash, expires_at) VALUES (:token_hash, :expires_at)"),
+        {"token_hash": token_hash, "expires_at": expires_at},
+    )
+
+
+def find_user(db: Session, condition: Any) -> Optional[Record]:
+    # Deactivated users cannot log in or authenticate
+    user = db.scalars(select(User).where(condition, User.is_active.isnot(False))).first()
+    return user_record(user) if user is not None else None
+
+
+def user_record(user: User) -> Record:
+    return {
+        "id": user.id,
+        "username": user.username,
+        "email": user.email,
+        "password": user.hashed_password,
+    }
+
+
+def conversation_record(conversation: Optional[Conversation]) -> Optional[Record]:
+    if conversation is None:
+        return None
+    return {
+        "id": conversation.id,
+        "title": conversation.title,
+        "user_id": conversation.user_id,
+        "created_at": iso(conversation.created_at),
+        "updated_at": iso(conversation.updated_at),
+    }
+
+
+def message_record(message: Message) -> Record:
+    return {
+        "id": message.id,
+        "content": message.content,
+        "role": message.role,
+        "conversation_id": message.conversation_id,
+        "created_at": iso(message.created_at),
+    }
+
+
+def iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value is not None else None
@@ -0,0 +1,410 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from sqlalchemy import create_engine
+
+from app.core.search import MAX_HITS, SEARCH_SQL, fts_match, group_hits, query_terms, search_result
+from app.db.migrations import migrate_engine
+from app.store.base import DuplicateUserError, Record, StorageBackend
+from app.store.durability import DURABILITY_MODES
+from app.store.locking import FileLock
+from app.store.metrics import STORAGE_LOAD_SECONDS
+from app.store.records import check_role
+
+# Applied to every connection. WAL lets readers run alongside the single
+# writer.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",  # KiB
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA foreign_keys=ON",
+)
+
+# SQLite's own setting for each durability mode. FULL fsyncs the WAL on
+# every commit. NORMAL only fsyncs it at checkpoints, so a power loss can
+# drop the commits since the last checkpoint (up to about 1000 pages) but
+# never corrupts the database. OFF leaves flushing to the OS.
+SYNCHRONOUS = {"sync": "FULL", "batched": "NORMAL", "async": "OFF"}
+
+
+class ConnectionPool:
+    """
+    Up to ``size`` SQLite connections shared by the threads of one process.
+
+    A thread borrows a connection for each statement and gives it back, so
+    the number of open connections (and file handles and page caches) per
+    worker stays bounded however many threads serve requests; threads
+    wait for a free connection beyond that.
+    """
+
+    def __init__(self, connect: Callable[[], sqlite3.Connection], size: int):
+        self._connect = connect
+        self.size = size
+        self._opened = 0
+        # Most recently returned last, so the warm connections get reused
+        self._idle: List[sqlite3.Connection] = []
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._waiting = 0
+
+    def acquire(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+            while self._opened >= self.size:
+                self._waiting += 1
+                self._available.wait()
+                self._waiting -= 1
+                if self._idle:
+                    return self._idle.pop()
+            self._opened += 1
+        # Connect outside the lock, in the slot reserved above
+        try:
+            connection = self._connect()
+        except BaseException:
+            with self._lock:
+                self._opened -= 1
+                self._available.notify()
+            raise
+        with self._lock:
+            self._connections.append(connection)
+        return connection
+
+    def release(self, connection: sqlite3.Connection) -> None:
+        with self._lock:
+            self._idle.append(connection)
+            if self._waiting:
+                self._available.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self) -> None:
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+            self._idle = []
+            self._opened = 0
+
+
+class SqliteStore(StorageBackend):
+    """
+    Users, conversations and messages in a SQLite database.
+
+    Uses the same tables as ``app.models`` (the schema is applied with
+    ``app.db.migrations``), so one database can be served by either app,
+    and searches the same ``messages_fts`` table, which triggers keep in
+    sync with the messages. Statements run on a pool of up to
+    ``pool_size`` connections; writes commit immediately, and SQLite
+    serializes them and assigns the ids. Versions for conditional requests
+    are derived from the stored rows rather than counted.
+
+    Several processes can serve the same database (``shared``): WAL lets
+    their readers run alongside the one writer, ids come from SQLite, and
+    token revocations are stored so that every process sees them.
+    """
+
+    shared = True
+
+    def __init__(self, path: str, durability: str = "sync", pool_size: int = 8):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode {durability!r}; expected one of {', '.join(DURABILITY_MODES)}")
+        self.path = path
+        self.synchronous = SYNCHRONOUS[durability]
+        self.pool = ConnectionPool(self._connect, pool_size)
+        # Connection pinned by transaction(), per thread
+        self._local = threading.local()
+
+    def load(self) -> None:
+        engine = create_engine(f"sqlite:///{self.path}")
+        try:
+            with STORAGE_LOAD_SECONDS.time("sqlite"):
+                # Workers starting together would otherwise race to apply
+                # the same migration
+                with FileLock(self.path + ".migrate.lock"):
+                    migrate_engine(engine)
+        finally:
+            engine.dispose()
+
+    def close(self) -> None:
+        self.pool.close()
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """
+        Run the calls this thread makes in the block as one transaction,
+        committed at the end (or rolled back on an exception)
+        """
+        with self.pool.connection() as connection:
+            self._local.connection = connection
+            try:
+                connection.execute("BEGIN IMMEDIATE")
+                try:
+                    yield
+                except BaseException:
+                    connection.execute("ROLLBACK")
+                    raise
+                connection.execute("COMMIT")
+            finally:
+                self._local.connection = None
+
+    def batch(self) -> Iterator[None]:
+        # One transaction, so a batch is also atomic
+        return self.transaction()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            connection.execute(pragma)
+        connection.execute(f"PRAGMA synchronous={self.synchronous}")
+        return connection
+
+    def _execute(self, sql: str, params: Union[Sequence[Any], Dict[str, Any]], result: Callable[[sqlite3.Cursor], Any]) -> Any:
+        # The result is read before the connection goes back to the pool
+        pinned = getattr(self._local, "connection", None)
+        if pinned is not None:
+            return result(pinned.execute(sql, params))
+        connection = self.pool.acquire()
+        try:
+            return result(connection.execute(sql, params))
+        finally:
+            self.pool.release(connection)
+
+    def _one(self, sql: str, *params: Any) -> Optional[sqlite3.Row]:
+        return self._execute(sql, params, sqlite3.Cursor.fetchone)
+
+    def _all(self, sql: str, *params: Any) -> List[sqlite3.Row]:
+        return self._execute(sql, params, sqlite3.Cursor.fetchall)
+
+    def _insert(self, sql: str, *params: Any) -> int:
+        return self._execute(sql, params, lambda cursor: cursor.lastrowid)
+
+    def _update(self, sql: str, *params: Any) -> int:
+        return self._execute(sql, params, lambda cursor: cursor.rowcount)
+
+    # Token revocations
+
+    def revoke_token(self, token_hash: bytes, expires_at: float) -> None:
+        self._update("DELETE FROM revoked_tokens WHERE expires_at <= ?", time.time())
+        self._update(
+            "INSERT OR IGNORE INTO revoked_tokens (token_hash, expires_at) VALUES (?, ?)",
+            token_hash, expires_at,
+        )
+
+    def revoked_tokens(self, after: int = 0) -> Tuple[List[Tuple[bytes, float]], int]:
+        rows = self._all(
+            "SELECT id, token_hash, expires_at FROM revoked_tokens WHERE id > ? ORDER BY id", after
+        )
+        if rows:
+            after = rows[-1]["id"]
+        now = time.time()
+        return [(bytes(row["token_hash"]), row["expires_at"]) for row in rows if row["expires_at"] > now], after
+
+    # Users
+
+    def get_user(self, user_id: int) -> Optional[Record]:
+        return user_record(self._one(USER_SELECT + " WHERE id = ? AND " + ACTIVE, user_id))
+
+    def get_user_by_username(self, username: str) -> Optional[Record]:
+        return user_record(self._one(USER_SELECT + " WHERE username = ? AND " + ACTIVE, username))
+
+    def get_user_by_email(self, email: str) -> Optional[Record]:
+        return user_record(self._one(USER_SELECT + " WHERE email = ? AND " + ACTIVE, email))
+
+    def create_user(self, username: str, email: str, password: str) -> Record:
+        try:
+            user_id = self._insert(
+                "INSERT INTO users (username, email, hashed_password, is_active) VALUES (?, ?, ?, 1)",
+                username, email, password,
+            )
+        except sqlite3.IntegrityError as e:
+            # "UNIQUE constraint failed: users.username"
+            raise DuplicateUserError("email" if "users.email" in str(e) else "username") from e
+        return {"id": user_id, "username": username, "email": email, "password": password}
+
+    def set_password(self, user_id: int, password: str) -> None:
+        self._update("UPDATE users SET hashed_password = ? WHERE id = ?", password, user_id)
+
+    # Conversations
+
+    def get_conversation(self, conversation_id: int) -> Optional[Record]:
+        return conversation_record(
+            self._one(CONVERSATION_SELECT + " WHERE id = ?", conversation_id)
+        )
+
+    def create_conversation(self, user_id: int, title: str) -> Record:
+        now = datetime.utcnow()
+        conversation_id = self._insert(
+            "INSERT INTO conversations (title, user_id, created_at, updated_at) VALUES (?, ?, ?, ?)",
+            title, user_id, to_sql(now), to_sql(now),
+        )
+        return {
+            "id": conversation_id,
+            "title": title,
+            "user_id": user_id,
+            "created_at": now.isoformat(),
+            "updated_at": now.isoformat(),
+        }
+
+    def list_conversations(self, user_id: int) -> List[Record]:
+        rows = self._all(
+            CONVERSATION_SELECT + " WHERE user_id = ? ORDER BY updated_at DESC", user_id
+        )
+        return [conversation_record(row) for row in rows]
+
+    def touch_conversation(self, conversation_id: int) -> None:
+        self._update(
+            "UPDATE conversations SET updated_at = ? WHERE id = ?",
+            to_sql(datetime.utcnow()), conversation_id,
+        )
+
+    def get_summary(self, conversation_id: int) -> Tuple[str, int]:
+        row = self._one("SELECT summary, summary_until FROM conversations WHERE id = ?", conversation_id)
+        return (row["summary"], row["summary_until"]) if row is not None else ("", 0)
+
+    def set_summary(self, conversation_id: int, summary: str, until: int) -> None:
+        self._update(
+            "UPDATE conversations SET summary = ?, summary_until = ? WHERE id = ?",
+            summary, until, conversation_id,
+        )
+
+    # Messages
+
+    def append_message(self, conversation_id: int, role: str, content: str) -> Record:
+        check_role(role)
+        now = datetime.utcnow()
+        message_id = self._insert(
+            "INSERT INTO messages (content, role, conversation_id, created_at) VALUES (?, ?, ?, ?)",
+            content, role, conversation_id, to_sql(now),
+        )
+        return {
+            "id": message_id,
+            "content": content,
+            "role": role,
+            "conversation_id": conversation_id,
+            "created_at": now.isoformat(),
+        }
+
+    def list_messages(self, conversation_id: int) -> List[Record]:
+        rows = self._all(MESSAGE_SELECT + " WHERE conversation_id = ? ORDER BY id", conversation_id)
+        return [message_record(row) for row in rows]
+
+    def page_messages(
+        self,
+        conversation_id: int,
+        limit: int,
+        before: Optional[int] = None,
+        after: Optional[int] = None,
+    ) -> Tuple[List[Record], bool]:
+        sql = MESSAGE_SELECT + " WHERE conversation_id = ?"
+        params: List[Any] = [conversation_id]
+        if before is not None:
+            sql += " AND id < ?"
+            params.append(before)
+        if after is not None:
+            sql += " AND id > ?"
+            params.append(after)
+
+        # Fetch one extra row to learn whether there is another page
+        forward = after is not None and before is None
+        sql += " ORDER BY id " + ("ASC" if forward else "DESC") + " LIMIT ?"
+        params.append(limit + 1)
+
+        rows = self._all(sql, *params)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if not forward:
+            rows.reverse()
+        return [message_record(row) for row in rows], has_more
+
+    # Search
+
+    def search(self, user_id: int, query: str, limit: int) -> List[Record]:
+        terms = query_terms(query)
+        if not terms:
+            return []
+        hits = self._execute(
+            SEARCH_SQL, {"match": fts_match(user_id, terms), "limit": MAX_HITS}, sqlite3.Cursor.fetchall
+        )
+        return [
+            search_result(group[0]["title"], group, lambda hit: hit["snippet"])
+            for group in group_hits(hits, limit)
+        ]
+
+
+    # Versions
+
+    def user_version(self, user_id: int) -> str:
+        # Read from the (user_id, updated_at) index alone; stored, so every
+        # process agrees on it
+        row = self._one("SELECT count(*), max(updated_at) FROM conversations WHERE user_id = ?", user_id)
+        return f"{row[0]}.{row[1]}"
+
+    def conversation_version(self, conversation_id: int) -> str:
+        # Messages are only ever appended, so the newest id identifies the
+        # contents; read from the (conversation_id, id) index
+        row = self._one("SELECT max(id) FROM messages WHERE conversation_id = ?", conversation_id)
+        return str(row[0] or 0)
+
+
+USER_SELECT = "SELECT id, username, email, hashed_password FROM users"
+# Deactivated users cannot log in or authenticate
+ACTIVE = "is_active IS NOT 0"
+CONVERSATION_SELECT = "SELECT id, title, user_id, created_at, updated_at FROM conversations"
+MESSAGE_SELECT = "SELECT id, content, role, conversation_id, created_at FROM messages"
+
+
+def to_sql(value: datetime) -> str:
+    # The format SQLAlchemy uses for DateTime columns on SQLite
+    return value.isoformat(" ")
+
+
+def from_sql(value: Optional[str]) -> Optional[str]:
+    return value.replace(" ", "T", 1) if value is not None else None
+
+
+def user_record(row: Optional[sqlite3.Row]) -> Optional[Record]:
+    if row is None:
+        return None
+    return {
+        "id": row["id"],
+        "username": row["username"],
+        "email": row["email"],
+        "password": row["hashed_password"],
+    }
+
+
+def conversation_record(row: Optional[sqlite3.Row]) -> Optional[Record]:
+    if row is None:
+        return None
+    return {
+        "id": row["id"],
+        "title": row["title"],
+        "user_id": row["user_id"],
+        "created_at": from_sql(row["created_at"]),
+        "updated_at": from_sql(row["updated_at"]),
+    }
+
+
+def message_record(row: sqlite3.Row) -> Record:
+    return {
+        "id": row["id"],
+        "content": row["content"],
+        "role": row["role"],
+        "conversation_id": row["conversation_id"],
+        "created_at": from_sql(row["created_at"]),
+    }
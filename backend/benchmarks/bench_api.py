@@ -0,0 +1,345 @@
+"""
+Latency and throughput of the chat API endpoints as the data grows.
+
+Seeds a dataset of users, conversations per user and messages per
+conversation, then drives /auth/login, /auth/me, /chat/, /chat/conversations
+and /chat/history/{id} at each concurrency level and reports requests per
+second and p50/p95/p99 latency per endpoint. Both apps are covered: `main`
+(backend/main.py, with STORAGE_BACKEND from --storage) and `app` (the same
+routes on the app package's SQLAlchemy database). Each target runs
+in-process through httpx's ASGI transport in its own subprocess with fresh
+data; --url drives an already running server instead and seeds it through
+the API.
+
+Results can be written as JSON and two result files compared; the compare
+run exits with status 1 when an endpoint got slower than --threshold.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_api --users 20 --conversations 5 --messages 50 --concurrency 1 10 --output base.json
+    python -m benchmarks.bench_api --compare base.json new.json --threshold 0.1
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List
+
+TARGETS = ("main", "app")
+ENDPOINTS = ("login", "me", "chat", "conversations", "history")
+PASSWORD = "bench-password"
+
+# Users that get a token; requests are spread over them round robin
+TOKEN_USERS = 8
+
+
+def username(i: int) -> str:
+    return f"bench{i}"
+
+
+def percentile(samples: List[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def summarize(latencies: List[float], elapsed: float, errors: int) -> Dict[str, float]:
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+# Seeding
+
+def seed_main(users: int, conversations: int, messages: int) -> None:
+    # Write straight to the store, bypassing the journal and per-row
+    # commits, or seeding large datasets would take longer than the run
+    import main
+    from app.store import MemoryStore, SqliteStore
+
+    store = main.store
+    if isinstance(store, SqliteStore):
+        with store.transaction():
+            seed_store(store, users, conversations, messages)
+        return
+
+    if isinstance(store, MemoryStore):
+        store._record = lambda op, data, sync=False: store._apply(op, data)
+    seed_store(store, users, conversations, messages)
+    if isinstance(store, MemoryStore):
+        del store._record
+        store.save()
+
+
+def seed_store(store, users: int, conversations: int, messages: int) -> None:
+    for u in range(users):
+        user = store.create_user(username(u), f"{username(u)}@example.com", PASSWORD)
+        for c in range(conversations):
+            conversation = store.create_conversation(user["id"], f"conversation {c}")
+            for m in range(messages):
+                role = "user" if m % 2 == 0 else "assistant"
+                store.append_message(conversation["id"], role, f"message {m}")
+
+
+def seed_app(users: int, conversations: int, messages: int) -> None:
+    from sqlalchemy import insert
+
+    from app.core.security import get_password_hash
+    from app.db.database import SessionLocal
+    from app.models import Conversation, Message, User
+
+    # One hash for everybody; bcrypt per user would dominate seeding
+    hashed_password = get_password_hash(PASSWORD)
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        db.execute(insert(User), [
+            {"id": u + 1, "username": username(u), "email": f"{username(u)}@example.com",
+             "hashed_password": hashed_password, "is_active": True}
+            for u in range(users)
+        ])
+        db.execute(insert(Conversation), [
+            {"id": u * conversations + c + 1, "title": f"conversation {c}", "user_id": u + 1,
+             "created_at": now, "updated_at": now}
+            for u in range(users) for c in range(conversations)
+        ])
+        rows = []
+        for conversation_id in range(1, users * conversations + 1):
+            for m in range(messages):
+                rows.append({"content": f"message {m}", "role": "user" if m % 2 == 0 else "assistant",
+                             "conversation_id": conversation_id, "created_at": now})
+                if len(rows) >= 10000:
+                    db.execute(insert(Message), rows)
+                    rows = []
+        if rows:
+            db.execute(insert(Message), rows)
+        db.commit()
+    finally:
+        db.close()
+
+
+async def seed_api(client, users: int, conversations: int, messages: int) -> None:
+    for u in range(users):
+        await client.post("/api/v1/auth/register", json={
+            "username": username(u), "email": f"{username(u)}@example.com", "password": PASSWORD,
+        })
+        headers = await login(client, u)
+        for c in range(conversations):
+            conversation_id = None
+            # Every chat turn adds the message and its reply
+            for m in range(max(1, messages // 2)):
+                response = await client.post("/api/v1/chat/", json={
+                    "message": f"message {m}", "conversation_id": conversation_id,
+                }, headers=headers)
+                conversation_id = response.json()["conversation_id"]
+
+
+# Load generation
+
+async def login(client, u: int) -> Dict[str, str]:
+    response = await client.post("/api/v1/auth/login", data={"username": username(u), "password": PASSWORD})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def measure(client, endpoint: str, sessions: list, concurrency: int, total: int) -> Dict[str, float]:
+    latencies: List[float] = []
+    errors = 0
+    remaining = total
+
+    async def request(i: int):
+        u, headers, conversation_ids = sessions[i % len(sessions)]
+        conversation_id = random.choice(conversation_ids)
+        if endpoint == "login":
+            return await client.post("/api/v1/auth/login", data={"username": username(u), "password": PASSWORD})
+        if endpoint == "me":
+            return await client.get("/api/v1/auth/me", headers=headers)
+        if endpoint == "chat":
+            return await client.post("/api/v1/chat/", json={
+                "message": "hello", "conversation_id": conversation_id,
+            }, headers=headers)
+        if endpoint == "conversations":
+            return await client.get("/api/v1/chat/conversations", headers=headers)
+        return await client.get(f"/api/v1/chat/history/{conversation_id}", headers=headers)
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            response = await request(remaining)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+async def run_target(target: str, args) -> dict:
+    import httpx
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=60)
+        app = None
+    else:
+        if target == "main":
+            from main import app
+        else:
+            from app.main import app
+        await app.router.startup()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench")
+
+    try:
+        seed_start = time.perf_counter()
+        if args.url:
+            await seed_api(client, args.users, args.conversations, args.messages)
+        elif target == "main":
+            seed_main(args.users, args.conversations, args.messages)
+        else:
+            seed_app(args.users, args.conversations, args.messages)
+        seed_time = time.perf_counter() - seed_start
+
+        sessions = []
+        for u in range(min(args.users, TOKEN_USERS)):
+            headers = await login(client, u)
+            response = await client.get("/api/v1/chat/conversations", headers=headers)
+            conversation_ids = [conv["id"] for conv in response.json()["conversations"]]
+            sessions.append((u, headers, conversation_ids))
+
+        results: Dict[str, Dict[str, dict]] = {}
+        for endpoint in args.endpoints:
+            total = args.login_requests if endpoint == "login" else args.requests
+            results[endpoint] = {
+                str(c): await measure(client, endpoint, sessions, c, total) for c in args.concurrency
+            }
+    finally:
+        await client.aclose()
+        if app is not None:
+            await app.router.shutdown()
+
+    return {"seed_seconds": seed_time, "endpoints": results}
+
+
+# Reporting
+
+def print_results(results: dict) -> None:
+    for target, run in results["targets"].items():
+        print(f"\n{target} (seeded in {run['seed_seconds']:.1f}s)")
+        print(f"{'endpoint':>14} {'conc':>5} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        for endpoint, levels in run["endpoints"].items():
+            for concurrency, r in levels.items():
+                print(
+                    f"{endpoint:>14} {concurrency:>5} {r['throughput']:>9.1f} {r['p50_ms']:>8.2f} "
+                    f"{r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['errors']:>7}"
+                )
+
+
+def compare(base_path: str, new_path: str, threshold: float) -> int:
+    """
+    Print the change in p95 and throughput per endpoint; returns the number
+    of regressions beyond the threshold
+    """
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    regressions = 0
+    print(f"{'target':>6} {'endpoint':>14} {'conc':>5} {'p95 base':>9} {'p95 new':>9} {'req/s base':>11} {'req/s new':>10}")
+    for target, run in new["targets"].items():
+        base_run = base["targets"].get(target)
+        if base_run is None:
+            continue
+        for endpoint, levels in run["endpoints"].items():
+            for concurrency, r in levels.items():
+                b = base_run["endpoints"].get(endpoint, {}).get(concurrency)
+                if b is None:
+                    continue
+                slower = r["p95_ms"] > b["p95_ms"] * (1 + threshold)
+                fewer = r["throughput"] < b["throughput"] * (1 - threshold)
+                flag = "  REGRESSION" if slower or fewer else ""
+                regressions += bool(flag)
+                print(
+                    f"{target:>6} {endpoint:>14} {concurrency:>5} {b['p95_ms']:>9.2f} {r['p95_ms']:>9.2f} "
+                    f"{b['throughput']:>11.1f} {r['throughput']:>10.1f}{flag}"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--targets", nargs="+", default=list(TARGETS), choices=TARGETS)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--conversations", type=int, default=5, help="conversations per user")
+    parser.add_argument("--messages", type=int, default=50, help="messages per conversation")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10])
+    parser.add_argument("--requests", type=int, default=500, help="requests per endpoint and concurrency level")
+    parser.add_argument("--login-requests", type=int, default=50, help="login requests (bcrypt is slow)")
+    parser.add_argument("--endpoints", nargs="+", default=list(ENDPOINTS), choices=ENDPOINTS)
+    parser.add_argument("--storage", default="json", help="STORAGE_BACKEND for the main target")
+    parser.add_argument("--url", help="benchmark a running server instead, e.g. http://127.0.0.1:8000")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="compare two result files")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed relative slowdown")
+    parser.add_argument("--child", choices=TARGETS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        regressions = compare(*args.compare, args.threshold)
+        print(f"\n{regressions} regression(s) beyond {args.threshold:.0%}")
+        sys.exit(1 if regressions else 0)
+
+    if args.child:
+        print(json.dumps(asyncio.run(run_target(args.child, args))))
+        return
+
+    results = {
+        "created_at": datetime.utcnow().isoformat(),
+        "dataset": {"users": args.users, "conversations": args.conversations, "messages": args.messages},
+        "concurrency": args.concurrency,
+        "targets": {},
+    }
+    # Each target runs in its own process since both read their settings at
+    # import time, and against its own fresh data
+    child_args = [
+        "--users", str(args.users), "--conversations", str(args.conversations),
+        "--messages", str(args.messages), "--requests", str(args.requests),
+        "--login-requests", str(args.login_requests),
+        "--concurrency", *map(str, args.concurrency), "--endpoints", *args.endpoints,
+    ]
+    if args.url:
+        child_args += ["--url", args.url]
+    for target in args.targets:
+        with tempfile.TemporaryDirectory() as data_dir:
+            env = dict(
+                os.environ,
+                DATA_DIR=data_dir,
+                STORAGE_BACKEND=args.storage,
+                DATABASE_URL=f"sqlite:///{data_dir}/bench.db",
+            )
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_api", "--child", target, *child_args],
+                env=env, check=True, capture_output=True, text=True,
+            ).stdout
+            results["targets"][target] = json.loads(output.strip().splitlines()[-1])
+
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
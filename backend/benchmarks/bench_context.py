@@ -0,0 +1,121 @@
+"""
+Cost of assembling a reply's context as a conversation grows: reading the
+whole history vs app.llm.context's incrementally maintained window.
+
+For each history length, fills one conversation of a store, then times
+per turn:
+
+- reload: list_messages and keep the newest messages within the budget,
+  which is what a handler has to do without a window,
+- window: the cached window's context, plus adding the turn's two
+  messages to it,
+- rebuild: the window rebuilt from the stored summary and the messages
+  after it, as after an eviction or a restart.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_context --messages 100 1000 10000 100000
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+from typing import Callable, Dict, Iterator, List
+
+from app.llm.context import ContextWindows
+from app.store import MemoryStore, SqliteStore, StorageBackend
+from app.store.base import Record
+
+PAGE = 500
+
+
+def messages_after(store: StorageBackend, conversation_id: int, after: int) -> Iterator[Record]:
+    has_more = True
+    while has_more:
+        page, has_more = store.page_messages(conversation_id, PAGE, after=after)
+        yield from page
+        if page:
+            after = page[-1]["id"]
+
+
+def reload(store: StorageBackend, conversation_id: int, budget: int) -> List[Dict[str, str]]:
+    context, size = [], 0
+    for message in reversed(store.list_messages(conversation_id)):
+        size += len(message["content"])
+        if size > budget:
+            break
+        context.append({"role": message["role"], "content": message["content"]})
+    context.reverse()
+    return context
+
+
+def timed(fn: Callable[[], None], repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def measure(name: str, store: StorageBackend, messages: int, args) -> None:
+    user = store.create_user(f"user{messages}", f"user{messages}@example.com", "secret")
+    conversation_id = store.create_conversation(user["id"], "long conversation")["id"]
+    with store.batch():
+        for i in range(messages):
+            role = "user" if i % 2 == 0 else "assistant"
+            store.append_message(conversation_id, role, f"message {i} " + "with some words " * (i % 10 + 1))
+
+    windows = ContextWindows(args.budget)
+
+    def rebuild() -> None:
+        windows.clear()
+        summary, until = store.get_summary(conversation_id)
+        _, summary = windows.build(conversation_id, summary, until, messages_after(store, conversation_id, until))
+        if summary is not None:
+            store.set_summary(conversation_id, *summary)
+
+    # The first build folds the whole history into the summary, once
+    start = time.perf_counter()
+    rebuild()
+    first_build = time.perf_counter() - start
+
+    next_id = [10 ** 9]
+
+    def window_turn() -> None:
+        windows.get(conversation_id)
+        for role in ("user", "assistant"):
+            next_id[0] += 1
+            windows.append(conversation_id, [{"id": next_id[0], "role": role, "content": "a new message " * 5}])
+
+    reload_time = timed(lambda: reload(store, conversation_id, args.budget), args.repeat)
+    window_time = timed(window_turn, args.repeat * 10)
+    rebuild_time = timed(rebuild, args.repeat)
+    print(f"{name:>8} {messages:>9,} {reload_time * 1e6:>11.0f} {window_time * 1e6:>11.1f} "
+          f"{rebuild_time * 1e6:>11.0f} {first_build * 1000:>14.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", nargs="+", type=int, default=[100, 1000, 10000, 100000])
+    parser.add_argument("--budget", type=int, default=8000, help="characters")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--skip-sqlite", action="store_true")
+    args = parser.parse_args()
+
+    print(f"{'store':>8} {'messages':>9} {'reload us':>11} {'window us':>11} {'rebuild us':>11} "
+          f"{'first build ms':>14}")
+    for messages in args.messages:
+        measure("memory", MemoryStore(), messages, args)
+    if args.skip_sqlite:
+        return
+    with tempfile.TemporaryDirectory() as data_dir:
+        store = SqliteStore(os.path.join(data_dir, "chat.db"), durability="async")
+        store.load()
+        for messages in args.messages:
+            measure("sqlite", store, messages, args)
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
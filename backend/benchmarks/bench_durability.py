@@ -0,0 +1,55 @@
+"""
+Write throughput of the persistent storage backends in each durability mode.
+
+Runs the chat workload of bench_storage (register users, then chat turns
+of two appended messages and a conversation touch) against the json,
+sharded and sqlite backends in sync, batched and async mode, and reports
+chat turns per second and the fsyncs issued per turn.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_durability --users 20 --turns 100 --threads 1 8
+"""
+import argparse
+import tempfile
+
+from app.store import DURABILITY_MODES, create_store
+from app.store.metrics import STORAGE_FSYNCS
+from benchmarks.bench_storage import run_workload
+
+BACKENDS = ("json", "sharded", "sqlite")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--modes", nargs="+", default=list(DURABILITY_MODES), choices=DURABILITY_MODES)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=100, help="chat turns per user")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--flush-interval-ms", type=int, default=50)
+    parser.add_argument("--flush-every", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'backend':>8} {'mode':>8} {'threads':>8} {'turns/s':>10} {'fsyncs/turn':>12}")
+    for backend in args.backends:
+        for mode in args.modes:
+            for threads in args.threads:
+                with tempfile.TemporaryDirectory() as data_dir:
+                    store = create_store(
+                        backend, data_dir, durability=mode,
+                        flush_interval=args.flush_interval_ms / 1000, flush_every=args.flush_every,
+                    )
+                    store.load()
+                    fsyncs = STORAGE_FSYNCS.value(mode)
+                    try:
+                        result = run_workload(store, args.users, args.turns, threads)
+                    finally:
+                        store.close()
+                    # SQLite syncs on its own and is not counted
+                    per_turn = (STORAGE_FSYNCS.value(mode) - fsyncs) / (args.users * args.turns)
+                fsync_column = f"{per_turn:>12.2f}" if backend != "sqlite" else f"{'-':>12}"
+                print(f"{backend:>8} {mode:>8} {threads:>8} {result['chat']:>10.0f} {fsync_column}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Throughput and memory of main.py's /chat/export and /chat/import.
+
+For each backend and history size, seeds one user with that many messages,
+streams /chat/export to a file, and uploads the file in chunks to
+/chat/import for a second user. Reports messages per second for each, and
+the peak memory allocated while the request runs (tracemalloc, measured in
+a separate pass). The peak memory of an export, and of an import into
+sqlite, should stay the same whatever the size of the history; the other
+stores keep the imported messages, and their search index, in memory.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_export --messages 10000 100000 1000000
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from app.store import STORAGE_BACKENDS
+
+MESSAGES_PER_CONVERSATION = 1000
+CHUNK_BYTES = 64 * 1024
+PASSWORD = "export-password"
+
+
+def seed(store, messages: int) -> None:
+    user = store.create_user("user0", "user0@example.com", PASSWORD)
+    for start in range(0, messages, MESSAGES_PER_CONVERSATION):
+        conversation = store.create_conversation(user["id"], f"conversation {start}")
+        with store.batch():
+            for i in range(start, min(start + MESSAGES_PER_CONVERSATION, messages)):
+                role = "user" if i % 2 == 0 else "assistant"
+                store.append_message(conversation["id"], role, f"message {i} with some text to make it look like chat")
+
+
+async def call(app, method: str, path: str, token: str, chunks, write) -> int:
+    # Straight through ASGI, as a server would, so that neither side of
+    # the body is buffered by a test client
+    body_sent = False
+    done = asyncio.Event()
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            chunk = await chunks.__anext__() if chunks is not None else None
+            if chunk is not None:
+                return {"type": "http.request", "body": chunk, "more_body": True}
+            body_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Then the client stays connected until the response is complete
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    status = 0
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            write(message.get("body", b""))
+            if not message.get("more_body", False):
+                done.set()
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method,
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "headers": [(b"host", b"bench"), (b"authorization", f"Bearer {token}".encode())],
+        "client": ("127.0.0.1", 1), "server": ("bench", 80),
+    }
+    await app(scope, receive, send)
+    return status
+
+
+async def measure(messages: int, data_dir: str) -> None:
+    import main
+    from app.api.v1.api import create_access_token
+
+    seed(main.store, messages)
+    # user0 exports, user1 and user2 import
+    users = [main.store.get_user_by_username("user0")]
+    users += [main.store.create_user(f"user{u}", f"user{u}@example.com", PASSWORD) for u in (1, 2)]
+    tokens = [create_access_token(main.settings, {"sub": str(user["id"])}) for user in users]
+    await main.app.router.startup()
+    path = os.path.join(data_dir, "export.ndjson")
+
+    async def export() -> None:
+        with open(path, "wb") as f:
+            assert await call(main.app, "GET", "/api/v1/chat/export", tokens[0], None, f.write) == 200
+
+    async def upload():
+        with open(path, "rb") as f:
+            while chunk := f.read(CHUNK_BYTES):
+                yield chunk
+        yield None
+
+    async def import_as(u: int) -> None:
+        body = bytearray()
+        assert await call(main.app, "POST", "/api/v1/chat/import", tokens[u], upload(), body.extend) == 200, body
+        assert json.loads(body)["messages"] == messages, body
+
+    try:
+        results = []
+        for name, run, traced_run in (
+            ("export", export, export),
+            ("import", lambda: import_as(1), lambda: import_as(2)),
+        ):
+            start = time.perf_counter()
+            await run()
+            elapsed = time.perf_counter() - start
+            tracemalloc.start()
+            await traced_run()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results.append(f"{name} {messages / elapsed:>9,.0f} msg/s {peak / 2**20:>6.1f} MiB")
+        size = os.path.getsize(path)
+        print(f"{os.environ['STORAGE_BACKEND']:>10} {messages:>9,} messages ({size / 2**20:.0f} MiB): " + "   ".join(results))
+    finally:
+        await main.app.router.shutdown()
+
+
+def run(backend: str, messages: int) -> None:
+    # main.py reads its settings at import time, so each run gets a process
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = dict(os.environ, STORAGE_BACKEND=backend, DATA_DIR=data_dir)
+        result = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_export", "--child", "--messages", str(messages)],
+            env=env, capture_output=True, text=True,
+        )
+    if result.returncode != 0:
+        print(f"{backend:>10} {messages:>9,} messages: failed\n{result.stderr}")
+    else:
+        print(result.stdout.strip())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--backends", nargs="+", default=["memory", "sharded", "sqlite"], choices=STORAGE_BACKENDS)
+    parser.add_argument("--messages", nargs="+", type=int, default=[10000, 100000, 1000000])
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        asyncio.run(measure(args.messages[0], os.environ["DATA_DIR"]))
+        return
+    for backend in args.backends:
+        for messages in args.messages:
+            run(backend, messages)
+
+
+if __name__ == "__main__":
+    main()
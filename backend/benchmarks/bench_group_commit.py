@@ -0,0 +1,90 @@
+"""
+Concurrent requests per second of the app package with and without group commit.
+
+Each configuration runs in its own subprocess (it is chosen from settings
+at import time) against a fresh SQLite file, driving the ASGI app
+in-process with httpx. Every client loops over a chat turn followed by a
+history read.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_group_commit --concurrency 1 10 50 --requests 1000
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+async def run_mode(concurrency: int, total_requests: int) -> float:
+    import httpx
+    from app.main import app
+
+    await app.router.startup()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.post("/api/v1/auth/register", json={
+            "username": "bench", "email": "bench@example.com", "password": "bench",
+        })
+        response = await client.post("/api/v1/auth/login", data={"username": "bench", "password": "bench"})
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        response = await client.post("/api/v1/chat/", json={"message": "hello"}, headers=headers)
+        conversation_id = response.json()["conversation_id"]
+
+        remaining = total_requests
+
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 2
+                await client.post(
+                    "/api/v1/chat/",
+                    json={"message": "hello", "conversation_id": conversation_id},
+                    headers=headers,
+                )
+                await client.get(f"/api/v1/chat/history/{conversation_id}", headers=headers)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    await app.router.shutdown()
+    return total_requests / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        results = {
+            str(c): asyncio.run(run_mode(c, args.requests)) for c in args.concurrency
+        }
+        print(json.dumps(results))
+        return
+
+    print(f"{'mode':>12} " + " ".join(f"{'c=' + str(c):>10}" for c in args.concurrency) + "  (req/s)")
+    for group_commit in (False, True):
+        with tempfile.TemporaryDirectory() as data_dir:
+            env = dict(
+                os.environ,
+                DATABASE_URL=f"sqlite:///{data_dir}/bench.db",
+                GROUP_COMMIT=str(group_commit),
+            )
+            label = "group commit" if group_commit else "per request"
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_group_commit", "--child",
+                 "--requests", str(args.requests), "--concurrency", *map(str, args.concurrency)],
+                env=env, check=True, capture_output=True, text=True,
+            ).stdout
+            results = json.loads(output.strip().splitlines()[-1])
+            print(f"{label:>12} " + " ".join(f"{results[str(c)]:>10.1f}" for c in args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Per-request lookup latency of the JSON store as the dataset grows.
+
+Builds stores with an increasing number of messages spread over many users
+and conversations, then times the lookups behind register, login,
+/chat/conversations and /chat/history for one user whose own data stays the
+same size. With the secondary indexes the numbers should stay flat.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_indexes --sizes 1000 10000 100000 1000000
+"""
+import argparse
+import tempfile
+import time
+from datetime import datetime
+
+from app.store import JsonStore
+
+MESSAGES_PER_CONVERSATION = 20
+CONVERSATIONS_PER_USER = 10
+
+
+def build_store(data_dir: str, total_messages: int) -> JsonStore:
+    # Populate through _apply to skip the journal; we only care about lookups
+    store = JsonStore(data_dir)
+    now = datetime.utcnow().isoformat()
+    message_id = conv_id = user_id = 0
+    while message_id < total_messages:
+        user_id += 1
+        store._apply("user_created", {
+            "id": user_id,
+            "username": f"user{user_id}",
+            "email": f"user{user_id}@example.com",
+            "password": "secret",
+        })
+        for _ in range(CONVERSATIONS_PER_USER):
+            conv_id += 1
+            store._apply("conversation_created", {
+                "id": conv_id,
+                "title": f"conversation {conv_id}",
+                "user_id": user_id,
+                "created_at": now,
+                "updated_at": now,
+            })
+            for i in range(MESSAGES_PER_CONVERSATION):
+                message_id += 1
+                store._apply("message_appended", {
+                    "id": message_id,
+                    "content": f"message {message_id}",
+                    "role": "user" if i % 2 == 0 else "assistant",
+                    "conversation_id": conv_id,
+                    "created_at": now,
+                })
+    return store
+
+
+def time_per_call(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'messages':>10} {'register':>10} {'login':>10} {'convs':>10} {'history':>10}  (us/call)")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as data_dir:
+            store = build_store(data_dir, size)
+            # The user in the middle of the dataset, so nothing is at the front
+            target = store.users[str(len(store.users) // 2 + 1)]
+            conversation_id = int(store.conversation_ids_by_user[target["id"]][0])
+
+            register = time_per_call(
+                lambda: (store.get_user_by_username("nobody"), store.get_user_by_email("nobody@example.com")),
+                args.repeat,
+            )
+            login = time_per_call(lambda: store.get_user_by_username(target["username"]), args.repeat)
+            conversations = time_per_call(
+                lambda: store.list_conversations(target["id"]),
+                args.repeat,
+            )
+            history = time_per_call(lambda: store.list_messages(conversation_id), args.repeat)
+            print(f"{size:>10} {register:>10.2f} {login:>10.2f} {conversations:>10.2f} {history:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Reply latency and generations run: calling the generator per request vs
+app.llm.pool.GenerationPool, offline against the slow (fake) generator.
+
+Simulates ``--concurrency`` clients sending ``--requests`` prompts drawn
+from ``--distinct`` prompts with Zipf popularity (a few prompts are asked
+a lot, as with suggested questions or retries), and compares
+
+- direct: every request runs its own generation, as the endpoints did;
+  only realistic for a model that can serve any number at once,
+- bounded: the same, but at most ``--workers`` at once (a semaphore),
+- pool: a GenerationPool with ``--workers`` workers that coalesces
+  identical prompts in flight, without a cache,
+- pool + cache: the same with the reply cache.
+
+Reports requests per second, p50/p95/p99 latency, how many generations
+actually ran, the most that ran at once, and how many requests got a
+GenerationBusyError.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_llm --requests 2000 --concurrency 200 --latency-ms 200
+"""
+import argparse
+import asyncio
+import random
+import time
+from itertools import accumulate
+from typing import AsyncIterator, List
+
+from app.llm import GenerationBusyError, GenerationPool, SlowGenerator
+from app.llm.generators import Context
+from benchmarks.bench_api import percentile
+
+
+class CountingGenerator(SlowGenerator):
+    """
+    Slow generator that also records the most generations run at once
+    """
+
+    def __init__(self, latency: float, delay: float):
+        super().__init__(latency, delay)
+        self.running = 0
+        self.max_running = 0
+
+    async def generate(self, message: str, context: Context = ()) -> AsyncIterator[str]:
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            async for chunk in super().generate(message, context):
+                yield chunk
+        finally:
+            self.running -= 1
+
+
+def prompts(args) -> List[str]:
+    rng = random.Random(args.seed)
+    cum_weights = list(accumulate(1 / rank for rank in range(1, args.distinct + 1)))
+    ranks = rng.choices(range(args.distinct), cum_weights=cum_weights, k=args.requests)
+    return [f"question number {rank} about something" for rank in ranks]
+
+
+async def run(name: str, reply, generator: CountingGenerator, args) -> None:
+    queue = list(reversed(prompts(args)))
+    latencies: List[float] = []
+    busy = 0
+
+    async def client() -> None:
+        nonlocal busy
+        while queue:
+            prompt = queue.pop()
+            start = time.perf_counter()
+            try:
+                await reply(prompt)
+            except GenerationBusyError:
+                busy += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - start
+    print(f"{name:>12} {args.requests / elapsed:>8.0f} {percentile(latencies, 50) * 1000:>8.0f} "
+          f"{percentile(latencies, 95) * 1000:>8.0f} {percentile(latencies, 99) * 1000:>8.0f} "
+          f"{generator.calls:>11} {generator.max_running:>8} {busy:>6}")
+
+
+async def main_async(args) -> None:
+    latency, delay = args.latency_ms / 1000, args.chunk_delay_ms / 1000
+    print(f"{args.requests} requests from {args.concurrency} clients, {args.distinct} distinct prompts, "
+          f"{args.latency_ms:g} ms to first chunk + {args.chunk_delay_ms:g} ms per chunk")
+    print(f"{'':>12} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'generations':>11} "
+          f"{'at once':>8} {'busy':>6}")
+
+    generator = CountingGenerator(latency, delay)
+
+    async def direct(prompt: str) -> str:
+        return "".join([chunk async for chunk in generator.generate(prompt)])
+
+    await run("direct", direct, generator, args)
+
+    generator = CountingGenerator(latency, delay)
+    slots = asyncio.Semaphore(args.workers)
+
+    async def bounded(prompt: str) -> str:
+        async with slots:
+            return "".join([chunk async for chunk in generator.generate(prompt)])
+
+    await run("bounded", bounded, generator, args)
+
+    for name, cache_size in (("pool", 0), ("pool + cache", args.requests)):
+        generator = CountingGenerator(latency, delay)
+        pool = GenerationPool(
+            generator, workers=args.workers, queue_size=args.queue_size,
+            timeout=60.0, cache_size=cache_size, cache_ttl=3600.0,
+        )
+        await run(name, pool.complete, generator, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--distinct", type=int, default=500, help="distinct prompts")
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="fake time to first chunk")
+    parser.add_argument("--chunk-delay-ms", type=float, default=5.0, help="fake time per chunk")
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--queue-size", type=int, default=256, help="pool only; keep it above concurrency - workers to reject nothing")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Memory per message of the in-memory message representation.
+
+Builds the same messages (1M by default) twice, as the dict records the
+stores used to keep (a dict per message keyed by string id plus the
+conversation -> message ids index) and as MemoryStore's MessageColumns, and
+reports the bytes allocated per message, with and without the content
+string, which costs the same in both. Also times reading a page of
+history from each, since columns build the dicts on every read.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_records --messages 1000000
+"""
+import argparse
+import gc
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from app.store.memory import MemoryStore, page_bounds
+
+MESSAGES_PER_CONVERSATION = 50
+
+
+def content_for(message_id: int) -> str:
+    return f"message {message_id} about something or other"
+
+
+def make_message(message_id: int, created: datetime) -> dict:
+    return {
+        "id": message_id,
+        "content": content_for(message_id),
+        "role": "user" if message_id % 2 else "assistant",
+        "conversation_id": (message_id - 1) // MESSAGES_PER_CONVERSATION + 1,
+        "created_at": created.isoformat(),
+    }
+
+
+class DictMessages:
+    """
+    The previous representation: MemoryStore.messages and
+    MemoryStore.message_ids_by_conversation
+    """
+
+    def __init__(self):
+        self.messages: Dict[str, dict] = {}
+        self.message_ids_by_conversation: Dict[int, List[int]] = {}
+
+    def add(self, message: dict) -> None:
+        self.messages[str(message["id"])] = message
+        self.message_ids_by_conversation.setdefault(message["conversation_id"], []).append(message["id"])
+
+    def page_messages(self, conversation_id: int, limit: int):
+        message_ids = self.message_ids_by_conversation.get(conversation_id, [])
+        start, end, has_more = page_bounds(message_ids, limit, None, None)
+        return [self.messages[str(msg_id)] for msg_id in message_ids[start:end]], has_more
+
+
+def measure(name: str, store, add, total: int, start: datetime) -> dict:
+    gc.collect()
+    tracemalloc.start()
+    for index in range(total):
+        # Message timestamps are a few milliseconds apart
+        add(store, make_message(index + 1, start + timedelta(microseconds=index * 1731)))
+    gc.collect()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    conversations = total // MESSAGES_PER_CONVERSATION
+    reads = 10000
+    timer = time.perf_counter()
+    for index in range(reads):
+        store.page_messages(index % conversations + 1, 50)
+    page_us = (time.perf_counter() - timer) / reads * 1e6
+    return {"name": name, "bytes": allocated / total, "page_us": page_us}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=1000000)
+    args = parser.parse_args()
+
+    content_bytes = sum(sys.getsizeof(content_for(i)) for i in range(1, args.messages + 1)) / args.messages
+    start = datetime.utcnow()
+
+    results = [
+        measure("dict records", DictMessages(), DictMessages.add, args.messages, start),
+        measure("columns", MemoryStore(), MemoryStore._add_message, args.messages, start),
+    ]
+
+    print(f"{args.messages} messages, content strings average {content_bytes:.0f} bytes\n")
+    print(f"{'representation':>16} {'bytes/message':>14} {'w/o content':>12} {'page of 50 us':>14}")
+    for r in results:
+        print(f"{r['name']:>16} {r['bytes']:>14.0f} {r['bytes'] - content_bytes:>12.0f} {r['page_us']:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Search latency at 1M messages: main.py's in-memory inverted index vs FTS5.
+
+Generates messages from a Zipf-distributed vocabulary spread over users
+and conversations, then:
+
+- builds the in-memory SearchIndex on its own and reports the build time
+  and its size,
+- fills a MemoryStore through append_message (which indexes every message
+  as it is written), a ShardedStore without its in-memory index (which
+  reads the user's messages for each search) and a SqliteStore (whose
+  triggers fill messages_fts),
+- times store.search for queries of common, medium and rare words and of
+  two and three words, each run by random users, and reports p50/p95/p99.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_search --messages 1000000 --users 100
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+from itertools import accumulate
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from app.store import MemoryStore, ShardedStore, SqliteStore, StorageBackend
+from app.store.search import SearchIndex
+from benchmarks.bench_api import percentile
+
+CONVERSATIONS_PER_USER = 20
+WORDS_PER_MESSAGE = (4, 24)
+SEARCH_LIMIT = 20
+
+
+def vocabulary(size: int, rng: random.Random) -> List[str]:
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choices(string.ascii_lowercase, k=rng.randint(3, 9))))
+    return sorted(words, key=lambda word: rng.random())
+
+
+def generate(messages: int, users: int, vocab: List[str], seed: int) -> Iterator[Tuple[int, int, str]]:
+    """
+    ``(user index, conversation index, content)`` with the messages spread
+    evenly over the users' conversations
+    """
+    rng = random.Random(seed)
+    # Zipf: the word of rank r is used in proportion to 1 / r
+    cum_weights = list(accumulate(1 / rank for rank in range(1, len(vocab) + 1)))
+    conversations = users * CONVERSATIONS_PER_USER
+    for i in range(messages):
+        conversation = i % conversations
+        words = rng.choices(vocab, cum_weights=cum_weights, k=rng.randint(*WORDS_PER_MESSAGE))
+        yield conversation // CONVERSATIONS_PER_USER, conversation, " ".join(words)
+
+
+def index_size(index: SearchIndex) -> int:
+    # Dicts and posting arrays; the words are shared between users
+    size = sys.getsizeof(index._postings)
+    words = set()
+    for postings in index._postings.values():
+        size += sys.getsizeof(postings)
+        for word, entries in postings.items():
+            size += sys.getsizeof(entries)
+            words.add(word)
+    return size + sum(sys.getsizeof(word) for word in words)
+
+
+def build_index(args, vocab: List[str]) -> None:
+    index = SearchIndex()
+    # Conversations are covered up front, as they are when created
+    for conversation in range(args.users * CONVERSATIONS_PER_USER):
+        index.add_conversation(conversation // CONVERSATIONS_PER_USER, conversation, ())
+    start = time.perf_counter()
+    for message_id, (user, conversation, content) in enumerate(generate(args.messages, args.users, vocab, args.seed)):
+        index.add(user, {"id": message_id, "conversation_id": conversation, "content": content})
+    elapsed = time.perf_counter() - start
+    size = index_size(index)
+    print(f"index only: {args.messages / elapsed:,.0f} messages/s, {index.postings:,} postings, "
+          f"{size / 2**20:.0f} MiB ({size / args.messages:.0f} bytes/message)")
+
+
+def fill(store: StorageBackend, args, vocab: List[str]) -> List[int]:
+    users = [store.create_user(f"user{u}", f"user{u}@example.com", "secret")["id"] for u in range(args.users)]
+    conversations = [
+        store.create_conversation(users[c // CONVERSATIONS_PER_USER], f"conversation {c}")["id"]
+        for c in range(args.users * CONVERSATIONS_PER_USER)
+    ]
+    for i, (_, conversation, content) in enumerate(generate(args.messages, args.users, vocab, args.seed)):
+        store.append_message(conversations[conversation], "user" if i % 2 == 0 else "assistant", content)
+    return users
+
+
+def query_sets(vocab: List[str]) -> Dict[str, Callable[[random.Random], str]]:
+    common, medium, rare = vocab[:10], vocab[100:1000], vocab[5000:]
+    return {
+        "common": lambda rng: rng.choice(common),
+        "medium": lambda rng: rng.choice(medium),
+        "rare": lambda rng: rng.choice(rare),
+        "2 words": lambda rng: f"{rng.choice(common)} {rng.choice(medium)}",
+        "3 words": lambda rng: f"{rng.choice(common)} {rng.choice(common)} {rng.choice(medium)}",
+    }
+
+
+def time_queries(store: StorageBackend, users: List[int], vocab: List[str], args) -> None:
+    for name, make_query in query_sets(vocab).items():
+        rng = random.Random(args.seed)
+        latencies, results = [], 0
+        for _ in range(args.queries):
+            user, query = rng.choice(users), make_query(rng)
+            start = time.perf_counter()
+            results += len(store.search(user, query, SEARCH_LIMIT))
+            latencies.append(time.perf_counter() - start)
+        print(f"{name:>10} {percentile(latencies, 50) * 1000:>8.2f} {percentile(latencies, 95) * 1000:>8.2f} "
+              f"{percentile(latencies, 99) * 1000:>8.2f} {results / args.queries:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200, help="queries per kind")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--skip-sharded", action="store_true")
+    parser.add_argument("--skip-sqlite", action="store_true")
+    args = parser.parse_args()
+
+    vocab = vocabulary(args.vocabulary, random.Random(args.seed))
+    per_user = args.messages // args.users
+    print(f"{args.messages:,} messages, {args.users} users ({per_user:,} messages each), "
+          f"{args.vocabulary:,} words")
+    build_index(args, vocab)
+
+    header = f"{'query':>10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'results/query':>12}"
+    store = MemoryStore()
+    start = time.perf_counter()
+    users = fill(store, args, vocab)
+    print(f"\nmemory store: filled in {time.perf_counter() - start:.1f}s, indexing as it goes")
+    print(header)
+    time_queries(store, users, vocab, args)
+    del store
+
+    if not args.skip_sharded:
+        with tempfile.TemporaryDirectory() as data_dir:
+            store = ShardedStore(data_dir, durability="async")
+            store.load()
+            start = time.perf_counter()
+            with store.batch():
+                users = fill(store, args, vocab)
+            # Searches read the segments from disk, as after a restart
+            store.close()
+            store = ShardedStore(data_dir, cache_bytes=0)
+            store.load()
+            print(f"\nsharded, no index: filled in {time.perf_counter() - start:.1f}s")
+            print(header)
+            time_queries(store, users, vocab, args)
+            store.close()
+
+    if args.skip_sqlite:
+        return
+    with tempfile.TemporaryDirectory() as data_dir:
+        store = SqliteStore(os.path.join(data_dir, "chat.db"), durability="async")
+        store.load()
+        start = time.perf_counter()
+        # One transaction, or seeding would take longer than the run
+        with store.transaction():
+            users = fill(store, args, vocab)
+        print(f"\nsqlite FTS5: filled in {time.perf_counter() - start:.1f}s, "
+              f"{os.path.getsize(store.path) / 2**20:.0f} MiB on disk")
+        print(header)
+        time_queries(store, users, vocab, args)
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
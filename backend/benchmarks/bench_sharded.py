@@ -0,0 +1,153 @@
+"""
+Cold start time and resident memory of the JSON and sharded stores.
+
+Writes a dataset (1M messages by default) in the JSON snapshot format,
+splits a copy of it into per-conversation segments, then starts each store
+in a fresh process and reports how long load() took, the resident memory
+after loading, the latency of reading a cold and a warm conversation and the
+memory after reading many conversations under the sharded store's cache
+budget.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_sharded --messages 1000000 --cache-mb 64
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+MESSAGES_PER_CONVERSATION = 50
+CONVERSATIONS_PER_USER = 10
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def write_dataset(data_dir: str, total_messages: int) -> int:
+    now = datetime.utcnow().isoformat()
+    users, conversations, messages = {}, {}, {}
+    message_id = conv_id = user_id = 0
+    while message_id < total_messages:
+        user_id += 1
+        users[str(user_id)] = {
+            "id": user_id, "username": f"user{user_id}",
+            "email": f"user{user_id}@example.com", "password": "secret",
+        }
+        for _ in range(CONVERSATIONS_PER_USER):
+            conv_id += 1
+            conversations[str(conv_id)] = {
+                "id": conv_id, "title": f"conversation {conv_id}", "user_id": user_id,
+                "created_at": now, "updated_at": now,
+            }
+            for i in range(MESSAGES_PER_CONVERSATION):
+                message_id += 1
+                messages[str(message_id)] = {
+                    "id": message_id, "content": f"message {message_id} about something or other",
+                    "role": "user" if i % 2 == 0 else "assistant",
+                    "conversation_id": conv_id, "created_at": now,
+                }
+
+    for name, key, data, next_id in (
+        ("users.json", "users", users, user_id + 1),
+        ("conversations.json", "conversations", conversations, conv_id + 1),
+        ("messages.json", "messages", messages, message_id + 1),
+    ):
+        with open(os.path.join(data_dir, name), "w") as f:
+            json.dump({key: data, "next_id": next_id}, f)
+    return conv_id
+
+
+def run_child(args) -> dict:
+    from app.store import create_store
+
+    baseline = rss_mb()
+    store = create_store(args.child, args.data_dir, cache_bytes=args.cache_mb * 1024 * 1024)
+    start = time.perf_counter()
+    store.load()
+    load_seconds = time.perf_counter() - start
+    loaded_rss = rss_mb()
+
+    conversation_id = random.randint(1, args.conversations)
+    start = time.perf_counter()
+    store.page_messages(conversation_id, 50)
+    cold_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    store.page_messages(conversation_id, 50)
+    warm_ms = (time.perf_counter() - start) * 1000
+
+    for _ in range(args.touch):
+        store.page_messages(random.randint(1, args.conversations), 50)
+    store.close()
+
+    return {
+        "load_seconds": load_seconds,
+        "rss_after_load_mb": loaded_rss - baseline,
+        "cold_read_ms": cold_ms,
+        "warm_read_ms": warm_ms,
+        "rss_after_reads_mb": rss_mb() - baseline,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--cache-mb", type=int, default=64, help="sharded store message cache budget")
+    parser.add_argument("--touch", type=int, default=5000, help="conversations read after startup")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--data-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--conversations", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args)))
+        return
+
+    def child(backend: str, data_dir: str, conversations: int) -> dict:
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_sharded", "--child", backend,
+             "--data-dir", data_dir, "--conversations", str(conversations),
+             "--cache-mb", str(args.cache_mb), "--touch", str(args.touch)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+    with tempfile.TemporaryDirectory() as root:
+        json_dir = os.path.join(root, "json")
+        sharded_dir = os.path.join(root, "sharded")
+        os.makedirs(json_dir)
+
+        start = time.perf_counter()
+        conversations = write_dataset(json_dir, args.messages)
+        print(f"wrote {args.messages} messages in {conversations} conversations in {time.perf_counter() - start:.1f}s")
+
+        # The first sharded load splits messages.json into segments
+        shutil.copytree(json_dir, sharded_dir)
+        migration = child("sharded", sharded_dir, conversations)
+        print(f"migrated to segments in {migration['load_seconds']:.1f}s")
+
+        results = {
+            "json": child("json", json_dir, conversations),
+            "sharded": child("sharded", sharded_dir, conversations),
+        }
+
+    print(f"\n{'store':>8} {'load s':>8} {'RSS MB':>8} {'cold ms':>8} {'warm ms':>8} {'RSS after reads':>16}")
+    for name, r in results.items():
+        print(
+            f"{name:>8} {r['load_seconds']:>8.2f} {r['rss_after_load_mb']:>8.1f} {r['cold_read_ms']:>8.2f} "
+            f"{r['warm_read_ms']:>8.3f} {r['rss_after_reads_mb']:>16.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Startup time of the JSON store from the JSON files vs the indexed snapshot.
+
+Writes a dataset (1M messages by default) as users/conversations/messages
+JSON files, converts a copy to store.snap with app.store.convert, then loads each in a fresh process and reports the load
+time, the resident memory after loading and the latency of the first login
+lookup and history page.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_snapshot --messages 1000000
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_sharded import rss_mb, write_dataset
+
+
+def run_child(args) -> dict:
+    from app.store import JsonStore
+
+    baseline = rss_mb()
+    store = JsonStore(args.data_dir)
+    start = time.perf_counter()
+    store.load()
+    load_seconds = time.perf_counter() - start
+    loaded_rss = rss_mb()
+
+    start = time.perf_counter()
+    user = store.get_user_by_username("user7")
+    login_ms = (time.perf_counter() - start) * 1000
+    conversation_id = int(store.list_conversations(user["id"])[0]["id"])
+    start = time.perf_counter()
+    store.page_messages(conversation_id, 50)
+    history_ms = (time.perf_counter() - start) * 1000
+    store.close()
+
+    return {
+        "load_seconds": load_seconds,
+        "rss_after_load_mb": loaded_rss - baseline,
+        "first_login_ms": login_ms,
+        "first_history_ms": history_ms,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--data-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args)))
+        return
+
+    def child(data_dir: str) -> dict:
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_snapshot", "--child", "--data-dir", data_dir],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+    with tempfile.TemporaryDirectory() as root:
+        json_dir = os.path.join(root, "json")
+        snap_dir = os.path.join(root, "snap")
+        os.makedirs(json_dir)
+        write_dataset(json_dir, args.messages)
+        shutil.copytree(json_dir, snap_dir)
+
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-m", "app.store.convert", snap_dir, "--backend", "json"],
+            check=True, capture_output=True, text=True,
+        )
+        print(f"converted in {time.perf_counter() - start:.1f}s")
+        for name in ("users.json", "conversations.json", "messages.json"):
+            os.remove(os.path.join(snap_dir, name))
+
+        json_size = sum(os.path.getsize(os.path.join(json_dir, name)) for name in os.listdir(json_dir))
+        snap_size = os.path.getsize(os.path.join(snap_dir, "store.snap"))
+        results = {"json files": child(json_dir), "store.snap": child(snap_dir)}
+
+    print(f"size: {json_size / 1e6:.0f} MB of JSON, {snap_size / 1e6:.0f} MB snapshot\n")
+    print(f"{'format':>11} {'load s':>8} {'RSS MB':>8} {'login ms':>9} {'history ms':>11}")
+    for name, r in results.items():
+        print(
+            f"{name:>11} {r['load_seconds']:>8.3f} {r['rss_after_load_mb']:>8.1f} "
+            f"{r['first_login_ms']:>9.3f} {r['first_history_ms']:>11.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Throughput of each storage backend on the same chat workload.
+
+For every backend the benchmark registers users, runs chat turns (append
+the user message, append the reply, touch the conversation) and then runs
+the reads behind the API: login lookup, token lookup, the conversation list
+and the newest history page. Writes and reads can be spread over several
+threads, as the API's threadpool would.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_storage --users 50 --turns 200 --threads 1 4
+"""
+import argparse
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.store import STORAGE_BACKENDS, StorageBackend, create_store
+
+CONVERSATIONS_PER_USER = 4
+
+
+def run_threads(fn, items, threads: int) -> float:
+    start = time.perf_counter()
+    if threads == 1:
+        for item in items:
+            fn(item)
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(fn, items))
+    return time.perf_counter() - start
+
+
+def run_workload(store: StorageBackend, users: int, turns: int, threads: int) -> dict:
+    def register(i: int):
+        user = store.create_user(f"user{i}", f"user{i}@example.com", "secret")
+        return [
+            store.create_conversation(user["id"], f"conversation {c}")["id"]
+            for c in range(CONVERSATIONS_PER_USER)
+        ]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        conversation_ids = [cid for cids in pool.map(register, range(users)) for cid in cids]
+    register_time = time.perf_counter() - start
+
+    def chat_turn(i: int):
+        conversation_id = conversation_ids[i % len(conversation_ids)]
+        store.append_message(conversation_id, "user", f"message {i}")
+        store.append_message(conversation_id, "assistant", f"You said: message {i}")
+        store.touch_conversation(conversation_id)
+
+    total_turns = users * turns
+    chat_time = run_threads(chat_turn, range(total_turns), threads)
+
+    def read(i: int):
+        user = store.get_user_by_username(f"user{i % users}")
+        store.get_user(user["id"])
+        conversations = store.list_conversations(user["id"])
+        store.page_messages(conversations[0]["id"], 50)
+
+    reads = total_turns
+    read_time = run_threads(read, range(reads), threads)
+
+    return {
+        "register": users / register_time,
+        "chat": total_turns / chat_time,
+        "read": reads / read_time,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--backends", nargs="+", default=list(STORAGE_BACKENDS), choices=STORAGE_BACKENDS)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=200, help="chat turns per user")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4])
+    args = parser.parse_args()
+
+    print(f"{'backend':>10} {'threads':>8} {'register':>10} {'chat':>10} {'read':>10}  (ops/s)")
+    for backend in args.backends:
+        for threads in args.threads:
+            with tempfile.TemporaryDirectory() as data_dir:
+                store = create_store(backend, data_dir)
+                store.load()
+                try:
+                    result = run_workload(store, args.users, args.turns, threads)
+                finally:
+                    store.close()
+            print(
+                f"{backend:>10} {threads:>8} {result['register']:>10.0f} "
+                f"{result['chat']:>10.0f} {result['read']:>10.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+Chat turns over /api/v1/chat/ws vs the REST endpoints, against one
+uvicorn worker of main.py.
+
+Starts `uvicorn main:app` on a free port with a fresh data directory,
+registers a few users, then
+
+- throughput: drives chat turns from several client processes for a fixed
+  time, each client keeping ``--concurrency`` conversations going, over
+  POST /chat/ (keep-alive connections), POST /chat/stream (SSE) and the
+  WebSocket, and reports turns per second and p50/p99 latency,
+- connections: opens ``--connections`` authenticated, idle WebSockets and
+  reports the worker's resident memory per connection, then the latency
+  of turns on one more socket while they are all open. Most of that memory
+  is uvicorn's per-message-deflate state; compare with --no-deflate.
+
+The default echo generator replies at once, so the throughput is that of
+the transport, authentication and storage around a turn; pass
+--latency-ms to simulate a model. The clients run on the same machine, so
+on few cores they compete with the worker.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_websocket --clients 2 --concurrency 16 --seconds 10 --connections 1000 5000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+from benchmarks.bench_api import PASSWORD, login, percentile, username
+from benchmarks.bench_workers import free_port, stop_server
+
+MODES = ("rest", "sse", "ws")
+
+
+def start_server(port: int, data_dir: str, args) -> subprocess.Popen:
+    env = dict(
+        os.environ, STORAGE_BACKEND=args.storage, DATA_DIR=data_dir,
+        RESPONSE_GENERATOR="slow" if args.latency_ms else "echo",
+        RESPONSE_LATENCY_MS=str(args.latency_ms), RESPONSE_CHUNK_DELAY_MS="0",
+        # Every turn is let in; this measures the transports, not admission
+        GENERATION_QUEUE_SIZE="100000",
+        WS_MAX_CONNECTIONS=str(max(args.connections, default=0) + args.clients * args.concurrency + 10),
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning",
+         "--ws", "websockets", "--ws-per-message-deflate", str(args.deflate).lower()],
+        env=env,
+    )
+    import httpx
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with status {server.returncode}")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return server
+        except httpx.TransportError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("uvicorn did not start in time")
+
+
+def rss_kib(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+async def prepare(url: str, users: int) -> List[str]:
+    import httpx
+
+    async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+        tokens = []
+        for u in range(users):
+            await client.post("/api/v1/auth/register", json={
+                "username": username(u), "email": f"{username(u)}@example.com", "password": PASSWORD,
+            })
+            headers = await login(client, u)
+            tokens.append(headers["Authorization"].split(" ", 1)[1])
+    return tokens
+
+
+# Clients
+
+async def open_socket(url: str, token: str):
+    import websockets
+
+    socket = await websockets.connect(url.replace("http", "ws", 1) + "/api/v1/chat/ws", max_size=None)
+    await socket.send(json.dumps({"type": "auth", "token": token}))
+    ready = json.loads(await socket.recv())
+    if ready["type"] != "ready":
+        raise RuntimeError(f"Not authenticated: {ready}")
+    return socket
+
+
+async def socket_turn(socket, message: str, conversation_id) -> Dict:
+    await socket.send(json.dumps({"type": "chat", "message": message, "conversation_id": conversation_id}))
+    while True:
+        frame = json.loads(await socket.recv())
+        if frame["type"] == "ping":
+            await socket.send('{"type":"pong"}')
+        elif frame["type"] in ("done", "error"):
+            return frame
+
+
+async def drive_async(mode: str, url: str, tokens: List[str], concurrency: int, seconds: float, seed: int) -> dict:
+    import httpx
+
+    rng = random.Random(seed)
+    latencies: List[float] = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=60, limits=limits) as client:
+        deadline = time.perf_counter() + seconds
+
+        async def worker(w: int) -> None:
+            nonlocal errors
+            token = rng.choice(tokens)
+            headers = {"Authorization": f"Bearer {token}"}
+            socket = await open_socket(url, token) if mode == "ws" else None
+            conversation_id = None
+            turn = 0
+            try:
+                while time.perf_counter() < deadline:
+                    turn += 1
+                    body = {"message": f"message {turn} from {seed}/{w}", "conversation_id": conversation_id}
+                    start = time.perf_counter()
+                    if mode == "rest":
+                        response = await client.post("/api/v1/chat/", json=body, headers=headers)
+                        ok = response.status_code == 200
+                        reply = response.json() if ok else {}
+                    elif mode == "sse":
+                        reply, ok = {}, False
+                        async with client.stream("POST", "/api/v1/chat/stream", json=body, headers=headers) as response:
+                            event = None
+                            async for line in response.aiter_lines():
+                                if line.startswith("event: "):
+                                    event = line[7:]
+                                elif line.startswith("data: ") and event == "done":
+                                    reply, ok = json.loads(line[6:]), True
+                    else:
+                        reply = await socket_turn(socket, body["message"], conversation_id)
+                        ok = reply["type"] == "done"
+                    if ok:
+                        latencies.append(time.perf_counter() - start)
+                        conversation_id = reply["conversation_id"]
+                    else:
+                        errors += 1
+            finally:
+                if socket is not None:
+                    await socket.close()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(w) for w in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return {"latencies": latencies, "errors": errors, "elapsed": elapsed}
+
+
+def drive(mode: str, url: str, tokens: List[str], concurrency: int, seconds: float, seed: int) -> dict:
+    return asyncio.run(drive_async(mode, url, tokens, concurrency, seconds, seed))
+
+
+def throughput(mode: str, url: str, tokens: List[str], args) -> None:
+    with ProcessPoolExecutor(max_workers=args.clients) as pool:
+        futures = [
+            pool.submit(drive, mode, url, tokens, args.concurrency, args.seconds, seed)
+            for seed in range(args.clients)
+        ]
+        results = [future.result() for future in futures]
+    latencies = [s for r in results for s in r["latencies"]]
+    errors = sum(r["errors"] for r in results)
+    elapsed = max(r["elapsed"] for r in results)
+    print(f"{mode:>6} {len(latencies) / elapsed:>9.0f} {percentile(latencies, 50) * 1000:>8.1f} "
+          f"{percentile(latencies, 99) * 1000:>8.1f} {errors:>7}")
+
+
+async def connections(url: str, tokens: List[str], pid: int, count: int, args) -> None:
+    before = rss_kib(pid)
+    start = time.perf_counter()
+    sockets = []
+    # A hundred handshakes at a time
+    for first in range(0, count, 100):
+        sockets += await asyncio.gather(*(
+            open_socket(url, tokens[i % len(tokens)]) for i in range(first, min(first + 100, count))
+        ))
+    opened = time.perf_counter() - start
+    await asyncio.sleep(1)
+    per_connection = (rss_kib(pid) - before) / count
+
+    socket = await open_socket(url, tokens[0])
+    latencies: List[float] = []
+    conversation_id = None
+    deadline = time.perf_counter() + args.seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        reply = await socket_turn(socket, f"message {len(latencies)}", conversation_id)
+        latencies.append(time.perf_counter() - start)
+        conversation_id = reply.get("conversation_id", conversation_id)
+    await socket.close()
+    print(f"{count:>11,} {count / opened:>11.0f} {per_connection:>10.1f} "
+          f"{percentile(latencies, 50) * 1000:>8.1f} {percentile(latencies, 99) * 1000:>8.1f}")
+    await asyncio.gather(*(s.close() for s in sockets))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clients", type=int, default=2, help="client processes generating load")
+    parser.add_argument("--concurrency", type=int, default=16, help="conversations per client")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    parser.add_argument("--connections", type=int, nargs="*", default=[1000, 5000], help="idle WebSockets held open")
+    parser.add_argument("--storage", default="memory", help="STORAGE_BACKEND of the worker")
+    parser.add_argument("--no-deflate", dest="deflate", action="store_false",
+                        help="turn off per-message-deflate, which costs most of the memory of a connection")
+    parser.add_argument("--latency-ms", type=float, default=0, help="fake time to the first chunk of a reply")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        server = start_server(port, data_dir, args)
+        try:
+            tokens = asyncio.run(prepare(url, args.users))
+
+            print(f"{os.cpu_count()} CPUs, 1 worker ({args.storage}, per-message-deflate "
+                  f"{'on' if args.deflate else 'off'}), {args.clients} clients x {args.concurrency} conversations, "
+                  f"{args.latency_ms:g} ms per reply")
+            print(f"{'':>6} {'turns/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+            for mode in args.modes:
+                throughput(mode, url, tokens, args)
+
+            if args.connections:
+                print()
+                print(f"{'connections':>11} {'opened/s':>11} {'KiB each':>10} {'p50 ms':>8} {'p99 ms':>8}")
+                for count in args.connections:
+                    asyncio.run(connections(url, tokens, server.pid, count, args))
+        finally:
+            stop_server(server)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+Throughput of main.py served by 1 to N uvicorn worker processes.
+
+For each worker count, starts `uvicorn main:app --workers N` on a free port
+with the shared sqlite store in a fresh data directory, seeds users through
+the API and then drives a mix of chat turns and history reads from several
+client processes for a fixed time. Reports requests per second, p50/p99
+latency and the speedup over one worker.
+
+After each run it checks that the workers shared their state: every
+acknowledged chat turn is stored exactly once (ids come from SQLite), and
+a token logged out on one worker is rejected by all of them.
+
+The clients run on the same machine, so on few cores they compete with
+the workers; give them --clients close to the number of spare cores.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_workers --workers 1 2 4 --clients 4 --seconds 10
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+from app.store import DURABILITY_MODES
+from benchmarks.bench_api import login, percentile, seed_api
+
+# Share of requests that are chat turns; the rest read a history page
+WRITE_RATIO = 0.5
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(workers: int, port: int, data_dir: str, durability: str) -> subprocess.Popen:
+    env = dict(os.environ, STORAGE_BACKEND="sqlite", DATA_DIR=data_dir, DURABILITY=durability)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--workers", str(workers),
+         "--port", str(port), "--log-level", "warning"],
+        env=env,
+    )
+    import httpx
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with status {server.returncode}")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/", timeout=1)
+            return server
+        except httpx.TransportError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("uvicorn did not start in time")
+
+
+def stop_server(server: subprocess.Popen) -> None:
+    server.terminate()
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+# Load generation, one process per client
+
+async def drive_async(url: str, sessions: list, concurrency: int, seconds: float, seed: int) -> dict:
+    import httpx
+
+    rng = random.Random(seed)
+    latencies: Dict[str, List[float]] = {"chat": [], "history": []}
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=60, limits=limits) as client:
+        deadline = time.perf_counter() + seconds
+
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                headers, conversation_id = rng.choice(sessions)
+                kind = "chat" if rng.random() < WRITE_RATIO else "history"
+                start = time.perf_counter()
+                if kind == "chat":
+                    response = await client.post("/api/v1/chat/", json={
+                        "message": "hello", "conversation_id": conversation_id,
+                    }, headers=headers)
+                else:
+                    response = await client.get(f"/api/v1/chat/history/{conversation_id}", headers=headers)
+                if response.status_code == 200:
+                    latencies[kind].append(time.perf_counter() - start)
+                else:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return {"latencies": latencies, "errors": errors, "elapsed": elapsed}
+
+
+def drive(url: str, sessions: list, concurrency: int, seconds: float, seed: int) -> dict:
+    return asyncio.run(drive_async(url, sessions, concurrency, seconds, seed))
+
+
+async def prepare(url: str, users: int) -> List[Tuple[Dict[str, str], int]]:
+    import httpx
+
+    async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+        # One conversation of one chat turn per user
+        await seed_api(client, users, 1, 2)
+        sessions = []
+        for u in range(users):
+            headers = await login(client, u)
+            response = await client.get("/api/v1/chat/conversations", headers=headers)
+            sessions.append((headers, response.json()["conversations"][0]["id"]))
+    return sessions
+
+
+async def check_revocation(url: str, headers: Dict[str, str], workers: int) -> List[str]:
+    import httpx
+
+    async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+        # Use the token everywhere first, so every worker has it cached
+        for _ in range(workers * 4):
+            await client.get("/api/v1/auth/me", headers=headers)
+        await client.post("/api/v1/auth/logout", headers=headers)
+        # REVOCATION_SYNC_SECONDS in main.py, plus a margin
+        await asyncio.sleep(1.5)
+        statuses = [(await client.get("/api/v1/auth/me", headers=headers)).status_code for _ in range(workers * 4)]
+    accepted = sum(status != 401 for status in statuses)
+    return [f"revoked token accepted {accepted} times"] if accepted else []
+
+
+def count_messages(data_dir: str) -> Tuple[int, int]:
+    # Total and distinct message ids
+    connection = sqlite3.connect(os.path.join(data_dir, "chat.db"))
+    try:
+        return connection.execute("SELECT COUNT(*), COUNT(DISTINCT id) FROM messages").fetchone()
+    finally:
+        connection.close()
+
+
+def run(workers: int, args) -> Tuple[dict, List[str]]:
+    with tempfile.TemporaryDirectory() as data_dir:
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        server = start_server(workers, port, data_dir, args.durability)
+        try:
+            sessions = asyncio.run(prepare(url, args.users))
+            seeded, _ = count_messages(data_dir)
+
+            with ProcessPoolExecutor(max_workers=args.clients) as pool:
+                futures = [
+                    pool.submit(drive, url, sessions, args.concurrency, args.seconds, seed)
+                    for seed in range(args.clients)
+                ]
+                results = [future.result() for future in futures]
+
+            problems = asyncio.run(check_revocation(url, sessions[0][0], workers))
+        finally:
+            stop_server(server)
+
+        stored, distinct = count_messages(data_dir)
+
+    latencies = {kind: [s for r in results for s in r["latencies"][kind]] for kind in ("chat", "history")}
+    errors = sum(r["errors"] for r in results)
+    elapsed = max(r["elapsed"] for r in results)
+    everything = latencies["chat"] + latencies["history"]
+
+    # Every chat turn stores the message and its reply
+    expected = seeded + 2 * len(latencies["chat"])
+    if stored != expected:
+        problems.append(f"{stored} messages stored, {expected} expected")
+    if distinct != stored:
+        problems.append(f"{stored - distinct} message ids were handed out twice")
+    if errors:
+        problems.append(f"{errors} requests failed")
+
+    summary = {
+        "workers": workers,
+        "requests": len(everything),
+        "throughput": len(everything) / elapsed,
+        "chat": len(latencies["chat"]) / elapsed,
+        "history": len(latencies["history"]) / elapsed,
+        "p50_ms": percentile(everything, 50) * 1000,
+        "p99_ms": percentile(everything, 99) * 1000,
+    }
+    return summary, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=4, help="client processes generating load")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent requests per client")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--durability", default="sync", choices=DURABILITY_MODES)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs, {args.clients} clients x {args.concurrency} concurrent requests, "
+          f"{args.durability} durability")
+    print(f"{'workers':>8} {'req/s':>9} {'chat/s':>8} {'history/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'speedup':>8}")
+    problems = []
+    base = None
+    for workers in args.workers:
+        summary, run_problems = run(workers, args)
+        problems += [f"{workers} workers: {p}" for p in run_problems]
+        base = base or summary["throughput"]
+        print(f"{workers:>8} {summary['throughput']:>9.0f} {summary['chat']:>8.0f} {summary['history']:>10.0f} "
+              f"{summary['p50_ms']:>8.1f} {summary['p99_ms']:>8.1f} {summary['throughput'] / base:>7.2f}x")
+
+    for problem in problems:
+        print(f"FAIL {problem}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
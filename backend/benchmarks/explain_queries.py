@@ -0,0 +1,48 @@
+"""
+Check that the hot chat queries are served by their indexes.
+
+Migrates a fresh SQLite database, runs EXPLAIN QUERY PLAN on the exact
+statements used by /chat/conversations and /chat/history, and fails if a
+query does not use the expected index or needs a temporary sort.
+
+Usage (from the backend directory):
+    python -m benchmarks.explain_queries
+"""
+import sys
+import tempfile
+
+from sqlalchemy import create_engine, text
+
+from app.crud.chat import conversation_list_query, history_page_query
+from app.db.migrations import migrate_engine
+
+CHECKS = [
+    ("conversation list", conversation_list_query(1), "ix_conversations_user_id_updated_at"),
+    ("history, newest page", history_page_query(1, 50), "ix_messages_conversation_id_id"),
+    ("history, before cursor", history_page_query(1, 50, before=100), "ix_messages_conversation_id_id"),
+    ("history, after cursor", history_page_query(1, 50, after=10), "ix_messages_conversation_id_id"),
+]
+
+
+def query_plan(connection, statement) -> str:
+    compiled = statement.compile(connection, compile_kwargs={"literal_binds": True})
+    rows = connection.execute(text(f"EXPLAIN QUERY PLAN {compiled}"))
+    return "\n".join(row[-1] for row in rows)
+
+
+def main() -> int:
+    failures = 0
+    with tempfile.TemporaryDirectory() as data_dir:
+        engine = create_engine(f"sqlite:///{data_dir}/explain.db")
+        migrate_engine(engine)
+        with engine.connect() as connection:
+            for name, statement, index in CHECKS:
+                plan = query_plan(connection, statement)
+                ok = index in plan and "TEMP B-TREE" not in plan
+                failures += not ok
+                print(f"{'ok' if ok else 'FAIL':>4}  {name}: {plan.replace(chr(10), '; ')}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
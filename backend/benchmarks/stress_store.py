@@ -0,0 +1,282 @@
+"""
+Concurrency stress test for main.py's storage backends.
+
+Fires thousands of concurrent chat turns, first straight at each store from
+a thread pool and then through main.py's API (whose sync handlers run in
+FastAPI's threadpool), and checks that:
+
+- every user, conversation and message id is unique,
+- every message that was acknowledged is stored, in its conversation, in
+  id order and with its content,
+- concurrent registrations of the same username create one user,
+- and, for the persistent backends, the same holds after reopening the store.
+
+Exits with status 1 if any check fails.
+
+Usage (from the backend directory):
+    python -m benchmarks.stress_store --turns 5000 --threads 32
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+from app.store import STORAGE_BACKENDS, DURABILITY_MODES, DuplicateUserError, StorageBackend, create_store
+
+PASSWORD = "stress-password"
+
+# One chat turn in ten starts a new conversation
+NEW_CONVERSATION_EVERY = 10
+
+# conversation id -> [(message id, content)] as acknowledged to the client
+Expected = Dict[int, List[Tuple[int, str]]]
+
+
+def check_messages(expected: Expected, stored: Dict[int, List[dict]]) -> List[str]:
+    problems = []
+    all_ids = [message_id for messages in expected.values() for message_id, _ in messages]
+    if len(all_ids) != len(set(all_ids)):
+        problems.append(f"{len(all_ids) - len(set(all_ids))} message ids were handed out twice")
+
+    for conversation_id, messages in expected.items():
+        have = stored.get(conversation_id, [])
+        ids = [m["id"] for m in have]
+        if ids != sorted(set(ids)):
+            problems.append(f"conversation {conversation_id}: message ids out of order or repeated")
+        contents = {m["id"]: m["content"] for m in have}
+        lost = [message_id for message_id, _ in messages if message_id not in contents]
+        wrong = [message_id for message_id, content in messages if contents.get(message_id, content) != content]
+        if lost:
+            problems.append(f"conversation {conversation_id}: {len(lost)} messages lost")
+        if wrong:
+            problems.append(f"conversation {conversation_id}: {len(wrong)} messages with the wrong content")
+        if len(have) != len(messages):
+            problems.append(f"conversation {conversation_id}: {len(have)} messages stored, {len(messages)} sent")
+    return problems
+
+
+# Straight at the store
+
+def stress_store(store: StorageBackend, users: int, turns: int, threads: int) -> Tuple[List[str], Expected]:
+    problems = []
+    pool = ThreadPoolExecutor(max_workers=threads)
+
+    def register(i: int):
+        name = f"user{i % users}"
+        try:
+            return store.create_user(name, f"{name}@example.com", PASSWORD)
+        except DuplicateUserError:
+            return None
+
+    # Every username twice, concurrently
+    created = [user for user in pool.map(register, range(users * 2)) if user is not None]
+    if len(created) != users:
+        problems.append(f"{len(created)} users created for {users} usernames")
+    if len({user["id"] for user in created}) != len(created):
+        problems.append("user ids were handed out twice")
+
+    first_conversations = list(pool.map(
+        lambda user: store.create_conversation(user["id"], "first")["id"], created
+    ))
+
+    def chat_turn(i: int):
+        new = i % NEW_CONVERSATION_EVERY == 0
+        if new:
+            conversation_id = store.create_conversation(created[i % len(created)]["id"], f"turn {i}")["id"]
+        else:
+            conversation_id = first_conversations[i % len(first_conversations)]
+        sent = store.append_message(conversation_id, "user", f"turn {i}")
+        reply = store.append_message(conversation_id, "assistant", f"reply {i}")
+        store.touch_conversation(conversation_id)
+        return conversation_id, new, [(sent["id"], sent["content"]), (reply["id"], reply["content"])]
+
+    expected: Expected = defaultdict(list)
+    conversation_ids = list(first_conversations)
+    for conversation_id, new, messages in pool.map(chat_turn, range(turns)):
+        expected[conversation_id].extend(messages)
+        if new:
+            conversation_ids.append(conversation_id)
+    pool.shutdown()
+
+    if len(set(conversation_ids)) != len(conversation_ids):
+        problems.append("conversation ids were handed out twice")
+    return problems, expected
+
+
+def verify_store(store: StorageBackend, expected: Expected) -> List[str]:
+    return check_messages(expected, {cid: store.list_messages(cid) for cid in expected})
+
+
+def run_store(backend: str, durability: str, users: int, turns: int, threads: int) -> List[str]:
+    with tempfile.TemporaryDirectory() as data_dir:
+        store = create_store(backend, data_dir, durability=durability, compact_every=max(100, turns // 3))
+        store.load()
+        start = time.perf_counter()
+        problems, expected = stress_store(store, users, turns, threads)
+        elapsed = time.perf_counter() - start
+        problems += verify_store(store, expected)
+        store.close()
+
+        if backend != "memory":
+            store = create_store(backend, data_dir)
+            store.load()
+            problems += [f"after reopening: {p}" for p in verify_store(store, expected)]
+            store.close()
+    print(f"store {backend:>10} {durability:>8}: {turns} turns on {threads} threads in {elapsed:.1f}s, "
+          f"{len(problems)} problems")
+    return problems
+
+
+# Through the API
+
+async def stress_api(users: int, turns: int, concurrency: int) -> List[str]:
+    import httpx
+
+    from main import app
+
+    problems = []
+    await app.router.startup()
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://stress", timeout=120)
+    try:
+        async def register(i: int) -> int:
+            name = f"user{i % users}"
+            response = await client.post(
+                "/api/v1/auth/register", json={"username": name, "email": f"{name}@example.com", "password": PASSWORD}
+            )
+            return response.status_code
+
+        statuses = await asyncio.gather(*(register(i) for i in range(users * 2)))
+        if statuses.count(200) != users or statuses.count(400) != users:
+            problems.append(f"registering every username twice returned {sorted(statuses)}")
+
+        headers = []
+        for u in range(users):
+            response = await client.post("/api/v1/auth/login", data={"username": f"user{u}", "password": PASSWORD})
+            headers.append({"Authorization": f"Bearer {response.json()['access_token']}"})
+
+        first = []
+        for u in range(users):
+            response = await client.post("/api/v1/chat/", json={"message": f"hello {u}"}, headers=headers[u])
+            first.append(response.json()["conversation_id"])
+
+        # Contents per conversation; message ids are not returned by /chat/
+        sent: Dict[int, List[str]] = defaultdict(list)
+        for u, conversation_id in enumerate(first):
+            sent[conversation_id] += [f"hello {u}", f"You said: hello {u}"]
+        semaphore = asyncio.Semaphore(concurrency)
+        failures = 0
+
+        async def chat_turn(i: int):
+            nonlocal failures
+            u = i % users
+            body = {"message": f"turn {i}"}
+            if i % NEW_CONVERSATION_EVERY:
+                body["conversation_id"] = first[u]
+            async with semaphore:
+                response = await client.post("/api/v1/chat/", json=body, headers=headers[u])
+            if response.status_code != 200:
+                failures += 1
+                return
+            sent[response.json()["conversation_id"]] += [f"turn {i}", f"You said: turn {i}"]
+
+        start = time.perf_counter()
+        await asyncio.gather(*(chat_turn(i) for i in range(turns)))
+        elapsed = time.perf_counter() - start
+        if failures:
+            problems.append(f"{failures} chat turns failed")
+
+        all_ids: List[int] = []
+        for u in range(users):
+            response = await client.get("/api/v1/chat/conversations", headers=headers[u])
+            for conversation in response.json()["conversations"]:
+                messages, before = [], None
+                while True:
+                    params = {"limit": 200}
+                    if before is not None:
+                        params["before"] = before
+                    page = (await client.get(
+                        f"/api/v1/chat/history/{conversation['id']}", params=params, headers=headers[u]
+                    )).json()
+                    messages = page["messages"] + messages
+                    if not page["has_more"]:
+                        break
+                    before = page["messages"][0]["id"]
+                all_ids += [m["id"] for m in messages]
+                expected = sent.pop(conversation["id"], [])
+                if sorted(m["content"] for m in messages) != sorted(expected):
+                    problems.append(
+                        f"conversation {conversation['id']}: {len(messages)} messages stored, {len(expected)} sent"
+                    )
+        if sent:
+            problems.append(f"{len(sent)} conversations missing from the conversation lists")
+        if len(all_ids) != len(set(all_ids)):
+            problems.append(f"{len(all_ids) - len(set(all_ids))} message ids were handed out twice")
+    finally:
+        await client.aclose()
+        await app.router.shutdown()
+
+    print(f"api   {os.environ['STORAGE_BACKEND']:>10} {os.environ['DURABILITY']:>8}: {turns} turns at concurrency "
+          f"{concurrency} in {elapsed:.1f}s, {len(problems)} problems")
+    return problems
+
+
+def run_api(backend: str, durability: str, users: int, turns: int, concurrency: int) -> List[str]:
+    # main.py reads its settings at import time, so each run gets a process
+    with tempfile.TemporaryDirectory() as data_dir:
+        # The cheapest bcrypt cost: this checks the store, not hashing
+        env = dict(os.environ, STORAGE_BACKEND=backend, DURABILITY=durability, DATA_DIR=data_dir, BCRYPT_ROUNDS="4")
+        result = subprocess.run(
+            [sys.executable, "-m", "benchmarks.stress_store", "--api-child",
+             "--users", str(users), "--turns", str(turns), "--threads", str(concurrency)],
+            env=env, capture_output=True, text=True,
+        )
+    output = [line for line in result.stdout.splitlines() if line.strip()]
+    for line in output:
+        if line.startswith("api "):
+            print(line)
+    problems = [line for line in output if not line.startswith("api ")]
+    if result.returncode != 0 and not problems:
+        problems.append(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "child failed")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--backends", nargs="+", default=list(STORAGE_BACKENDS), choices=STORAGE_BACKENDS)
+    parser.add_argument("--durability", nargs="+", default=["sync", "async"], choices=DURABILITY_MODES)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=5000, help="concurrent chat turns per run")
+    parser.add_argument("--threads", type=int, default=32, help="threads, or concurrent requests for the API")
+    parser.add_argument("--skip-api", action="store_true")
+    parser.add_argument("--api-child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.api_child:
+        problems = asyncio.run(stress_api(args.users, args.turns, args.threads))
+        for problem in problems:
+            print(problem)
+        sys.exit(1 if problems else 0)
+
+    problems = []
+    for backend in args.backends:
+        # The memory backend has no durability to vary
+        modes = args.durability if backend != "memory" else args.durability[:1]
+        for durability in modes:
+            problems += run_store(backend, durability, args.users, args.turns, args.threads)
+            if not args.skip_api:
+                problems += run_api(backend, durability, args.users, args.turns, args.threads)
+
+    for problem in problems:
+        print(f"FAIL {problem}")
+    print("ok" if not problems else f"{len(problems)} problems")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,11 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, status
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, EmailStr
-from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta
-import json
 import os
-from jose import jwt
+
+from app.api.v1.api import add_exception_handlers, create_api_router
+from app.core.metrics import MetricsMiddleware, metrics_response
+from app.core.security import hashing_executor
+from app.store import StoreLockedError, create_store
 
 # Import settings directly
 class Settings:
@@ -15,136 +14,86 @@ class Settings:
     CORS_ORIGINS = ["http://localhost:5500", "http://127.0.0.1:5500"]
     SECRET_KEY = "supersecretkey"
     ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
+    TOKEN_CACHE_SIZE = 10000  # verified tokens kept until they expire
+    TOKEN_CACHE_TTL_SECONDS = 900
+    USER_CACHE_SIZE = 10000  # authenticated users, kept for USER_CACHE_TTL_SECONDS
+    USER_CACHE_TTL_SECONDS = 60
+    REVOCATION_SYNC_SECONDS = 1.0  # shared stores: how soon other workers see a logout
+    STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "sharded")  # memory, json, sharded, sqlite or sqlalchemy
+    DATA_DIR = os.environ.get("DATA_DIR", os.path.dirname(os.path.abspath(__file__)))
+    SQLITE_PATH = os.environ.get("SQLITE_PATH")  # defaults to chat.db in DATA_DIR
+    DATABASE_URL = os.environ.get("DATABASE_URL")  # sqlalchemy: defaults to the SQLite file at SQLITE_PATH
+    JOURNAL_COMPACT_EVERY = 10000  # journal entries between snapshots
+    DURABILITY = os.environ.get("DURABILITY", "sync")  # sync, batched or async; see app.store.durability
+    FLUSH_INTERVAL_MS = int(os.environ.get("FLUSH_INTERVAL_MS", 50))  # batched/async: time between fsyncs
+    FLUSH_EVERY = int(os.environ.get("FLUSH_EVERY", 1000))  # batched/async: writes that trigger an early fsync
+    MESSAGE_CACHE_MB = int(os.environ.get("MESSAGE_CACHE_MB", 256))  # sharded: messages kept in memory
+    SQLITE_POOL_SIZE = int(os.environ.get("SQLITE_POOL_SIZE", 8))  # sqlite: connections per worker
+    SEARCH_INDEX = os.environ.get("SEARCH_INDEX", "false").lower() == "true"  # sharded: keep the search index in memory
+    HISTORY_PAGE_SIZE = 50
+    HISTORY_PAGE_MAX = 200
+    SEARCH_RESULTS = 20  # conversations per search
+    SEARCH_RESULTS_MAX = 50
+    IMPORT_BATCH_SIZE = 1000  # records written per batch by /chat/import
+    RESPONSE_CACHE_MB = int(os.environ.get("RESPONSE_CACHE_MB", 32))  # serialized conversation lists and history pages
+    RESPONSE_GENERATOR = os.environ.get("RESPONSE_GENERATOR", "echo")  # see app.llm.generators.GENERATORS
+    RESPONSE_LATENCY_MS = float(os.environ.get("RESPONSE_LATENCY_MS", 0))  # slow generator: wait before the first chunk
+    RESPONSE_CHUNK_DELAY_MS = float(os.environ.get("RESPONSE_CHUNK_DELAY_MS", 50))  # slow generator: wait before each chunk
+    GENERATION_WORKERS = int(os.environ.get("GENERATION_WORKERS", 8))  # generations running at once
+    GENERATION_QUEUE_SIZE = int(os.environ.get("GENERATION_QUEUE_SIZE", 64))  # waiting for a worker, beyond which chat gets a 503
+    GENERATION_TIMEOUT_SECONDS = 60.0  # from request to last chunk; 504 after that
+    GENERATION_CACHE_SIZE = int(os.environ.get("GENERATION_CACHE_SIZE", 1000))  # replies by (context, prompt); 0 disables
+    GENERATION_CACHE_TTL_SECONDS = 3600
+    CONTEXT_BUDGET = int(os.environ.get("CONTEXT_BUDGET", 8000))  # latest messages sent with a prompt, in CONTEXT_BUDGET_UNIT
+    CONTEXT_BUDGET_UNIT = os.environ.get("CONTEXT_BUDGET_UNIT", "chars")  # chars or tokens (estimated)
+    CONTEXT_SUMMARY_CHARS = 2000  # rolling summary of the messages before them
+    CONTEXT_CACHE_SIZE = int(os.environ.get("CONTEXT_CACHE_SIZE", 2000))  # conversations whose context is kept in memory
+    WS_MAX_CONNECTIONS = int(os.environ.get("WS_MAX_CONNECTIONS", 10000))  # chat WebSockets open at once, per worker
+    WS_MAX_PENDING_TURNS = 4  # chat messages waiting on one WebSocket while a reply is streamed
+    WS_HEARTBEAT_SECONDS = 20.0  # between pings; a client silent for two is disconnected
+    WS_IDLE_TIMEOUT_SECONDS = float(os.environ.get("WS_IDLE_TIMEOUT_SECONDS", 600))  # without a chat turn
+    WS_AUTH_TIMEOUT_SECONDS = 10.0  # from connecting to the auth message
+    WS_SEND_TIMEOUT_SECONDS = 30.0  # for the client to take a frame
+    METRICS_ENABLED = True  # Prometheus metrics at /metrics
 
 settings = Settings()
 
-# Create routers
-api_router = APIRouter()
-auth_router = APIRouter()
-chat_router = APIRouter()
-
-# Define schemas
-class Token(BaseModel):
-    access_token: str
-    token_type: str
-
-class UserBase(BaseModel):
-    username: str
-    email: EmailStr
-
-class UserCreate(UserBase):
-    password: str
-
-class User(UserBase):
-    id: int
-
-class MessageBase(BaseModel):
-    content: str
-    role: str
-
-class ChatRequest(BaseModel):
-    message: str
-    conversation_id: Optional[int] = None
-
-class ChatResponse(BaseModel):
-    message: str
-    conversation_id: int
-
-# In-memory database
-users_db = {}
-conversations_db = {}
-messages_db = {}
-next_user_id = 1
-next_conversation_id = 1
-next_message_id = 1
+# Storage backend picked by STORAGE_BACKEND. The default keeps users and
+# conversations in memory, journaled to DATA_DIR and compacted into a
+# snapshot on a background thread, and loads each conversation's messages
+# from its own segment file on first use; see app.store. Only the sqlite
+# and sqlalchemy backends can be shared by several worker processes.
+store = create_store(
+    settings.STORAGE_BACKEND,
+    settings.DATA_DIR,
+    sqlite_path=settings.SQLITE_PATH,
+    compact_every=settings.JOURNAL_COMPACT_EVERY,
+    cache_bytes=settings.MESSAGE_CACHE_MB * 1024 * 1024,
+    durability=settings.DURABILITY,
+    flush_interval=settings.FLUSH_INTERVAL_MS / 1000,
+    flush_every=settings.FLUSH_EVERY,
+    pool_size=settings.SQLITE_POOL_SIZE,
+    search_index=settings.SEARCH_INDEX,
+    database_url=settings.DATABASE_URL,
+)
 
-# Load data from JSON files if they exist
+# Load or recover the persisted state
 def load_data():
-    global users_db, conversations_db, messages_db, next_user_id, next_conversation_id, next_message_id
-
-    # Get the current directory (where main.py is located)
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-
-    # Define file paths
-    users_file = os.path.join(current_dir, 'users.json')
-    conversations_file = os.path.join(current_dir, 'conversations.json')
-    messages_file = os.path.join(current_dir, 'messages.json')
+    store.load()
 
-    if os.path.exists(users_file):
-        with open(users_file, 'r') as f:
-            data = json.load(f)
-            users_db = data['users']
-            next_user_id = data['next_id']
-
-    if os.path.exists(conversations_file):
-        with open(conversations_file, 'r') as f:
-            data = json.load(f)
-            conversations_db = data['conversations']
-            next_conversation_id = data['next_id']
-
-    if os.path.exists(messages_file):
-        with open(messages_file, 'r') as f:
-            data = json.load(f)
-            messages_db = data['messages']
-            next_message_id = data['next_id']
-
-# Save data to JSON files
+# Write a full snapshot, if the backend keeps one
 def save_data():
-    # Get the current directory (where main.py is located)
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-
-    # Define file paths
-    users_file = os.path.join(current_dir, 'users.json')
-    conversations_file = os.path.join(current_dir, 'conversations.json')
-    messages_file = os.path.join(current_dir, 'messages.json')
-
-    with open(users_file, 'w') as f:
-        json.dump({'users': users_db, 'next_id': next_user_id}, f)
-
-    with open(conversations_file, 'w') as f:
-        json.dump({'conversations': conversations_db, 'next_id': next_conversation_id}, f)
-
-    with open(messages_file, 'w') as f:
-        json.dump({'messages': messages_db, 'next_id': next_message_id}, f)
+    store.save()
 
 # Try to load data
 try:
     load_data()
+except StoreLockedError:
+    # Another worker owns the data; starting empty would overwrite it
+    raise
 except Exception as e:
     print(f"Error loading data: {e}")
 
-# Authentication functions
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/auth/login")
-
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm="HS256")
-    return encoded_jwt
-
-def get_current_user(token: str = Depends(oauth2_scheme)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-    except jwt.JWTError:
-        raise credentials_exception
-
-    user = users_db.get(str(user_id))
-    if user is None:
-        raise credentials_exception
-    return user
-
 app = FastAPI(
     title=settings.PROJECT_NAME,
     openapi_url=f"{settings.API_V1_STR}/openapi.json"
@@ -157,200 +106,27 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
-# Auth endpoints
-@auth_router.post("/register", response_model=User)
-def register(user: UserCreate):
-    global next_user_id
-
-    # Check if username already exists
-    for user_id, existing_user in users_db.items():
-        if existing_user["username"] == user.username:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Username already registered",
-            )
-
-    # Check if email already exists
-    for user_id, existing_user in users_db.items():
-        if existing_user["email"] == user.email:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Email already registered",
-            )
-
-    # Create new user
-    user_id = str(next_user_id)
-    users_db[user_id] = {
-        "id": next_user_id,
-        "username": user.username,
-        "email": user.email,
-        "password": user.password  # In a real app, hash this password
-    }
-    next_user_id += 1
-
-    # Save data
-    save_data()
-
-    return {
-        "id": int(user_id),
-        "username": user.username,
-        "email": user.email
-    }
-
-@auth_router.post("/login", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    # Find user by username
-    user = None
-    user_id = None
-    for uid, u in users_db.items():
-        if u["username"] == form_data.username:
-            user = u
-            user_id = uid
-            break
-
-    # Check credentials
-    if not user or user["password"] != form_data.password:  # In a real app, verify hashed password
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Incorrect username or password",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-
-    # Create access token
-    access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user_id},
-        expires_delta=access_token_expires
-    )
-
-    return {"access_token": access_token, "token_type": "bearer"}
-
-@auth_router.get("/me", response_model=User)
-def read_users_me(current_user: dict = Depends(get_current_user)):
-    return {
-        "id": current_user["id"],
-        "username": current_user["username"],
-        "email": current_user["email"]
-    }
-
-# Chat endpoints
-@chat_router.post("/", response_model=ChatResponse)
-def chat(chat_request: ChatRequest, current_user: dict = Depends(get_current_user)):
-    global next_conversation_id, next_message_id
-
-    # Get or create conversation
-    conversation_id = None
-    if chat_request.conversation_id:
-        # Check if conversation exists and belongs to user
-        conv_id = str(chat_request.conversation_id)
-        if conv_id in conversations_db and conversations_db[conv_id]["user_id"] == current_user["id"]:
-            conversation_id = conv_id
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Conversation not found",
-            )
-    else:
-        # Create a new conversation
-        title = chat_request.message[:30] + "..." if len(chat_request.message) > 30 else chat_request.message
-        conversation_id = str(next_conversation_id)
-        conversations_db[conversation_id] = {
-            "id": next_conversation_id,
-            "title": title,
-            "user_id": current_user["id"],
-            "created_at": datetime.utcnow().isoformat(),
-            "updated_at": datetime.utcnow().isoformat()
-        }
-        next_conversation_id += 1
-
-    # Add user message
-    message_id = str(next_message_id)
-    messages_db[message_id] = {
-        "id": next_message_id,
-        "content": chat_request.message,
-        "role": "user",
-        "conversation_id": int(conversation_id),
-        "created_at": datetime.utcnow().isoformat()
-    }
-    next_message_id += 1
-
-    # Generate AI response (simple echo for now)
-    ai_response = f"You said: {chat_request.message}"
-
-    # Add AI message
-    message_id = str(next_message_id)
-    messages_db[message_id] = {
-        "id": next_message_id,
-        "content": ai_response,
-        "role": "assistant",
-        "conversation_id": int(conversation_id),
-        "created_at": datetime.utcnow().isoformat()
-    }
-    next_message_id += 1
-
-    # Update conversation timestamp
-    conversations_db[conversation_id]["updated_at"] = datetime.utcnow().isoformat()
-
-    # Save data
-    save_data()
-
-    return {
-        "message": ai_response,
-        "conversation_id": int(conversation_id)
-    }
-
-@chat_router.get("/conversations", response_model=Dict[str, List[Dict[str, Any]]])
-def get_conversations(current_user: dict = Depends(get_current_user)):
-    # Get all conversations for the current user
-    user_conversations = []
-    for conv_id, conv in conversations_db.items():
-        if conv["user_id"] == current_user["id"]:
-            user_conversations.append({
-                "id": conv["id"],
-                "title": conv["title"],
-                "created_at": conv["created_at"]
-            })
-
-    # Sort by updated_at (newest first)
-    user_conversations.sort(key=lambda x: conversations_db[str(x["id"])]["updated_at"], reverse=True)
-
-    return {"conversations": user_conversations}
-
-@chat_router.get("/history/{conversation_id}", response_model=Dict[str, List[Dict[str, str]]])
-def get_conversation_history(conversation_id: int, current_user: dict = Depends(get_current_user)):
-    # Check if conversation exists and belongs to user
-    conv_id = str(conversation_id)
-    if conv_id not in conversations_db or conversations_db[conv_id]["user_id"] != current_user["id"]:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Conversation not found",
-        )
-
-    # Get all messages for the conversation
-    conversation_messages = []
-    for msg_id, msg in messages_db.items():
-        if msg["conversation_id"] == conversation_id:
-            conversation_messages.append({
-                "role": msg["role"],
-                "content": msg["content"]
-            })
+# Per-route request metrics, plus the storage timings recorded by app.store
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
 
-    # Sort by created_at
-    conversation_messages.sort(key=lambda x: next(
-        msg["created_at"] for msg_id, msg in messages_db.items()
-        if msg["role"] == x["role"] and msg["content"] == x["content"]
-    ))
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        return metrics_response()
 
-    return {"messages": conversation_messages}
+@app.on_event("shutdown")
+def close_store():
+    store.close()
+    hashing_executor.shutdown()
 
-# Include routers
-api_router.include_router(auth_router, prefix="/auth", tags=["auth"])
-api_router.include_router(chat_router, prefix="/chat", tags=["chat"])
+# 503 and 504 for the generation and hashing pools
+add_exception_handlers(app)
 
-# Include API router
-app.include_router(api_router, prefix=settings.API_V1_STR)
+# The API, on the store
+app.include_router(create_api_router(store, settings), prefix=settings.API_V1_STR)
 
 @app.get("/")
 def root():
@@ -0,0 +1,4 @@
+import os
+
+# The cheapest bcrypt cost, set before app.core.config reads it
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
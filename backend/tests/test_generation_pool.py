@@ -0,0 +1,115 @@
+import asyncio
+
+import pytest
+
+from app.llm import GenerationBusyError, GenerationCancelledError, GenerationTimeoutError, SlowGenerator
+from app.llm.pool import GenerationPool
+
+REPLY = "You said: hello there world"
+
+
+def make_pool(generator: SlowGenerator, workers: int = 4, queue_size: int = 4, timeout: float = 5.0, cache_size: int = 0):
+    return GenerationPool(generator, workers, queue_size, timeout, cache_size, cache_ttl=60)
+
+
+async def read(chunks) -> str:
+    return "".join([chunk async for chunk in chunks])
+
+
+def test_same_prompt_shares_one_generation():
+    async def run():
+        generator = SlowGenerator(delay=0.01)
+        pool = make_pool(generator)
+        first = pool.stream("hello there world")
+        second = pool.stream("hello there world")
+        replies = await asyncio.gather(read(first), read(second))
+        return generator.calls, replies
+
+    calls, replies = asyncio.run(run())
+    assert calls == 1
+    assert replies == [REPLY, REPLY]
+
+
+def test_coalesced_reader_counts_before_it_reads():
+    async def run():
+        pool = make_pool(SlowGenerator(delay=0.01))
+        first = pool.stream("hello there world")
+        await first.__anext__()
+        # Joins, but does not read yet, like a handler that stores the
+        # user's message first
+        second = pool.stream("hello there world")
+        await first.aclose()
+        await asyncio.sleep(0.05)
+        return await read(second)
+
+    assert asyncio.run(run()) == REPLY
+
+
+def test_generation_is_cancelled_once_nobody_reads():
+    async def run():
+        generator = SlowGenerator(delay=0.05)
+        pool = make_pool(generator)
+        chunks = pool.stream("hello there world")
+        await chunks.__anext__()
+        task = next(iter(pool._in_flight.values())).task
+        await chunks.aclose()
+        await asyncio.gather(task, return_exceptions=True)
+        in_flight = pool.stats()["in_flight"]
+        # A new request starts over instead of joining the cancelled one
+        reply = await read(pool.stream("hello there world"))
+        return in_flight, generator.calls, reply
+
+    in_flight, calls, reply = asyncio.run(run())
+    assert in_flight == 0
+    assert calls == 2
+    assert reply == REPLY
+
+
+def test_cancelled_generation_fails_its_readers():
+    async def run():
+        pool = make_pool(SlowGenerator(delay=0.05))
+        chunks = pool.stream("hello there world")
+        await chunks.__anext__()
+        next(iter(pool._in_flight.values())).task.cancel()
+        await read(chunks)
+
+    with pytest.raises(GenerationCancelledError):
+        asyncio.run(run())
+
+
+def test_slow_generation_times_out():
+    async def run():
+        pool = make_pool(SlowGenerator(latency=1.0), timeout=0.05)
+        await read(pool.stream("hello"))
+
+    with pytest.raises(GenerationTimeoutError):
+        asyncio.run(run())
+
+
+def test_full_pool_is_busy():
+    async def run():
+        pool = make_pool(SlowGenerator(delay=0.05), workers=1, queue_size=1)
+        first = pool.stream("one")
+        second = pool.stream("two")
+        with pytest.raises(GenerationBusyError):
+            pool.stream("three")
+        # Joining a generation in flight needs no room
+        third = pool.stream("one")
+        replies = await asyncio.gather(read(first), read(second), read(third))
+        # Room again once they are done
+        replies.append(await read(pool.stream("three")))
+        return replies
+
+    assert asyncio.run(run()) == ["You said: one", "You said: two", "You said: one", "You said: three"]
+
+
+def test_finished_replies_are_cached():
+    async def run():
+        generator = SlowGenerator(delay=0)
+        pool = make_pool(generator, cache_size=10)
+        replies = [await read(pool.stream("hello there world")) for _ in range(2)]
+        return generator.calls, replies
+
+    calls, replies = asyncio.run(run())
+    assert calls == 1
+    assert replies == [REPLY, REPLY]
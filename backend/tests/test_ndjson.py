@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from app.core.ndjson import ImportFormatError, RecordReader
+
+
+async def chunks(*lines: str):
+    for line in lines:
+        yield (line + "\n").encode()
+
+
+def read(*lines: str):
+    async def collect():
+        return [batch async for batch in RecordReader().batches(chunks(*lines), 2)]
+
+    return asyncio.run(collect())
+
+
+CONVERSATION = '{"type": "conversation", "id": 7, "title": "Hello"}'
+
+
+def test_records_are_read_in_batches():
+    batches = read(
+        CONVERSATION,
+        '{"type": "message", "conversation_id": 7, "role": "user", "content": "Hi"}',
+        "",
+        '{"type": "message", "conversation_id": 7, "role": "assistant", "content": "Hello"}',
+    )
+    assert batches == [
+        [
+            {"type": "conversation", "id": 7, "title": "Hello"},
+            {"type": "message", "conversation_id": 7, "role": "user", "content": "Hi"},
+        ],
+        [{"type": "message", "conversation_id": 7, "role": "assistant", "content": "Hello"}],
+    ]
+
+
+@pytest.mark.parametrize("line, error", [
+    ('{"type": "message", "conversation_id": 7, "role": "wizard", "content": "Hi"}', "'role' must be one of"),
+    ('{"type": "message", "conversation_id": 7, "role": 1, "content": "Hi"}', "'role' must be a string"),
+    ('{"type": "message", "conversation_id": 8, "role": "user", "content": "Hi"}', "before the conversation"),
+    (CONVERSATION, "appears twice"),
+    ("[]", "expected a JSON object"),
+    ("{", "not valid JSON"),
+])
+def test_invalid_lines_are_rejected(line, error):
+    with pytest.raises(ImportFormatError) as info:
+        read(CONVERSATION, line)
+    assert info.value.line == 2
+    assert error in str(info.value)
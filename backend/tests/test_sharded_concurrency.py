@@ -0,0 +1,76 @@
+"""
+Loading segments into the cache while other threads append to them never
+loses or corrupts a message
+"""
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from app.store import ShardedStore
+
+CONVERSATIONS = 8
+MESSAGES = 50
+
+
+def split_writes(flusher) -> None:
+    # A large append can reach the file in pieces; make every one do so,
+    # with a pause in between for a reader to see half a line
+    def write(path: str, text: str) -> None:
+        f = flusher._open(path)
+        half = len(text) // 2
+        f.write(text[:half])
+        f.flush()
+        time.sleep(0.0005)
+        f.write(text[half:])
+        f.flush()
+
+    flusher._write = write
+
+
+@pytest.mark.parametrize("durability", ["sync", "batched", "async"])
+def test_appends_survive_evicting_loads(tmp_path, durability):
+    # No cache to speak of: nearly every read loads a segment from disk
+    store = ShardedStore(str(tmp_path), cache_bytes=1, durability=durability)
+    store.load()
+    split_writes(store.flusher)
+    user_id = store.create_user("alice", "alice@example.com", "secret")["id"]
+    conversation_ids = [store.create_conversation(user_id, f"chat {c}")["id"] for c in range(CONVERSATIONS)]
+    done = threading.Event()
+    errors = []
+
+    def write(conversation_id: int) -> None:
+        try:
+            for m in range(MESSAGES):
+                store.append_message(conversation_id, "user", f"message {m} " + "x" * 200)
+        except Exception as e:
+            errors.append(e)
+
+    def read() -> None:
+        while not done.is_set():
+            for conversation_id in conversation_ids:
+                store.list_messages(conversation_id)
+
+    readers = [threading.Thread(target=read) for _ in range(2)]
+    writers = [threading.Thread(target=write, args=(c,)) for c in conversation_ids]
+    for thread in readers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    done.set()
+    for thread in readers:
+        thread.join()
+    store.close()
+    assert errors == []
+
+    for conversation_id in conversation_ids:
+        with open(store._segment_path(conversation_id), encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f]
+        assert [line["content"].split(" ")[1] for line in lines] == [str(m) for m in range(MESSAGES)]
+
+    store = ShardedStore(str(tmp_path))
+    store.load()
+    assert all(len(store.list_messages(c)) == MESSAGES for c in conversation_ids)
+    store.close()
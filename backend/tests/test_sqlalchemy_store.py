@@ -0,0 +1,68 @@
+"""
+The app package's backend: group commit, atomic batches and deactivated
+users
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import create_engine, update
+
+from app.models.user import User
+from app.store import DuplicateUserError, SqlAlchemyStore
+
+
+def open_store(data_dir, **options) -> SqlAlchemyStore:
+    engine = create_engine(f"sqlite:///{data_dir}/chat.db", connect_args={"check_same_thread": False})
+    store = SqlAlchemyStore(engine, **options)
+    store.load()
+    return store
+
+
+def test_group_commit_keeps_every_concurrent_write(tmp_path):
+    store = open_store(tmp_path, group_commit=True, window=0.01)
+    user = store.create_user("alice", "alice@example.com", "secret")
+    conversations = [store.create_conversation(user["id"], f"chat {i}")["id"] for i in range(4)]
+
+    def append(i):
+        return store.append_message(conversations[i % 4], "user", f"message {i}")
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        messages = list(pool.map(append, range(200)))
+    assert len({message["id"] for message in messages}) == 200
+
+    # A failing write is retried alone and does not fail the rest
+    with pytest.raises(DuplicateUserError):
+        store.create_user("bob", "alice@example.com", "secret")
+    store.close()
+
+    store = open_store(tmp_path)
+    stored = [message["id"] for c in conversations for message in store.list_messages(c)]
+    assert sorted(stored) == sorted(message["id"] for message in messages)
+    store.close()
+
+
+def test_batch_is_one_transaction(tmp_path):
+    store = open_store(tmp_path)
+    user = store.create_user("alice", "alice@example.com", "secret")
+    with pytest.raises(RuntimeError):
+        with store.batch():
+            conversation = store.create_conversation(user["id"], "imported")
+            store.append_message(conversation["id"], "user", "hello")
+            raise RuntimeError("import failed")
+    assert store.list_conversations(user["id"]) == []
+
+    with store.batch():
+        conversation = store.create_conversation(user["id"], "imported")
+        store.append_message(conversation["id"], "user", "hello")
+    assert [m["content"] for m in store.list_messages(conversation["id"])] == ["hello"]
+    store.close()
+
+
+def test_deactivated_user_is_not_found(tmp_path):
+    store = open_store(tmp_path)
+    user = store.create_user("alice", "alice@example.com", "secret")
+    with store.engine.begin() as connection:
+        connection.execute(update(User).where(User.id == user["id"]).values(is_active=False))
+    assert store.get_user(user["id"]) is None
+    assert store.get_user_by_username("alice") is None
+    store.close()
@@ -0,0 +1,53 @@
+"""
+Messages with a role outside app.store.records.ROLES never reach a store,
+and a bad line in a segment does not make its conversation unreadable
+"""
+import pytest
+
+from app.store import STORAGE_BACKENDS, ShardedStore, create_store
+
+
+def open_store(kind: str, data_dir: str):
+    store = create_store(kind, data_dir)
+    store.load()
+    return store
+
+
+@pytest.mark.parametrize("kind", STORAGE_BACKENDS)
+def test_unknown_role_is_rejected_before_it_is_stored(kind, tmp_path):
+    store = open_store(kind, str(tmp_path))
+    user = store.create_user("alice", "alice@example.com", "secret")
+    conversation_id = store.create_conversation(user["id"], "chat")["id"]
+    store.append_message(conversation_id, "user", "hello")
+    with pytest.raises(ValueError):
+        store.append_message(conversation_id, "wizard", "abracadabra")
+    assert [m["role"] for m in store.list_messages(conversation_id)] == ["user"]
+    store.close()
+
+    if kind != "memory":
+        store = open_store(kind, str(tmp_path))
+        assert [m["content"] for m in store.list_messages(conversation_id)] == ["hello"]
+        store.append_message(conversation_id, "assistant", "hi")
+        assert len(store.list_messages(conversation_id)) == 2
+        store.close()
+
+
+def test_invalid_segment_lines_are_skipped(tmp_path):
+    store = open_store("sharded", str(tmp_path))
+    user = store.create_user("alice", "alice@example.com", "secret")
+    conversation_id = store.create_conversation(user["id"], "chat")["id"]
+    store.append_message(conversation_id, "user", "hello")
+    path = store._segment_path(conversation_id)
+    store.close()
+
+    # As written by a version that did not check roles
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"id":2,"role":"wizard","content":"abracadabra","created_at":"2025-01-01T00:00:00"}\n')
+        f.write('{"id":3,"content":"no role"}\n')
+
+    store = ShardedStore(str(tmp_path))
+    store.load()
+    assert [m["content"] for m in store.list_messages(conversation_id)] == ["hello"]
+    store.append_message(conversation_id, "assistant", "hi")
+    assert [m["content"] for m in store.list_messages(conversation_id)] == ["hello", "hi"]
+    store.close()
@@ -0,0 +1,70 @@
+import threading
+
+import pytest
+
+from app.store import ShardedStore
+from app.store.search import SearchIndex
+
+
+def fill(data_dir: str) -> int:
+    store = ShardedStore(data_dir)
+    store.load()
+    user_id = store.create_user("alice", "alice@example.com", "secret")["id"]
+    for c in range(20):
+        conversation_id = store.create_conversation(user_id, f"chat {c}")["id"]
+        for m in range(20):
+            store.append_message(conversation_id, "user", f"apple c{c} m{m}")
+    store.close()
+    return user_id
+
+
+def found(store: ShardedStore, user_id: int, query: str) -> int:
+    # Conversations with a match
+    return len(store.search(user_id, query, 50))
+
+
+@pytest.mark.parametrize("search_index", [True, False])
+def test_messages_written_while_indexing_are_found(tmp_path, search_index):
+    user_id = fill(str(tmp_path))
+    store = ShardedStore(str(tmp_path), search_index=search_index)
+    store.load()
+
+    def write():
+        for conv_id in range(1, 21):
+            store.append_message(conv_id, "assistant", f"banana {conv_id}")
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    writer.join()
+    if store._indexer is not None:
+        store._indexer.join()
+    assert found(store, user_id, "banana") == 20
+    assert found(store, user_id, "apple c7") == 1
+    assert found(store, user_id, "apple m7") == 20
+    # Without search_index nothing is kept in memory
+    assert (store.search_index.stats()["postings"] > 0) == search_index
+    store.close()
+
+
+def test_conversation_changed_while_read_is_read_again(tmp_path):
+    user_id = fill(str(tmp_path))
+    store = ShardedStore(str(tmp_path), search_index=True)
+    store.load()
+    store._indexer.join()
+    store.search_index = SearchIndex()
+    read = store._messages_to_index
+    reads = []
+
+    def racing_read(conversation_id):
+        # A message is written after the segment was read
+        messages = read(conversation_id)
+        if not reads:
+            store.append_message(conversation_id, "assistant", "cherry")
+        reads.append(conversation_id)
+        return messages
+
+    store._messages_to_index = racing_read
+    store._index_conversation("1")
+    assert reads == [1, 1]
+    assert found(store, user_id, "cherry") == 1
+    store.close()
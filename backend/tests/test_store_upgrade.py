@@ -0,0 +1,83 @@
+"""
+Upgrading a data directory from the older JSON files, or from the json
+backend, to the sharded backend keeps every message
+"""
+import json
+import os
+import subprocess
+import sys
+
+from app.store import JsonStore, ShardedStore
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CREATED = "2025-04-11T17:42:49.172006"
+
+
+def write_json_files(data_dir: str) -> None:
+    users = {"1": {"id": 1, "username": "alice", "email": "alice@example.com", "password": "secret"}}
+    conversations = {
+        str(i): {"id": i, "title": f"chat {i}", "user_id": 1, "created_at": CREATED, "updated_at": CREATED}
+        for i in (1, 2)
+    }
+    messages = {
+        str(i): {
+            "id": i, "content": f"message {i}", "role": "user" if i % 2 else "assistant",
+            "conversation_id": 1 if i <= 4 else 2, "created_at": CREATED,
+        }
+        for i in range(1, 7)
+    }
+    for name, key, records in (
+        ("users.json", "users", users),
+        ("conversations.json", "conversations", conversations),
+        ("messages.json", "messages", messages),
+    ):
+        with open(os.path.join(data_dir, name), "w") as f:
+            json.dump({key: records, "next_id": len(records) + 1}, f)
+
+
+def contents(store, conversation_id: int):
+    return [message["content"] for message in store.list_messages(conversation_id)]
+
+
+def assert_upgraded(data_dir: str) -> None:
+    store = ShardedStore(data_dir)
+    store.load()
+    try:
+        assert contents(store, 1) == [f"message {i}" for i in range(1, 5)]
+        assert contents(store, 2) == ["message 5", "message 6"]
+        assert store.append_message(2, "user", "new")["id"] == 7
+    finally:
+        store.close()
+    assert not os.path.exists(os.path.join(data_dir, "messages.json"))
+
+
+def convert(data_dir: str, *args: str) -> None:
+    # -W error: running the module must not warn about app.store importing it
+    subprocess.run(
+        [sys.executable, "-W", "error", "-m", "app.store.convert", data_dir, *args],
+        cwd=BACKEND_DIR, check=True, capture_output=True, env=dict(os.environ, STORAGE_BACKEND="sharded"),
+    )
+
+
+def test_convert_json_files_for_the_sharded_backend(tmp_path):
+    write_json_files(str(tmp_path))
+    convert(str(tmp_path))
+    assert_upgraded(str(tmp_path))
+
+
+def test_sharded_store_reads_messages_json_next_to_a_json_snapshot(tmp_path):
+    # What the converter wrote before it used the configured backend
+    write_json_files(str(tmp_path))
+    convert(str(tmp_path), "--backend", "json")
+    assert os.path.exists(os.path.join(str(tmp_path), "messages.json"))
+    assert_upgraded(str(tmp_path))
+
+
+def test_sharded_store_reads_the_messages_of_a_json_store(tmp_path):
+    write_json_files(str(tmp_path))
+    store = JsonStore(str(tmp_path))
+    store.load()
+    store.compact()
+    store.close()
+    os.remove(os.path.join(str(tmp_path), "messages.json"))
+    assert_upgraded(str(tmp_path))
@@ -0,0 +1,21 @@
+import pytest
+
+from app.core.security import get_password_hash, verify_password
+from app.store import STORAGE_BACKENDS, create_store
+
+
+@pytest.mark.parametrize("kind", STORAGE_BACKENDS)
+def test_password_hash_is_replaced(kind, tmp_path):
+    store = create_store(kind, str(tmp_path))
+    store.load()
+    user = store.create_user("alice", "alice@example.com", get_password_hash("old"))
+    store.set_password(user["id"], get_password_hash("new"))
+    for found in (store.get_user(user["id"]), store.get_user_by_username("alice")):
+        assert verify_password("new", found["password"])
+    store.close()
+
+    if kind != "memory":
+        store = create_store(kind, str(tmp_path))
+        store.load()
+        assert verify_password("new", store.get_user_by_email("alice@example.com")["password"])
+        store.close()
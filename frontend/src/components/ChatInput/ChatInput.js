@@ -10,6 +10,14 @@ document.addEventListener('DOMContentLoaded', () => {
     const API_BASE_URL = 'http://localhost:8000/api/v1';
     console.log('Using API base URL:', API_BASE_URL);
 
+    // Conversation history is loaded newest page first; older pages are
+    // fetched with the `before` cursor when the user scrolls to the top
+    const HISTORY_PAGE_SIZE = 50;
+    let historyConversationId = null;
+    let oldestMessageId = null;
+    let hasMoreHistory = false;
+    let loadingOlderMessages = false;
+
     // Auto-resize textarea
     const resizeTextarea = () => {
         // Reset height to auto to get the correct scrollHeight
@@ -64,6 +72,132 @@ document.addEventListener('DOMContentLoaded', () => {
         window.location.href = 'login.html';
     }
 
+    // Chat messages go over one WebSocket, authenticated once when it is
+    // opened; it is opened again by the next message after it closes
+    const WS_URL = API_BASE_URL.replace(/^http/, 'ws') + '/chat/ws';
+    let chatSocket = null;
+    let nextTurnId = 1;
+    const socketTurns = new Map();
+
+    const getChatSocket = (token) => {
+        if (!chatSocket) {
+            chatSocket = new Promise((resolve, reject) => {
+                const socket = new WebSocket(WS_URL);
+                socket.onopen = () => socket.send(JSON.stringify({ type: 'auth', token: token }));
+                socket.onmessage = (event) => {
+                    const frame = JSON.parse(event.data);
+                    if (frame.type === 'ready') {
+                        resolve(socket);
+                    } else if (frame.type === 'ping') {
+                        socket.send(JSON.stringify({ type: 'pong' }));
+                    } else if (socketTurns.has(frame.id)) {
+                        socketTurns.get(frame.id).onFrame(frame);
+                    }
+                };
+                socket.onclose = () => {
+                    chatSocket = null;
+                    reject(new Error('WebSocket closed'));
+                    socketTurns.forEach(turn => turn.onClose());
+                    socketTurns.clear();
+                };
+            });
+        }
+        return chatSocket;
+    };
+
+    const streamOverSocket = (socket, message, conversationId, onToken) => new Promise((resolve, reject) => {
+        const id = nextTurnId++;
+        socketTurns.set(id, {
+            onFrame: (frame) => {
+                if (frame.type === 'token') {
+                    onToken(frame.token);
+                } else if (frame.type === 'done') {
+                    socketTurns.delete(id);
+                    resolve(frame);
+                } else if (frame.type === 'error') {
+                    socketTurns.delete(id);
+                    reject(new Error(`Request failed with status ${frame.status}`));
+                }
+            },
+            onClose: () => reject(new Error('WebSocket closed before the reply was complete'))
+        });
+        socket.send(JSON.stringify({
+            type: 'chat',
+            id: id,
+            message: message,
+            conversation_id: conversationId
+        }));
+    });
+
+    // The reply streamed back as Server-Sent Events
+    const streamOverHttp = async (token, message, conversationId, onToken) => {
+        const response = await fetch(`${API_BASE_URL}/chat/stream`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Authorization': `Bearer ${token}`
+            },
+            body: JSON.stringify({
+                message: message,
+                conversation_id: conversationId
+            })
+        });
+
+        if (!response.ok || !response.body) {
+            throw new Error(`Request failed with status ${response.status}`);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        const data = {};
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            // Events are separated by a blank line
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let eventName = 'message';
+                let payload = '';
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event: ')) eventName = line.slice(7);
+                    else if (line.startsWith('data: ')) payload += line.slice(6);
+                });
+                if (!payload) continue;
+                const eventData = JSON.parse(payload);
+
+                if (eventName === 'start' || eventName === 'done') {
+                    Object.assign(data, eventData);
+                } else if (eventData.token !== undefined) {
+                    onToken(eventData.token);
+                }
+            }
+        }
+        return data;
+    };
+
+    // Streams the reply to a message, calling onToken with each chunk, and
+    // resolves to {message, conversation_id}. Uses the WebSocket, or HTTP
+    // when it cannot be opened; a message is never sent over both.
+    const streamReply = async (token, message, conversationId, onToken) => {
+        let socket = null;
+        try {
+            socket = await getChatSocket(token);
+        } catch (error) {
+            console.warn('WebSocket unavailable, sending over HTTP:', error);
+        }
+        if (socket) {
+            return streamOverSocket(socket, message, conversationId, onToken);
+        }
+        return streamOverHttp(token, message, conversationId, onToken);
+    };
+
     const sendMessage = async (e) => {
         console.log('Send message function called');
         // Prevent any form submission that might be causing page reload
@@ -109,29 +243,26 @@ document.addEventListener('DOMContentLoaded', () => {
             console.log('Sending with conversation ID:', conversationId);
 
             try {
-                // Make API request to send message
-                const response = await axios.post(`${API_BASE_URL}/chat/`, {
-                    message: message,
-                    conversation_id: conversationId ? parseInt(conversationId) : null
-                }, {
-                    headers: {
-                        'Authorization': `Bearer ${token}`
+                // Send the message; the reply is shown as it arrives
+                const contentElement = loadingMessage.querySelector('.message-content');
+                let responseText = '';
+                const data = await streamReply(
+                    token, message, conversationId ? parseInt(conversationId) : null, (chunk) => {
+                        responseText += chunk;
+                        contentElement.innerHTML = formatMessage(responseText);
+                        scrollToBottom();
                     }
-                });
-
-                console.log('API response:', response.data);
+                );
 
-                if (!response.data) {
-                    throw new Error('Empty response from server');
-                }
+                console.log('API response:', data);
 
-                // Replace loading message with actual response
-                const responseContent = response.data.message || 'I\'m not sure how to respond to that.';
-                loadingMessage.querySelector('.message-content').innerHTML = formatMessage(responseContent);
+                // Replace loading message with the complete response
+                const responseContent = data.message || responseText || 'I\'m not sure how to respond to that.';
+                contentElement.innerHTML = formatMessage(responseContent);
 
                 // Save conversation ID for future messages
-                if (response.data.conversation_id) {
-                    const newConversationId = response.data.conversation_id;
+                if (data.conversation_id) {
+                    const newConversationId = data.conversation_id;
                     const isNewConversation = !conversationId || parseInt(conversationId) !== newConversationId;
 
                     // Store conversation ID in localStorage
@@ -187,6 +318,11 @@ document.addEventListener('DOMContentLoaded', () => {
         localStorage.removeItem('conversation_id');
         localStorage.removeItem('currentlyViewingConversation');
 
+        // Forget the history cursor of the previous conversation
+        historyConversationId = null;
+        oldestMessageId = null;
+        hasMoreHistory = false;
+
         // Clear chat messages
         if (chatMessages) {
             chatMessages.innerHTML = '';
@@ -247,8 +383,11 @@ document.addEventListener('DOMContentLoaded', () => {
                 // Store that we're currently viewing this conversation
                 localStorage.setItem('currentlyViewingConversation', conversationId);
 
-                // Make API request to get conversation history
+                // Make API request to get the newest page of conversation history
                 const response = await axios.get(`${API_BASE_URL}/chat/history/${conversationId}`, {
+                    params: {
+                        limit: HISTORY_PAGE_SIZE
+                    },
                     headers: {
                         'Authorization': `Bearer ${token}`
                     }
@@ -271,6 +410,11 @@ document.addEventListener('DOMContentLoaded', () => {
                         chatMessages.appendChild(createMessageElement(msg.content, isUser));
                     });
 
+                    // Remember where the next (older) page starts
+                    historyConversationId = conversationId;
+                    oldestMessageId = response.data.messages[0].id;
+                    hasMoreHistory = response.data.has_more;
+
                     scrollToBottom();
                 } else {
                     console.log('No messages found for conversation ID:', conversationId);
@@ -309,7 +453,55 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     };
 
+    // Load the page of messages before the oldest one currently shown
+    const loadOlderMessages = async () => {
+        if (!hasMoreHistory || loadingOlderMessages || !historyConversationId) return;
+
+        const token = localStorage.getItem('token');
+        if (!token) return;
+
+        loadingOlderMessages = true;
+        try {
+            const response = await axios.get(`${API_BASE_URL}/chat/history/${historyConversationId}`, {
+                params: {
+                    limit: HISTORY_PAGE_SIZE,
+                    before: oldestMessageId
+                },
+                headers: {
+                    'Authorization': `Bearer ${token}`
+                }
+            });
+
+            const messages = response.data.messages || [];
+            if (messages.length > 0) {
+                // Prepend while keeping the current messages where they are on screen
+                const previousScrollHeight = chatMessages.scrollHeight;
+                const fragment = document.createDocumentFragment();
+                messages.forEach(msg => {
+                    fragment.appendChild(createMessageElement(msg.content, msg.role === 'user'));
+                });
+                chatMessages.insertBefore(fragment, chatMessages.firstChild);
+                chatMessages.scrollTop += chatMessages.scrollHeight - previousScrollHeight;
+
+                oldestMessageId = messages[0].id;
+            }
+            hasMoreHistory = response.data.has_more;
+        } catch (error) {
+            console.error('Error loading older messages:', error);
+        } finally {
+            loadingOlderMessages = false;
+        }
+    };
+
     // Event listeners
+    if (chatMessages) {
+        chatMessages.addEventListener('scroll', () => {
+            if (chatMessages.scrollTop < 100) {
+                loadOlderMessages();
+            }
+        });
+    }
+
     chatForm.addEventListener('submit', (e) => {
         e.preventDefault();
         sendMessage(e);
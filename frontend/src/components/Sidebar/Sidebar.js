@@ -1,5 +1,6 @@
 document.addEventListener('DOMContentLoaded', () => {
     const API_BASE_URL = 'http://localhost:8000/api/v1';
+    const LOGOUT_TIMEOUT_MS = 2000;
     const menuToggle = document.querySelector('.menu-toggle');
     const floatingMenuToggle = document.querySelector('.floating-menu-toggle');
     const sidebar = document.querySelector('.sidebar');
@@ -311,10 +312,28 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // Handle logout button click
     if (logoutBtn) {
-        logoutBtn.addEventListener('click', () => {
+        logoutBtn.addEventListener('click', async () => {
+            // Revoke the token server-side before leaving the page, which
+            // would abort the request; an unreachable server only delays
+            // the logout by the timeout
+            const token = localStorage.getItem('token');
             localStorage.removeItem('token');
             localStorage.removeItem('conversation_id');
-            window.location.href = 'login.html';
+            logoutBtn.disabled = true;
+            try {
+                if (token) {
+                    await axios.post(`${API_BASE_URL}/auth/logout`, null, {
+                        headers: {
+                            'Authorization': `Bearer ${token}`
+                        },
+                        timeout: LOGOUT_TIMEOUT_MS
+                    });
+                }
+            } catch (error) {
+                console.error('Error logging out:', error);
+            } finally {
+                window.location.href = 'login.html';
+            }
         });
     }
 